@@ -584,6 +584,10 @@ class ADAPI:
         if not await self.AD.state.entity_exists(namespace, entity):
             self.logger.warning("%s: Entity %s not found in namespace %s", self.name, entity, namespace)
 
+    def _check_priority(self, kwargs):
+        if "priority" in kwargs and kwargs["priority"] not in ("high", "normal", "low"):
+            raise ValueError("{}: Invalid callback priority: {}".format(self.name, kwargs["priority"]))
+
     @staticmethod
     def get_ad_version():
         """Returns a string with the current version of AppDaemon.
@@ -811,7 +815,7 @@ class ADAPI:
 
         """
         await self._check_entity(self._get_namespace(**kwargs), entity_id)
-        state = await self.get_state(**kwargs)
+        state = await self.get_state(copy=False, **kwargs)
         if entity_id in state:
             if "friendly_name" in state[entity_id]["attributes"]:
                 return state[entity_id]["attributes"]["friendly_name"]
@@ -1266,7 +1270,7 @@ class ADAPI:
                 state of the selected attribute (usually state) in the old state match the value
                 of ``old``.
 
-            duration (int, optional): If ``duration`` is supplied as a parameter, the callback will not
+            duration (float, optional): If ``duration`` is supplied as a parameter, the callback will not
                 fire unless the state listened for is maintained for that number of seconds. This
                 requires that a specific attribute is specified (or the default of ``state`` is used),
                 and should be used in conjunction with the ``old`` or ``new`` parameters, or both. When
@@ -1307,6 +1311,13 @@ class ADAPI:
             pin (bool, optional): If ``True``, the callback will be pinned to a particular thread.
             pin_thread (int, optional): Sets which thread from the worker pool the callback will be
                 run by (0 - number of threads -1).
+            priority (str, optional): Priority of the callback on its worker thread's queue, one of
+                ``high``, ``normal`` (the default) or ``low``. Queued ``high`` priority callbacks are run
+                ahead of the others, and are the last to be dropped if ``thread_queue_size`` is set.
+            coalesce (float, optional): If ``coalesce`` is supplied as a parameter, state changes of an
+                entity are collected for that number of seconds after the first one, and the callback is
+                then made once with the latest ``new`` value and the ``old`` value from before the first
+                change. This is useful for sensors that report several times a second.
             *kwargs (optional): Zero or more keyword arguments that will be supplied to the callback
                 when it is called.
 
@@ -1359,6 +1370,14 @@ class ADAPI:
 
             >>> self.handle = self.listen_state(self.my_callback, "light.office_1", new = "on", duration = 60, immediate = True)
 
+            Listen for motion and run the callback ahead of other queued callbacks.
+
+            >>> self.handle = self.listen_state(self.my_callback, "binary_sensor.hall_motion", new = "on", priority = "high")
+
+            Listen for changes of a power meter, at most once every half a second.
+
+            >>> self.handle = self.listen_state(self.my_callback, "sensor.house_power", coalesce = 0.5)
+
         """
         namespace = self._get_namespace(**kwargs)
         if "namespace" in kwargs:
@@ -1366,6 +1385,9 @@ class ADAPI:
         name = self.name
         if entity is not None and "." in entity:
             await self._check_entity(namespace, entity)
+        self._check_priority(kwargs)
+        if "coalesce" in kwargs and not (isinstance(kwargs["coalesce"], (int, float)) and kwargs["coalesce"] > 0):
+            raise ValueError("{}: Invalid coalesce window: {}".format(self.name, kwargs["coalesce"]))
 
         self.logger.debug("Calling listen_state for %s", self.name)
         return await self.AD.state.add_state_callback(name, namespace, entity, callback, kwargs)
@@ -1431,12 +1453,12 @@ class ADAPI:
                 dictionary for the specified entity rather than an individual attribute value.
             default (any, optional): The value to return when the requested attribute or the
                 whole entity doesn't exist (Default: ``None``).
-            copy (bool, optional): By default, a copy of the stored state object is returned.
-                When you set ``copy`` to ``False``, you get the same object as is stored
-                internally by AppDaemon. Avoiding the copying brings a small performance gain,
-                but also gives you write-access to the internal AppDaemon data structures,
-                which is dangerous. Only disable copying when you can guarantee not to modify
-                the returned state object, e.g., you do read-only operations.
+            copy (bool, optional): By default, a modifiable copy of the stored state object is
+                returned. The copy shares the stored state, and each part of it is only copied when it
+                is first read, so it is cheap even for a whole namespace. When you set ``copy`` to
+                ``False``, you get the same object as is stored internally by AppDaemon, without any
+                copying at all. Entity states are read-only, so trying to modify them will raise a
+                ``TypeError``; the dictionary of a whole namespace is not, and must not be modified.
             **kwargs (optional): Zero or more keyword arguments.
 
         Keyword Args:
@@ -1663,6 +1685,53 @@ class ADAPI:
 
         return await self.AD.services.call_service(namespace, d, s, kwargs)
 
+    @utils.sync_wrapper
+    async def call_services_batch(self, calls, **kwargs):
+        """Calls several Services within AppDaemon at once.
+
+        All of the calls are handed to AppDaemon in a single step and are then made concurrently, which is
+        considerably faster than calling `call_service()` in a loop when an App needs to act on many entities,
+        e.g., setting a scene across a large number of lights.
+
+        Args:
+            calls (list): A list of service calls. Each entry is a dictionary with a ``service`` key,
+                in the format `domain/service`, and any parameters the service requires. An entry may also
+                include a ``namespace`` key to override the namespace for that call.
+            **kwargs (optional): Zero or more keyword arguments.
+
+        Keyword Args:
+            namespace(str, optional): If a `namespace` is provided, AppDaemon will make the calls in the
+                given namespace. On the other hand, if no namespace is given, AppDaemon will use the last
+                specified namespace or the default namespace. See the section on `namespaces <APPGUIDE.html#namespaces>`__
+                for a detailed description. In most cases, it is safe to ignore this parameter.
+
+        Returns:
+            A list with the result of each service call, in the same order as `calls`.
+
+        Examples:
+            >>> self.call_services_batch([
+            >>>     {"service": "light/turn_on", "entity_id": "light.office_1", "brightness": 50},
+            >>>     {"service": "light/turn_on", "entity_id": "light.office_2", "brightness": 50},
+            >>>     {"service": "switch/turn_off", "entity_id": "switch.fan"},
+            >>> ])
+
+        """
+        namespace = self._get_namespace(**kwargs)
+
+        batch = []
+        for call in calls:
+            data = dict(call)
+            service = data.pop("service")
+            self._check_service(service)
+            d, s = service.split("/")
+            ns = data.pop("namespace", namespace)
+            data["__name"] = self.name
+            batch.append((ns, d, s, data))
+
+        self.logger.debug("call_services_batch: %s calls", len(batch))
+
+        return await self.AD.services.call_services_batch(batch)
+
     @utils.sync_wrapper
     async def run_sequence(self, sequence, **kwargs):
         """Run an AppDaemon Sequence. Sequences are defined in a valid apps.yaml file or inline, and are sequences of
@@ -1794,6 +1863,8 @@ class ADAPI:
         if "namespace" in kwargs:
             del kwargs["namespace"]
 
+        self._check_priority(kwargs)
+
         _name = self.name
         self.logger.debug("Calling listen_event for %s", self.name)
         return await self.AD.events.add_event_callback(_name, namespace, callback, event, **kwargs)
@@ -2103,6 +2174,56 @@ class ADAPI:
         """
         return await self.AD.sched.sunset(aware)
 
+    @utils.sync_wrapper
+    async def dawn(self, aware=False):
+        """Returns a `datetime` object that represents the next time Dawn will occur.
+
+        Dawn is when the sun is 6 degrees below the horizon in the morning (civil dawn).
+
+        Args:
+            aware (bool, optional): Specifies if the created datetime object will be
+                `aware` of timezone or `not`.
+
+        Examples:
+            >>> self.dawn()
+            2019-08-16 04:59:03
+
+        """
+        return await self.AD.sched.sun_event("dawn", aware)
+
+    @utils.sync_wrapper
+    async def dusk(self, aware=False):
+        """Returns a `datetime` object that represents the next time Dusk will occur.
+
+        Dusk is when the sun is 6 degrees below the horizon in the evening (civil dusk).
+
+        Args:
+            aware (bool, optional): Specifies if the created datetime object will be
+                `aware` of timezone or `not`.
+
+        Examples:
+            >>> self.dusk()
+            2019-08-16 20:23:01
+
+        """
+        return await self.AD.sched.sun_event("dusk", aware)
+
+    @utils.sync_wrapper
+    async def solar_noon(self, aware=False):
+        """Returns a `datetime` object that represents the next time Solar Noon will occur,
+        when the sun is at its highest point.
+
+        Args:
+            aware (bool, optional): Specifies if the created datetime object will be
+                `aware` of timezone or `not`.
+
+        Examples:
+            >>> self.solar_noon()
+            2019-08-16 12:41:02
+
+        """
+        return await self.AD.sched.sun_event("solar_noon", aware)
+
     @utils.sync_wrapper
     async def time(self):
         """Returns a localised `time` object representing the current Local Time.
@@ -2216,7 +2337,8 @@ class ADAPI:
             callback: Function to be invoked when the requested state change occurs.
                 It must conform to the standard Scheduler Callback format documented
                 `here <APPGUIDE.html#about-schedule-callbacks>`__.
-            delay (int): Delay, in seconds before the callback is invoked.
+            delay (float): Delay, in seconds before the callback is invoked. Fractions of a second are
+                supported, down to a millisecond.
             **kwargs (optional): Zero or more keyword arguments.
 
         Keyword Args:
@@ -2245,12 +2367,17 @@ class ADAPI:
 
             >>> self.handle = self.run_in(self.run_in_c, 5, title = "run_in5")
 
+            Run the specified callback after a quarter of a second.
+
+            >>> self.handle = self.run_in(self.run_in_c, 0.25)
+
         """
         name = self.name
         self.logger.debug("Registering run_in in %s seconds for %s", delay, name)
-        # convert seconds to an int if possible since a common pattern is to
+        # convert seconds to a float if possible since a common pattern is to
         # pass this through from the config file which is a string
-        exec_time = await self.get_now() + timedelta(seconds=int(delay))
+        exec_time = await self.get_now() + timedelta(seconds=float(delay))
+        self._check_priority(kwargs)
         handle = await self.AD.sched.insert_schedule(name, exec_time, callback, False, None, **kwargs)
 
         return handle
@@ -2323,6 +2450,7 @@ class ADAPI:
         if aware_event < now:
             one_day = datetime.timedelta(days=1)
             aware_event = aware_event + one_day
+        self._check_priority(kwargs)
         handle = await self.AD.sched.insert_schedule(name, aware_event, callback, False, None, **kwargs)
         return handle
 
@@ -2397,6 +2525,7 @@ class ADAPI:
         now = await self.get_now()
         if aware_when < now:
             raise ValueError("{}: run_at() Start time must be " "in the future".format(self.name))
+        self._check_priority(kwargs)
         handle = await self.AD.sched.insert_schedule(name, aware_when, callback, False, None, **kwargs)
         return handle
 
@@ -2592,6 +2721,7 @@ class ADAPI:
                 will occur, or can take the `now` string alongside an added offset. If given
                 in the past, it will be executed in the next interval time.
             interval: Frequency (expressed in seconds) in which the callback should be executed.
+                Fractions of a second are supported, down to a millisecond. Must be greater than zero.
             **kwargs: Arbitrary keyword parameters to be provided to the callback
                 function when it is invoked.
 
@@ -2624,6 +2754,10 @@ class ADAPI:
 
             >>> self.run_every(self.run_every_c, "now+5", 5 * 60)
 
+            Run every half a second starting now.
+
+            >>> self.run_every(self.run_every_c, "now", 0.5)
+
         """
         name = self.name
         now = await self.get_now()
@@ -2631,7 +2765,7 @@ class ADAPI:
         if isinstance(start, str) and "now" in start:  # meaning immediate time required
             now_offset = 0
             if "+" in start:  # meaning time to be added
-                now_offset = int(re.findall(r"\d+", start)[0])
+                now_offset = float(re.findall(r"\d+(?:\.\d+)?", start)[0])
 
             aware_start = await self.get_now()
             aware_start = aware_start + datetime.timedelta(seconds=now_offset)
@@ -2646,6 +2780,7 @@ class ADAPI:
             "Registering run_every starting %s in %ss intervals for %s", aware_start, interval, name,
         )
 
+        self._check_priority(kwargs)
         handle = await self.AD.sched.insert_schedule(
             name, aware_start, callback, True, None, interval=interval, **kwargs
         )
@@ -2659,6 +2794,7 @@ class ADAPI:
         else:
             event = self.AD.sched.next_sunset()
 
+        self._check_priority(kwargs)
         handle = await self.AD.sched.insert_schedule(name, event, callback, True, type_, **kwargs)
         return handle
 
@@ -15,6 +15,12 @@ class AdminLoop:
 
     async def loop(self):
         while not self.stopping:
+            if self.AD.threading is not None:
+                await self.AD.threading.update_admin_stats()
+
+            if self.AD.http.stream is not None:
+                await self.AD.http.stream.update_admin_stats()
+
             if self.AD.http.stats_update != "none" and self.AD.sched is not None:
                 await self.AD.threading.get_callback_update()
                 await self.AD.threading.get_q_update()
@@ -15,6 +15,7 @@ from collections import OrderedDict
 
 import appdaemon.utils as utils
 from appdaemon.appdaemon import AppDaemon
+from appdaemon.app_process import AppProcess
 
 
 class AppManagement:
@@ -152,7 +153,11 @@ class AppManagement:
 
         # Call its initialize function
         try:
-            if asyncio.iscoroutinefunction(init):
+            if "process" in self.objects[name]:
+                process = self.objects[name]["process"]
+                await utils.run_in_executor(self, process.start)
+                await utils.run_in_executor(self, process.call, "initialize")
+            elif asyncio.iscoroutinefunction(init):
                 await init()
             else:
                 await utils.run_in_executor(self, init)
@@ -179,6 +184,10 @@ class AppManagement:
 
     async def terminate_app(self, name, delete=True):
         term = None
+        process = None
+        if name in self.objects and "process" in self.objects[name]:
+            process = self.objects[name]["process"]
+
         if name in self.objects and hasattr(self.objects[name]["object"], "terminate"):
             self.logger.info("Calling terminate() for {}".format(name))
 
@@ -188,7 +197,9 @@ class AppManagement:
 
         if term is not None:
             try:
-                if asyncio.iscoroutinefunction(term):
+                if process is not None:
+                    await utils.run_in_executor(self, process.call, "terminate")
+                elif asyncio.iscoroutinefunction(term):
                     await term()
                 else:
                     await utils.run_in_executor(self, term)
@@ -207,6 +218,16 @@ class AppManagement:
                         "Logged an error to %s", self.AD.logging.get_filename("error_log"),
                     )
 
+        # Nothing must be dispatched to the app once its worker process is gone
+        await self.AD.callbacks.clear_callbacks(name)
+
+        self.AD.futures.cancel_futures(name)
+
+        await self.AD.sched.terminate_app(name)
+
+        if process is not None:
+            await utils.run_in_executor(self, process.stop)
+
         if delete:
             if name in self.objects:
                 del self.objects[name]
@@ -216,12 +237,6 @@ class AppManagement:
 
         await self.increase_inactive_apps(name)
 
-        await self.AD.callbacks.clear_callbacks(name)
-
-        self.AD.futures.cancel_futures(name)
-
-        await self.AD.sched.terminate_app(name)
-
         await self.set_state(name, state="terminated")
         await self.set_state(name, instancecallbacks=0)
 
@@ -290,6 +305,15 @@ class AppManagement:
             else:
                 pin = -1
 
+            execution = app_args.get("execution", "thread")
+            if execution not in ("thread", "process"):
+                self.logger.warning(
+                    "Invalid execution mode ({}) in app definition for {} - app will be discarded".format(
+                        execution, name
+                    )
+                )
+                return
+
             modname = await utils.run_in_executor(self, __import__, app_args["module"])
             app_class = getattr(modname, app_args["class"], None)
             if app_class is None:
@@ -312,6 +336,9 @@ class AppManagement:
                     "pin_thread": pin,
                 }
 
+                if execution == "process":
+                    self.objects[name]["process"] = AppProcess(self.AD, name, self.objects[name]["object"], app_args)
+
         else:
             self.logger.warning(
                 "Unable to find module module %s - '%s' is not initialized", app_args["module"], name,
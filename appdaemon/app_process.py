@@ -0,0 +1,312 @@
+from collections import deque
+import concurrent.futures
+import importlib
+import inspect
+import itertools
+import logging
+import multiprocessing
+import pickle
+import sys
+import threading
+import traceback
+
+from appdaemon.appdaemon import AppDaemon
+
+#
+# Plain attributes of the app object that are copied into the worker process
+#
+APP_ATTRIBUTES = ("name", "config", "app_config", "args", "app_dir", "config_dir", "dashboard_dir")
+
+
+class AppProcessError(Exception):
+    pass
+
+
+class CallbackRef:
+    """Stands in for a method of the app when it is passed to an API call from the worker process"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+class AppProcess:
+
+    """
+    Runs the callbacks of an app configured with ``execution: process`` in a dedicated worker process.
+
+    The app object created by AppDaemon stays in the main process and registers the callbacks as usual, but each
+    callback is a stub that sends the call over a pipe to the copy of the app in the worker process and waits for it
+    to complete. API calls made by the app in the worker process come back over the same pipe and are run against
+    the app object in the main process.
+    """
+
+    def __init__(self, ad: AppDaemon, name, app, app_args):
+
+        self.AD = ad
+        self.name = name
+        self.app = app
+        self.app_args = app_args
+        self.logger = ad.logging.get_child("_app_process")
+
+        self.process = None
+        self.conn = None
+        self.reader = None
+        self.send_lock = threading.Lock()
+        self.request_ids = itertools.count()
+        self.pending = {}
+        self.callbacks = {}
+
+    def start(self):
+        app = self.app
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=run_app_process,
+            args=(
+                child_conn,
+                list(sys.path),
+                self.app_args["module"],
+                self.app_args["class"],
+                {attr: getattr(app, attr, None) for attr in APP_ATTRIBUTES},
+                {"logger": app.logger.getEffectiveLevel(), "err": app.err.getEffectiveLevel()},
+            ),
+            name="AppDaemon-{}".format(self.name),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+        self.reader = threading.Thread(target=self.read, name="process-{}".format(self.name), daemon=True)
+        self.reader.start()
+        self.logger.info("Started worker process %s for app %s", self.process.pid, self.name)
+
+    def stop(self):
+        if self.process is None:
+            return
+
+        try:
+            self.send(("stop",))
+        except (OSError, ValueError):
+            pass
+
+        self.process.join(5)
+        if self.process.is_alive():
+            self.logger.warning("Worker process for app %s did not stop - terminating it", self.name)
+            self.process.terminate()
+            self.process.join()
+
+        self.conn.close()
+        self.logger.info("Stopped worker process for app %s", self.name)
+        self.process = None
+
+    def send(self, message):
+        with self.send_lock:
+            self.conn.send(message)
+
+    def call(self, method, *args, **kwargs):
+        if self.process is None or not self.process.is_alive():
+            raise AppProcessError("Worker process for app {} is not running".format(self.name))
+
+        request_id = next(self.request_ids)
+        future = concurrent.futures.Future()
+        self.pending[request_id] = future
+        try:
+            self.send(("callback", request_id, method, args, kwargs))
+        except Exception:
+            del self.pending[request_id]
+            raise
+
+        return future.result()
+
+    def get_callback(self, method):
+        #
+        # One stub per method so a callback registered twice looks the same to AppDaemon both times
+        #
+        if method not in self.callbacks:
+
+            def callback(*args, **kwargs):
+                return self.call(method, *args, **kwargs)
+
+            callback.__name__ = method
+            self.callbacks[method] = callback
+
+        return self.callbacks[method]
+
+    def decode(self, value):
+        if isinstance(value, CallbackRef):
+            return self.get_callback(value.name)
+        return value
+
+    def read(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if message[0] == "done":
+                _, request_id, ok, result = message
+                future = self.pending.pop(request_id, None)
+                if future is not None:
+                    if ok is True:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(AppProcessError(result))
+
+            elif message[0] == "api":
+                #
+                # API calls can wait on the loop, and on callbacks in this app, so they run in the executor
+                # to keep the pipe serviced
+                #
+                self.AD.executor.submit(self.run_api_call, *message[1:])
+
+            elif message[0] == "log":
+                _, logger, level, msg = message
+                getattr(self.app, logger).log(level, msg)
+
+        for future in self.pending.values():
+            future.set_exception(AppProcessError("Worker process for app {} has exited".format(self.name)))
+        self.pending = {}
+
+    def run_api_call(self, request_id, method, args, kwargs):
+        try:
+            args = [self.decode(arg) for arg in args]
+            kwargs = {key: self.decode(value) for key, value in kwargs.items()}
+            result = getattr(self.app, method)(*args, **kwargs)
+        except Exception as e:
+            self.reply(request_id, False, e)
+            return
+
+        self.reply(request_id, True, result)
+
+    def reply(self, request_id, ok, result):
+        try:
+            self.send(("result", request_id, ok, result))
+        except (OSError, ValueError):
+            # Worker process has gone away
+            pass
+        except Exception as e:
+            # The message is pickled before anything is written, so the pipe is still usable
+            if ok is True:
+                error = TypeError("Unable to return {!r} to the app process: {}".format(result, e))
+            else:
+                error = AppProcessError("{}: {}".format(type(result).__name__, result))
+            self.send(("result", request_id, False, error))
+
+
+#
+# Worker process side
+#
+
+
+class PipeLogHandler(logging.Handler):
+    def __init__(self, client, logger):
+        super().__init__()
+        self.client = client
+        self.logger = logger
+
+    def emit(self, record):
+        try:
+            self.client.send(("log", self.logger, record.levelno, self.format(record)))
+        except Exception:
+            self.handleError(record)
+
+
+class AppProcessClient:
+    def __init__(self, conn, app):
+        self.conn = conn
+        self.app = app
+        self.request_ids = itertools.count()
+        self.backlog = deque()
+        self.stopping = False
+
+    def send(self, message):
+        self.conn.send(message)
+
+    def encode(self, value):
+        if inspect.ismethod(value) and value.__self__ is self.app:
+            return CallbackRef(value.__name__)
+        return value
+
+    def request(self, method, args, kwargs):
+        request_id = next(self.request_ids)
+        args = [self.encode(arg) for arg in args]
+        kwargs = {key: self.encode(value) for key, value in kwargs.items()}
+        try:
+            self.send(("api", request_id, method, args, kwargs))
+        except (pickle.PicklingError, TypeError, AttributeError, ValueError) as e:
+            raise TypeError("Arguments to {}() cannot be sent to the main process: {}".format(method, e))
+
+        while True:
+            message = self.conn.recv()
+            if message[0] == "result" and message[1] == request_id:
+                _, _, ok, result = message
+                if ok is True:
+                    return result
+                raise result
+            else:
+                # Callbacks run one at a time, so anything arriving while we wait is run afterwards
+                self.backlog.append(message)
+
+    def forward(self, method):
+        def api_call(*args, **kwargs):
+            return self.request(method, args, kwargs)
+
+        api_call.__name__ = method
+        return api_call
+
+    def serve(self):
+        while not self.stopping:
+            if self.backlog:
+                message = self.backlog.popleft()
+            else:
+                try:
+                    message = self.conn.recv()
+                except EOFError:
+                    break
+
+            if message[0] == "stop":
+                self.stopping = True
+
+            elif message[0] == "callback":
+                _, request_id, method, args, kwargs = message
+                try:
+                    result = getattr(self.app, method)(*args, **kwargs)
+                    if inspect.iscoroutine(result):
+                        result.close()
+                        raise TypeError("async callbacks are not supported for apps using execution: process")
+                    self.send(("done", request_id, True, None))
+                except Exception:
+                    self.send(("done", request_id, False, traceback.format_exc()))
+
+
+def run_app_process(conn, path, module, class_name, attributes, log_levels):
+    sys.path = path
+    app_class = getattr(importlib.import_module(module), class_name)
+
+    #
+    # The app is created without running its __init__() as the AppDaemon internals it needs stay in the
+    # main process. Its own attributes are copied across, and the methods it inherits from the AppDaemon
+    # API are replaced with ones that forward the call to the main process.
+    #
+    app = app_class.__new__(app_class)
+    client = AppProcessClient(conn, app)
+
+    for attr, value in attributes.items():
+        setattr(app, attr, value)
+
+    for method in dir(app_class):
+        if method.startswith("_"):
+            continue
+        owner = next(klass for klass in app_class.__mro__ if method in klass.__dict__)
+        if owner.__module__.startswith("appdaemon.") and inspect.isfunction(owner.__dict__[method]):
+            setattr(app, method, client.forward(method))
+
+    for attr, level in log_levels.items():
+        logger = logging.getLogger("{}.{}".format(attr, attributes["name"]))
+        logger.setLevel(level)
+        logger.propagate = False
+        logger.addHandler(PipeLogHandler(client, attr))
+        setattr(app, attr, logger)
+
+    client.serve()
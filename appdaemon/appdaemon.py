@@ -65,6 +65,15 @@ class AppDaemon:
         self.load_distribution = "roundrobbin"
         utils.process_arg(self, "load_distribution", kwargs)
 
+        self.thread_queue_size = 0
+        utils.process_arg(self, "thread_queue_size", kwargs, int=True)
+
+        self.thread_queue_overflow = "block"
+        utils.process_arg(self, "thread_queue_overflow", kwargs)
+
+        self.coalesce_states = {}
+        utils.process_arg(self, "coalesce_states", kwargs)
+
         self.app_dir = None
         utils.process_arg(self, "app_dir", kwargs)
 
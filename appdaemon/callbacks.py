@@ -3,6 +3,11 @@ import asyncio
 import appdaemon.utils as utils
 from appdaemon.appdaemon import AppDaemon
 
+#
+# Event data fields that event callbacks are indexed by when they filter on them, in order of preference
+#
+TOPIC_FIELDS = ("topic", "wildcard")
+
 
 class Callbacks:
     def __init__(self, ad: AppDaemon):
@@ -11,6 +16,22 @@ class Callbacks:
 
         self.callbacks = {}
         self.callbacks_lock = asyncio.Lock()
+
+        #
+        # Callback indexes, all of the form namespace -> key -> {handle: name}
+        #
+        # State callbacks are keyed by (domain, entity) - (None, None) holds callbacks for all entities and
+        # (domain, None) those for a whole domain
+        self.state_index = {}
+        # Event callbacks are keyed by event type, with None holding the wildcard listeners
+        self.event_index = {}
+        # Event callbacks filtering on an MQTT topic or wildcard are keyed by (event type, field, value) instead,
+        # so a message only visits the callbacks for its own topic
+        self.topic_index = {}
+        # Log callbacks are keyed by log level
+        self.log_index = {}
+        # Number of log and __AD_LOG_EVENT callbacks per app, used for log loop avoidance
+        self.log_callback_counts = {}
         self.logger = ad.logging.get_child("_callbacks")
         self.diag = ad.logging.get_diag()
 
@@ -73,6 +94,7 @@ class Callbacks:
         async with self.callbacks_lock:
             if name in self.callbacks:
                 for cid in self.callbacks[name]:
+                    self.unindex_callback(cid, self.callbacks[name][cid])
                     if self.callbacks[name][cid]["type"] == "event":
                         await self.AD.state.remove_entity("admin", "event_callback.{}".format(cid))
                     if self.callbacks[name][cid]["type"] == "state":
@@ -80,3 +102,139 @@ class Callbacks:
                     if self.callbacks[name][cid]["type"] == "log":
                         await self.AD.state.remove_entity("admin", "log_callback.{}".format(cid))
                 del self.callbacks[name]
+
+    #
+    # Callback indexes - callers must hold callbacks_lock
+    #
+
+    @staticmethod
+    def state_index_key(entity):
+        if entity is None:
+            return None, None
+        elif "." not in entity:
+            return entity, None
+        else:
+            device, entity = entity.split(".", 1)
+            return device, entity
+
+    @staticmethod
+    def topic_filter(kwargs):
+        # The first of the topic fields the callback filters on, if any
+        for field in TOPIC_FIELDS:
+            if isinstance(kwargs.get(field), str):
+                return field
+        return None
+
+    def get_index(self, callback):
+        if callback["type"] == "state":
+            return self.state_index, self.state_index_key(callback["entity"])
+        elif callback["type"] == "event":
+            field = self.topic_filter(callback["kwargs"])
+            if field is not None:
+                return self.topic_index, (callback["event"], field, callback["kwargs"][field])
+            return self.event_index, callback["event"]
+        elif callback["type"] == "log":
+            return self.log_index, callback["kwargs"]["level"]
+        else:
+            return None, None
+
+    @staticmethod
+    def is_log_callback(callback):
+        return callback["type"] == "log" or (callback["type"] == "event" and callback["event"] == "__AD_LOG_EVENT")
+
+    def index_callback(self, handle, callback):
+        index, key = self.get_index(callback)
+        if index is None:
+            return
+
+        index.setdefault(callback["namespace"], {}).setdefault(key, {})[handle] = callback["name"]
+
+        if self.is_log_callback(callback):
+            name = callback["name"]
+            self.log_callback_counts[name] = self.log_callback_counts.get(name, 0) + 1
+
+    def unindex_callback(self, handle, callback):
+        index, key = self.get_index(callback)
+        if index is None:
+            return
+
+        namespace = callback["namespace"]
+        if namespace in index and key in index[namespace]:
+            index[namespace][key].pop(handle, None)
+            if index[namespace][key] == {}:
+                del index[namespace][key]
+            if index[namespace] == {}:
+                del index[namespace]
+
+        if self.is_log_callback(callback):
+            name = callback["name"]
+            self.log_callback_counts[name] = self.log_callback_counts.get(name, 1) - 1
+            if self.log_callback_counts[name] <= 0:
+                del self.log_callback_counts[name]
+
+    @staticmethod
+    def lookup_namespaces(index, namespace):
+        # Callbacks in the global namespace see all namespaces, and all callbacks see the global namespace
+        if namespace == "global":
+            return list(index.keys())
+        else:
+            return [namespace, "global"]
+
+    @staticmethod
+    def lookup_index(index, namespace, keys):
+        """Returns a list of (name, handle) tuples for the indexed callbacks matching namespace and any of keys"""
+
+        matches = []
+        for ns in Callbacks.lookup_namespaces(index, namespace):
+            if ns not in index:
+                continue
+            for key in keys:
+                if key in index[ns]:
+                    matches.extend((name, handle) for handle, name in index[ns][key].items())
+
+        return matches
+
+    def get_state_callbacks(self, namespace, entity_id):
+        device, entity = entity_id.split(".", 1)
+        return self.lookup_index(self.state_index, namespace, ((None, None), (device, None), (device, entity)))
+
+    def get_event_callbacks(self, namespace, event, data):
+        # Global listens don't get to see system events (events that start with __)
+        if event[:2] == "__":
+            events = (event,)
+        else:
+            events = (None, event)
+
+        matches = self.lookup_index(self.event_index, namespace, events)
+        if self.topic_index:
+            matches.extend(self.lookup_index(self.topic_index, namespace, self.topic_keys(namespace, events, data)))
+        return matches
+
+    def topic_keys(self, namespace, events, data):
+        """Returns the topic index keys of the callbacks whose topic filter can match the event data"""
+
+        keys = []
+        for field in TOPIC_FIELDS:
+            if field in data:
+                if isinstance(data[field], str):
+                    keys.extend((event, field, data[field]) for event in events)
+            else:
+                #
+                # Filters on fields the event doesn't have are ignored, so all the callbacks filtering on this field
+                # match. Only the keys of callbacks filtering on a topic are visited to find them
+                #
+                keys.extend(
+                    {
+                        key
+                        for ns in self.lookup_namespaces(self.topic_index, namespace)
+                        for key in self.topic_index.get(ns, {})
+                        if key[0] in events and key[1] == field
+                    }
+                )
+        return keys
+
+    def get_log_callbacks(self, namespace, level):
+        return self.lookup_index(self.log_index, namespace, (level,))
+
+    def has_log_callback(self, name):
+        return name in self.log_callback_counts
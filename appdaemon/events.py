@@ -1,7 +1,7 @@
 """Module to handle all events within AppDaemon."""
 
 import uuid
-from copy import deepcopy
+import asyncio
 import traceback
 import datetime
 
@@ -21,6 +21,19 @@ class Events:
 
         self.AD = ad
         self.logger = ad.logging.get_child("_events")
+
+        #
+        # Coalescing windows for state changes, by entity or domain
+        #
+        self.coalesce_windows = {}
+        for entity, window in (ad.coalesce_states or {}).items():
+            if isinstance(window, (int, float)) and not isinstance(window, bool) and window > 0:
+                self.coalesce_windows[entity] = window
+            else:
+                self.logger.warning("Invalid coalesce_states window for %s: %s - ignoring", entity, window)
+
+        # State changes waiting for the end of their coalescing window, by namespace and entity
+        self.coalescing = {}
         #
         # Events
         #
@@ -67,6 +80,7 @@ class Events:
                     "pin_thread": pin_thread,
                     "kwargs": kwargs,
                 }
+                self.AD.callbacks.index_callback(handle, self.AD.callbacks.callbacks[name][handle])
 
             if "timeout" in kwargs:
                 exec_time = await self.AD.sched.get_now() + datetime.timedelta(seconds=int(kwargs["timeout"]))
@@ -108,6 +122,7 @@ class Events:
 
         async with self.AD.callbacks.callbacks_lock:
             if name in self.AD.callbacks.callbacks and handle in self.AD.callbacks.callbacks[name]:
+                self.AD.callbacks.unindex_callback(handle, self.AD.callbacks.callbacks[name][handle])
                 del self.AD.callbacks.callbacks[name][handle]
                 await self.AD.state.remove_entity("admin", "event_callback.{}".format(handle))
             if name in self.AD.callbacks.callbacks and self.AD.callbacks.callbacks[name] == {}:
@@ -160,12 +175,14 @@ class Events:
             # Just fire the event locally
             await self.AD.events.process_event(namespace, {"event_type": event, "data": kwargs})
 
-    async def process_event(self, namespace, data):
+    async def process_event(self, namespace, data, coalesced=False):
         """Processes an event that has been received either locally or from a plugin.
 
         Args:
             namespace (str): Namespace the event was fired in.
             data: Data associated with the event.
+            coalesced (bool, optional): ``True`` for a state change that has already been held back for its
+                coalescing window.
 
         Returns:
             None.
@@ -192,8 +209,14 @@ class Events:
 
                     entity_id = data["data"]["entity_id"]
 
+                    # Freeze the new state once, for both the stored state and the callbacks
+                    data["data"]["new_state"] = utils.freeze(data["data"]["new_state"])
                     self.AD.state.set_state_simple(namespace, entity_id, data["data"]["new_state"])
 
+                    if coalesced is False and namespace != "admin" and self.coalesce_state_change(namespace, data):
+                        # The state is kept up to date, but the change is only dispatched at the end of the window
+                        return
+
                     if self.AD.apps is True and namespace != "admin":
                         await self.AD.state.process_state_callbacks(namespace, data)
                 else:
@@ -224,13 +247,13 @@ class Events:
                         # Nothing changed so don't send
                         return
 
-                # take a copy without TS if present as it breaks deepcopy and jason
+                #
+                # The stream encodes the event before anything else gets to run, so it only needs a shallow copy
+                # to add the namespace to, without TS if present as it breaks jason
+                #
+                mydata = dict(data)
                 if "ts" in data["data"]:
-                    ts = data["data"].pop("ts")
-                    mydata = deepcopy(data)
-                    data["data"]["ts"] = ts
-                else:
-                    mydata = deepcopy(data)
+                    mydata["data"] = {key: value for key, value in data["data"].items() if key != "ts"}
 
                 await self.AD.http.stream_update(namespace, mydata)
 
@@ -241,6 +264,37 @@ class Events:
             self.logger.warning(traceback.format_exc())
             self.logger.warning("-" * 60)
 
+    def coalesce_state_change(self, namespace, data):
+        """Holds back a state change if its entity has a coalescing window.
+
+        Only the latest change in the window is dispatched, carrying the ``old_state`` of the first one.
+
+        Returns:
+            ``True`` if the change was held back, ``False`` if it should be dispatched now.
+
+        """
+
+        entity_id = data["data"]["entity_id"]
+        key = (namespace, entity_id)
+
+        if key in self.coalescing:
+            data["data"]["old_state"] = self.coalescing[key]["data"]["old_state"]
+            self.coalescing[key] = data
+            return True
+
+        window = self.coalesce_windows.get(entity_id, self.coalesce_windows.get(entity_id.split(".", 1)[0]))
+        if window is None:
+            return False
+
+        self.coalescing[key] = data
+        self.AD.loop.create_task(self.end_coalescing(namespace, entity_id, window))
+        return True
+
+    async def end_coalescing(self, namespace, entity_id, window):
+        await asyncio.sleep(window)
+        data = self.coalescing.pop((namespace, entity_id))
+        await self.process_event(namespace, data, coalesced=True)
+
     async def has_log_callback(self, name):
         """Returns ``True`` if the app has a log callback, ``False`` otherwise.
 
@@ -252,20 +306,11 @@ class Events:
 
         """
 
-        has_log_callback = False
         if name == "AppDaemon._stream":
-            has_log_callback = True
-        else:
-            async with self.AD.callbacks.callbacks_lock:
-                for callback in self.AD.callbacks.callbacks:
-                    for _uuid in self.AD.callbacks.callbacks[callback]:
-                        cb = self.AD.callbacks.callbacks[callback][_uuid]
-                        if cb["name"] == name and cb["type"] == "event" and cb["event"] == "__AD_LOG_EVENT":
-                            has_log_callback = True
-                        elif cb["name"] == name and cb["type"] == "log":
-                            has_log_callback = True
+            return True
 
-        return has_log_callback
+        # Per app counter maintained as callbacks are added and removed, so there is no need to scan or lock
+        return self.AD.callbacks.has_log_callback(name)
 
     async def process_event_callbacks(self, namespace, data):
         """Processes a pure event callback.
@@ -285,58 +330,58 @@ class Events:
         self.logger.debug("process_event_callbacks() %s %s", namespace, data)
 
         removes = []
+        dispatches = []
+        event_data = None
         async with self.AD.callbacks.callbacks_lock:
-            for name in self.AD.callbacks.callbacks.keys():
-                for uuid_ in self.AD.callbacks.callbacks[name]:
-                    callback = self.AD.callbacks.callbacks[name][uuid_]
-                    if callback["namespace"] == namespace or callback["namespace"] == "global" or namespace == "global":
-                        #
-                        # Check for either a blank event (for all events)
-                        # Or the event is a match
-                        # But don't allow a global listen for any system events (events that start with __)
-                        #
-                        if "event" in callback and (
-                            (callback["event"] is None and data["event_type"][:2] != "__")
-                            or data["event_type"] == callback["event"]
-                        ):
-
-                            # Check any filters
-
-                            _run = True
-                            for key in callback["kwargs"]:
-                                if key in data["data"] and callback["kwargs"][key] != data["data"][key]:
-                                    _run = False
-
-                            if data["event_type"] == "__AD_LOG_EVENT":
-                                if (
-                                    "log" in callback["kwargs"]
-                                    and callback["kwargs"]["log"] != data["data"]["log_type"]
-                                ):
-                                    _run = False
-
-                            if _run:
-                                if name in self.AD.app_management.objects:
-                                    executed = await self.AD.threading.dispatch_worker(
-                                        name,
-                                        {
-                                            "id": uuid_,
-                                            "name": name,
-                                            "objectid": self.AD.app_management.objects[name]["id"],
-                                            "type": "event",
-                                            "event": data["event_type"],
-                                            "function": callback["function"],
-                                            "data": data["data"],
-                                            "pin_app": callback["pin_app"],
-                                            "pin_thread": callback["pin_thread"],
-                                            "kwargs": callback["kwargs"],
-                                        },
-                                    )
-
-                                    # Remove the callback if appropriate
-                                    if executed is True:
-                                        remove = callback["kwargs"].get("oneshot", False)
-                                        if remove is True:
-                                            removes.append({"name": name, "uuid": uuid_})
+            #
+            # The index only returns callbacks listening for this event type, or for all events if this isn't a
+            # system event (events that start with __)
+            #
+            for name, uuid_ in self.AD.callbacks.get_event_callbacks(namespace, data["event_type"], data["data"]):
+                callback = self.AD.callbacks.callbacks[name][uuid_]
+
+                # Check any filters
+
+                _run = True
+                for key in callback["kwargs"]:
+                    # priority is how the callback is queued, not a filter on the event data
+                    if key != "priority" and key in data["data"] and callback["kwargs"][key] != data["data"][key]:
+                        _run = False
+
+                if data["event_type"] == "__AD_LOG_EVENT":
+                    if "log" in callback["kwargs"] and callback["kwargs"]["log"] != data["data"]["log_type"]:
+                        _run = False
+
+                if _run:
+                    if name in self.AD.app_management.objects:
+                        if event_data is None:
+                            # Take a single read-only snapshot that every callback for this event can share
+                            event_data = utils.freeze(data["data"])
+
+                        dispatches.append(
+                            {
+                                "id": uuid_,
+                                "name": name,
+                                "objectid": self.AD.app_management.objects[name]["id"],
+                                "type": "event",
+                                "event": data["event_type"],
+                                "function": callback["function"],
+                                "data": event_data,
+                                "pin_app": callback["pin_app"],
+                                "pin_thread": callback["pin_thread"],
+                                "kwargs": callback["kwargs"],
+                            }
+                        )
+
+        # Dispatch once the lock is released, as queueing can wait for room on a worker that needs the lock
+        for args in dispatches:
+            executed = await self.AD.threading.dispatch_worker(args["name"], args)
+
+            # Remove the callback if appropriate
+            if executed is True:
+                remove = args["kwargs"].get("oneshot", False)
+                if remove is True:
+                    removes.append({"name": args["name"], "uuid": args["id"]})
 
         for remove in removes:
             await self.cancel_event_callback(remove["name"], remove["uuid"])
@@ -352,4 +397,4 @@ class Events:
     @staticmethod
     def sanitize_event_kwargs(app, kwargs):
         kwargs_copy = kwargs.copy()
-        return utils._sanitize_kwargs(kwargs_copy, ["__silent"])
+        return utils._sanitize_kwargs(kwargs_copy, ["__silent", "priority"])
@@ -142,6 +142,15 @@ class HTTP:
         self._process_arg("transport", http)
         self.logger.info("Using '%s' for event stream", self.transport)
 
+        self.stream_queue_size = 1000
+        self._process_arg("stream_queue_size", http)
+
+        self.stream_max_lag = 60
+        self._process_arg("stream_max_lag", http)
+
+        self.stream_compress = True
+        self._process_arg("stream_compress", http)
+
         self.config_dir = None
         self._process_arg("config_dir", dashboard)
 
@@ -696,7 +705,7 @@ class HTTP:
     async def stream_update(self, namespace, data):
         # self.logger.debug("stream_update() %s:%s", namespace, data)
         data["namespace"] = namespace
-        self.AD.thread_async.call_async_no_wait(self.stream.process_event, data)
+        await self.stream.process_event(data)
 
     # Routes, Status and Templates
 
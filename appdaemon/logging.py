@@ -498,6 +498,7 @@ class Logging:
                             "pin_thread": pin_thread,
                             "kwargs": cb_kwargs,
                         }
+                        self.AD.callbacks.index_callback(handle, self.AD.callbacks.callbacks[name][handle])
 
                         handles.append(handle)
 
@@ -541,44 +542,47 @@ class Logging:
         # Process log callbacks
 
         removes = []
+        dispatches = []
+        log_data = None
         async with self.AD.callbacks.callbacks_lock:
-            for name in self.AD.callbacks.callbacks.keys():
-                for uuid_ in self.AD.callbacks.callbacks[name]:
-                    callback = self.AD.callbacks.callbacks[name][uuid_]
-                    if callback["type"] == "log" and (
-                        callback["namespace"] == namespace or callback["namespace"] == "global" or namespace == "global"
-                    ):
-
-                        # Check any filters
-                        _run = True
-                        if "log" in callback["kwargs"] and callback["kwargs"]["log"] != data["log_type"]:
-                            _run = False
-
-                        if "level" in callback["kwargs"] and callback["kwargs"]["level"] != data["level"]:
-                            _run = False
-
-                        if _run:
-                            if name in self.AD.app_management.objects:
-                                executed = await self.AD.threading.dispatch_worker(
-                                    name,
-                                    {
-                                        "id": uuid_,
-                                        "name": name,
-                                        "objectid": self.AD.app_management.objects[name]["id"],
-                                        "type": "log",
-                                        "function": callback["function"],
-                                        "data": data,
-                                        "pin_app": callback["pin_app"],
-                                        "pin_thread": callback["pin_thread"],
-                                        "kwargs": callback["kwargs"],
-                                    },
-                                )
-
-                                # Remove the callback if appropriate
-                                if executed is True:
-                                    remove = callback["kwargs"].get("oneshot", False)
-                                    if remove is True:
-                                        removes.append({"name": callback["name"], "uuid": uuid_})
+            # Log callbacks are registered per level so the index narrows them down to this level
+            for name, uuid_ in self.AD.callbacks.get_log_callbacks(namespace, data["level"]):
+                callback = self.AD.callbacks.callbacks[name][uuid_]
+
+                # Check any filters
+                _run = True
+                if "log" in callback["kwargs"] and callback["kwargs"]["log"] != data["log_type"]:
+                    _run = False
+
+                if _run:
+                    if name in self.AD.app_management.objects:
+                        if log_data is None:
+                            # Take a single read-only snapshot that every callback for this message can share
+                            log_data = utils.freeze(data)
+
+                        dispatches.append(
+                            {
+                                "id": uuid_,
+                                "name": name,
+                                "objectid": self.AD.app_management.objects[name]["id"],
+                                "type": "log",
+                                "function": callback["function"],
+                                "data": log_data,
+                                "pin_app": callback["pin_app"],
+                                "pin_thread": callback["pin_thread"],
+                                "kwargs": callback["kwargs"],
+                            }
+                        )
+
+        # Dispatch once the lock is released, as queueing can wait for room on a worker that needs the lock
+        for args in dispatches:
+            executed = await self.AD.threading.dispatch_worker(args["name"], args)
+
+            # Remove the callback if appropriate
+            if executed is True:
+                remove = args["kwargs"].get("oneshot", False)
+                if remove is True:
+                    removes.append({"name": args["name"], "uuid": args["id"]})
 
         for remove in removes:
             await self.cancel_log_callback(remove["name"], remove["uuid"])
@@ -601,6 +605,7 @@ class Logging:
         async with self.AD.callbacks.callbacks_lock:
             for handle in handles:
                 if name in self.AD.callbacks.callbacks and handle in self.AD.callbacks.callbacks[name]:
+                    self.AD.callbacks.unindex_callback(handle, self.AD.callbacks.callbacks[name][handle])
                     del self.AD.callbacks.callbacks[name][handle]
                     await self.AD.state.remove_entity("admin", "log_callback.{}".format(handle))
                 if name in self.AD.callbacks.callbacks and self.AD.callbacks.callbacks[name] == {}:
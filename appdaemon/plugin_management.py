@@ -76,6 +76,14 @@ class Plugins:
                     if "refresh_timeout" not in self.plugins[name]:
                         self.plugins[name]["refresh_timeout"] = 30
 
+                    refresh_mode = self.plugins[name].get("refresh_mode", "update")
+                    if refresh_mode not in ("update", "reconcile"):
+                        self.logger.warning(
+                            "Invalid refresh_mode '%s' for plugin '%s' - using 'update'", refresh_mode, name
+                        )
+                        refresh_mode = "update"
+                    self.plugins[name]["refresh_mode"] = refresh_mode
+
                     basename = self.plugins[name]["type"]
                     type = self.plugins[name]["type"]
                     module_name = "{}plugin".format(basename)
@@ -299,13 +307,15 @@ class Plugins:
                             if (
                                 "namespaces" in self.plugins[name]
                             ):  # its a plugin using namespace mapping like adplugin so expecting a list
-                                namespace = self.plugins[name]["namespaces"]
                                 # add the main namespace
-                                namespace.extend(self.plugins[name]["namespace"])
+                                namespace = self.plugins[name]["namespaces"] + [self.plugins[name]["namespace"]]
                             else:
                                 namespace = plugin
 
-                            self.AD.state.update_namespace_state(namespace, state)
+                            if self.plugins[name]["refresh_mode"] == "reconcile":
+                                await self.AD.state.reconcile_namespace_state(namespace, state)
+                            else:
+                                self.AD.state.update_namespace_state(namespace, state)
 
                     except asyncio.TimeoutError:
                         self.logger.warning(
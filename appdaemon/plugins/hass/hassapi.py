@@ -88,7 +88,7 @@ class Hass(adbase.ADBase, adapi.ADAPI):
         else:
             device = "device_tracker"
 
-        return (key for key, value in self.get_state(device, **kwargs).items())
+        return (key for key, value in self.get_state(device, copy=False, **kwargs).items())
 
     def get_tracker_details(self, **kwargs):
         """Returns a list of all device trackers and their associated state.
@@ -187,12 +187,10 @@ class Hass(adbase.ADBase, adapi.ADAPI):
         else:
             device = "device_tracker"
 
-        state = await self.get_state(**kwargs)
+        state = await self.get_state(device, copy=False, **kwargs)
         for entity_id in state.keys():
-            thisdevice, thisentity = await self.split_entity(entity_id)
-            if thisdevice == device:
-                if state[entity_id]["state"] == "home":
-                    return True
+            if state[entity_id]["state"] == "home":
+                return True
         return False
 
     @utils.sync_wrapper
@@ -229,12 +227,10 @@ class Hass(adbase.ADBase, adapi.ADAPI):
         else:
             device = "device_tracker"
 
-        state = await self.get_state(**kwargs)
+        state = await self.get_state(device, copy=False, **kwargs)
         for entity_id in state.keys():
-            thisdevice, thisentity = await self.split_entity(entity_id)
-            if thisdevice == device:
-                if state[entity_id]["state"] != "home":
-                    return False
+            if state[entity_id]["state"] != "home":
+                return False
         return True
 
     @utils.sync_wrapper
@@ -271,12 +267,10 @@ class Hass(adbase.ADBase, adapi.ADAPI):
         else:
             device = "device_tracker"
 
-        state = await self.get_state(**kwargs)
+        state = await self.get_state(device, copy=False, **kwargs)
         for entity_id in state.keys():
-            thisdevice, thisentity = await self.split_entity(entity_id)
-            if thisdevice == device:
-                if state[entity_id]["state"] == "home":
-                    return False
+            if state[entity_id]["state"] == "home":
+                return False
         return True
 
     #
@@ -307,7 +301,7 @@ class Hass(adbase.ADBase, adapi.ADAPI):
 
     def constrain_input_boolean(self, value):
         unconstrained = True
-        state = self.get_state()
+        state = self.get_state(copy=False)
 
         values = value.split(",")
         if len(values) == 2:
@@ -323,7 +317,7 @@ class Hass(adbase.ADBase, adapi.ADAPI):
 
     def constrain_input_select(self, value):
         unconstrained = True
-        state = self.get_state()
+        state = self.get_state(copy=False)
 
         values = value.split(",")
         entity = values.pop(0)
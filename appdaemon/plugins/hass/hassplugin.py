@@ -1,7 +1,6 @@
 import asyncio
 import json
 import ssl
-import websocket
 import traceback
 import aiohttp
 import pytz
@@ -41,6 +40,9 @@ class HassPlugin(PluginBase):
 
         self.stopping = False
         self.ws = None
+        self.ws_id = 0
+        self.ws_futures = {}
+        self.ws_ready = False
         self.reading_messages = False
         self.metadata = None
         self.hass_booting = False
@@ -100,6 +102,11 @@ class HassPlugin(PluginBase):
         else:
             self.appdaemon_startup_conditions = {}
 
+        if "ws_commands" in args:
+            self.ws_commands = args["ws_commands"]
+        else:
+            self.ws_commands = False
+
         if "plugin_startup_conditions" in args:
             self.plugin_startup_conditions = args["plugin_startup_conditions"]
         else:
@@ -119,7 +126,7 @@ class HassPlugin(PluginBase):
         self.logger.debug("stop() called for %s", self.name)
         self.stopping = True
         if self.ws is not None:
-            self.ws.close()
+            self.AD.loop.create_task(self.ws.close())
 
     #
     # Placeholder for constraints
@@ -264,7 +271,6 @@ class HassPlugin(PluginBase):
 
     async def get_updates(self):  # noqa: C901
 
-        _id = 0
         self.already_notified = False
         self.first_time = True
 
@@ -289,7 +295,7 @@ class HassPlugin(PluginBase):
         #
 
         while not self.stopping:
-            _id += 1
+            self.ws_id = 0
             try:
                 #
                 # Connect to websocket interface
@@ -300,37 +306,39 @@ class HassPlugin(PluginBase):
                 elif url.startswith("http://"):
                     url = url.replace("http", "ws", 1)
 
-                sslopt = {}
                 if self.cert_verify is False:
-                    sslopt = {"cert_reqs": ssl.CERT_NONE}
-                if self.cert_path:
-                    sslopt["ca_certs"] = self.cert_path
-                self.ws = websocket.create_connection("{}/api/websocket".format(url), sslopt=sslopt)
-                res = await utils.run_in_executor(self, self.ws.recv)
-                result = json.loads(res)
+                    sslopt = False
+                elif self.cert_path:
+                    sslopt = ssl.create_default_context(cafile=self.cert_path)
+                else:
+                    sslopt = None
+
+                self.create_session()
+                self.ws = await self.session.ws_connect("{}/api/websocket".format(url), ssl=sslopt, max_msg_size=0)
+                result = await self.ws_receive()
                 self.logger.info("Connected to Home Assistant %s", result["ha_version"])
                 #
                 # Check if auth required, if so send password
                 #
                 if result["type"] == "auth_required":
                     if self.token is not None:
-                        auth = json.dumps({"type": "auth", "access_token": self.token})
+                        auth = {"type": "auth", "access_token": self.token}
                     elif self.ha_key is not None:
-                        auth = json.dumps({"type": "auth", "api_password": self.ha_key})
+                        auth = {"type": "auth", "api_password": self.ha_key}
                     else:
                         raise ValueError("HASS requires authentication and none provided in plugin config")
 
-                    await utils.run_in_executor(self, self.ws.send, auth)
-                    result = json.loads(self.ws.recv())
+                    await self.ws.send_json(auth)
+                    result = await self.ws_receive()
                     if result["type"] != "auth_ok":
                         self.logger.warning("Error in authentication")
                         raise ValueError("Error in authentication")
                 #
                 # Subscribe to event stream
                 #
-                sub = json.dumps({"id": _id, "type": "subscribe_events"})
-                await utils.run_in_executor(self, self.ws.send, sub)
-                result = json.loads(self.ws.recv())
+                _id = self.next_ws_id()
+                await self.ws.send_json({"id": _id, "type": "subscribe_events"})
+                result = await self.ws_receive()
                 if not (result["id"] == _id and result["type"] == "result" and result["success"] is True):
                     self.logger.warning("Unable to subscribe to HA events, id = %s", _id)
                     self.logger.warning(result)
@@ -365,9 +373,16 @@ class HassPlugin(PluginBase):
                 #
                 # Loop forever consuming events
                 #
+                self.ws_ready = True
                 while not self.stopping:
-                    ret = await utils.run_in_executor(self, self.ws.recv)
-                    result = json.loads(ret)
+                    result = await self.ws_receive()
+
+                    if result["type"] == "result" and result["id"] > _id:
+                        # Response to a command sent with ws_command(), dropped if the command has timed out
+                        future = self.ws_futures.pop(result["id"], None)
+                        if future is not None and not future.done():
+                            future.set_result(result)
+                        continue
 
                     if not (result["id"] == _id and result["type"] == "event"):
                         self.logger.warning("Unexpected result from Home Assistant, id = %s", _id)
@@ -382,9 +397,14 @@ class HassPlugin(PluginBase):
                         await self.AD.events.process_event(self.namespace, result["event"])
 
                 self.reading_messages = False
+                self.ws_ready = False
 
             except Exception:
+                self.ws_ready = False
                 self.reading_messages = False
+                if self.ws is not None:
+                    await self.ws.close()
+                self.cancel_ws_commands()
                 self.hass_booting = True
                 # remove callback from getting local events
                 await self.AD.callbacks.clear_callbacks(self.name)
@@ -403,6 +423,57 @@ class HassPlugin(PluginBase):
 
         self.logger.info("Disconnecting from Home Assistant")
 
+    async def ws_receive(self):
+        #
+        # Read the next message from the websocket, raising if the connection has gone away
+        #
+        msg = await self.ws.receive()
+        if msg.type == aiohttp.WSMsgType.TEXT:
+            return json.loads(msg.data)
+        elif msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.CLOSED):
+            raise ConnectionError("Websocket connection closed by Home Assistant")
+        elif msg.type == aiohttp.WSMsgType.ERROR:
+            raise ConnectionError("Websocket error: {}".format(self.ws.exception()))
+        else:
+            raise ValueError("Unexpected websocket message type: {}".format(msg.type))
+
+    def next_ws_id(self):
+        self.ws_id += 1
+        return self.ws_id
+
+    def ws_connected(self):
+        # Commands can only be sent once get_updates() is reading the results
+        return self.ws_ready is True and self.ws is not None and not self.ws.closed
+
+    async def ws_command(self, command):
+        #
+        # Send a command over the websocket and wait for the matching result message. Any number of commands can
+        # be in flight at once, get_updates() resolves each future as its result arrives
+        #
+        if not self.ws_connected():
+            raise ConnectionError("Not connected to Home Assistant")
+
+        _id = self.next_ws_id()
+        future = self.AD.loop.create_future()
+        self.ws_futures[_id] = future
+        command["id"] = _id
+        try:
+            await self.ws.send_json(command, dumps=utils.convert_json)
+            result = await asyncio.wait_for(future, self.timeout)
+        finally:
+            self.ws_futures.pop(_id, None)
+
+        if result["success"] is not True:
+            raise ValueError("Error from Home Assistant: {}".format(result.get("error")))
+
+        return result.get("result")
+
+    def cancel_ws_commands(self):
+        for future in self.ws_futures.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Disconnected from Home Assistant"))
+        self.ws_futures = {}
+
     def get_namespace(self):
         return self.namespace
 
@@ -479,6 +550,22 @@ class HassPlugin(PluginBase):
         if isinstance(data, str):
             data = {"entity_id": data}
 
+        # Without a live websocket, e.g. while connecting, the REST API is used instead
+        if self.ws_commands is True and self.ws_connected() and domain not in ["template", "database"]:
+            try:
+                return await self.ws_command(
+                    {"type": "call_service", "domain": domain, "service": service, "service_data": data}
+                )
+            except asyncio.TimeoutError:
+                self.logger.warning(
+                    "Timeout in call_service(%s/%s/%s, %s)", namespace, domain, service, data,
+                )
+            except (ConnectionError, ValueError) as e:
+                self.logger.warning(
+                    "Error calling Home Assistant service %s/%s/%s: %s", namespace, domain, service, e,
+                )
+            return None
+
         config = (await self.AD.plugins.get_plugin_object(namespace)).config
         if "token" in config:
             headers = {"Authorization": "Bearer {}".format(config["token"])}
@@ -682,14 +769,17 @@ class HassPlugin(PluginBase):
             )
             raise
 
+    def create_session(self):
+        if self.session is None:
+            #
+            # Set up HTTP Client - also used for the websocket connection
+            #
+            conn = aiohttp.TCPConnector()
+            self.session = aiohttp.ClientSession(connector=conn, json_serialize=utils.convert_json)
+
     async def get_hass_config(self):
         try:
-            if self.session is None:
-                #
-                # Set up HTTP Client
-                #
-                conn = aiohttp.TCPConnector()
-                self.session = aiohttp.ClientSession(connector=conn, json_serialize=utils.convert_json)
+            self.create_session()
 
             self.logger.debug("get_ha_config()")
             if self.token is not None:
@@ -745,6 +835,15 @@ class HassPlugin(PluginBase):
     async def fire_plugin_event(self, event, namespace, **kwargs):
         self.logger.debug("fire_event: %s, %s %s", event, namespace, kwargs)
 
+        if self.ws_commands is True and self.ws_connected():
+            try:
+                return await self.ws_command({"type": "fire_event", "event_type": event, "event_data": kwargs})
+            except asyncio.TimeoutError:
+                self.logger.warning("Timeout in fire_event(%s, %s, %s)", event, namespace, kwargs)
+            except (ConnectionError, ValueError) as e:
+                self.logger.warning("Error firing Home Assistant event %s: %s", event, e)
+            return None
+
         config = (await self.AD.plugins.get_plugin_object(namespace)).config
 
         if "token" in config:
@@ -1,5 +1,8 @@
 import traceback
 import datetime
+import heapq
+import itertools
+import bisect
 from datetime import timedelta
 import pytz
 import astral
@@ -14,6 +17,12 @@ import appdaemon.utils as utils
 from appdaemon.appdaemon import AppDaemon
 
 
+#
+# Solar events cached for each day, named after the astral.Location methods that compute them
+#
+SUN_EVENTS = ("dawn", "sunrise", "solar_noon", "sunset", "dusk")
+
+
 class Scheduler:
     def __init__(self, ad: AppDaemon):
         self.AD = ad
@@ -23,10 +32,21 @@ class Scheduler:
         self.diag = ad.logging.get_diag()
         self.last_fired = None
         self.sleep_task = None
+        # In realtime, the scheduler loop waits on wakeup, which is set by a loop timer armed for the next entry due
+        self.wakeup = None
+        self.timer_handle = None
         self.active = False
         self.location = None
+        # Solar events by UTC date, computed as they are asked for, and dropped once their date has passed
+        self.sun_events = {}
+        self.sun_date = None
         self.schedule = {}
 
+        # Priority queue of (timestamp, sequence, name, handle) tuples ordering the entries in self.schedule.
+        # Entries are removed lazily - a heap entry is stale once its handle is gone or its timestamp has moved on
+        self.timer_heap = []
+        self.timer_sequence = itertools.count()
+
         self.now = pytz.utc.localize(datetime.datetime.utcnow())
 
         #
@@ -61,6 +81,10 @@ class Scheduler:
 
         self.init_sun()
 
+        # Setup DST
+
+        self.init_dst()
+
     def set_start_time(self):
         tt = False
         unaware_now = None
@@ -90,6 +114,10 @@ class Scheduler:
     def stop(self):
         self.logger.debug("stop() called for scheduler")
         self.stopping = True
+        if self.timer_handle is not None:
+            self.timer_handle.cancel()
+        if self.wakeup is not None:
+            self.wakeup.set()
 
     async def cancel_timer(self, name, handle):
         self.logger.debug("Canceling timer for %s", name)
@@ -98,6 +126,7 @@ class Scheduler:
             await self.AD.state.remove_entity("admin", "scheduler_callback.{}".format(handle))
         if name in self.schedule and self.schedule[name] == {}:
             del self.schedule[name]
+        self.compact_timers()
 
     # noinspection PyBroadException
     async def exec_schedule(self, name, args, uuid_):
@@ -175,7 +204,17 @@ class Scheduler:
                     # Not sunrise or sunset so just increment
                     # the timestamp with the repeat interval
                     args["basetime"] += timedelta(seconds=args["interval"])
+                    #
+                    # The next time is worked out from the base time rather than from when this run happened, so
+                    # short intervals don't drift. If the run was late enough to miss one or more intervals, skip
+                    # them rather than running the callback several times in a row to catch up
+                    #
+                    now = await self.get_now()
+                    if args["basetime"] <= now and args["interval"] > 0:
+                        missed = (now - args["basetime"]) // timedelta(seconds=args["interval"]) + 1
+                        args["basetime"] += timedelta(seconds=args["interval"] * missed)
                     args["timestamp"] = args["basetime"] + timedelta(seconds=self.get_offset(args))
+                self.push_timer(name, uuid_, args["timestamp"])
                 # Update entity
 
                 await self.AD.state.set_state(
@@ -218,6 +257,38 @@ class Scheduler:
         elevation = self.AD.elevation
 
         self.location = astral.Location(("", "", latitude, longitude, self.AD.tz.zone, elevation))
+        self.sun_events = {}
+        self.sun_date = None
+
+    def init_dst(self):
+        #
+        # pytz timezones with DST carry a table of their transitions in UTC, so take the ones that change the DST
+        # offset from it once, rather than searching for them with astimezone() every time we need one
+        #
+        self.dst_transitions = []
+        self.dst_offsets = []
+
+        times = getattr(self.AD.tz, "_utc_transition_times", None)
+        info = getattr(self.AD.tz, "_transition_info", None)
+        if times is None or info is None:
+            return
+
+        for i in range(1, len(times)):
+            if info[i][1] != info[i - 1][1]:
+                self.dst_transitions.append(pytz.utc.localize(times[i]))
+                self.dst_offsets.append(info[i][1])
+
+        self.logger.debug("Cached %s DST transitions for %s", len(self.dst_transitions), self.AD.tz)
+
+    def get_dst_offset(self, dt):
+        if self.dst_transitions == []:
+            return dt.astimezone(self.AD.tz).dst()
+
+        i = bisect.bisect_right(self.dst_transitions, dt)
+        if i == 0:
+            return dt.astimezone(self.AD.tz).dst()
+
+        return self.dst_offsets[i - 1]
 
     def sun(self, type, offset):
         if offset < 0:
@@ -233,35 +304,43 @@ class Scheduler:
         else:
             return self.next_sunset(offset)
 
-    def next_sunrise(self, offset=0):
-        mod = offset
-        while True:
-            try:
-                next_rising_dt = self.location.sunrise(
-                    (self.now + datetime.timedelta(seconds=offset) + datetime.timedelta(days=mod)).date(), local=False,
-                )
-                if next_rising_dt > self.now:
-                    break
-            except astral.AstralError:
-                pass
-            mod += 1
+    def get_sun_events(self, date):
+        #
+        # Solar positions only depend on the date, so each day is computed once. Events that don't happen on
+        # the day, e.g. in polar regions, are stored as None
+        #
+        if date not in self.sun_events:
+            events = {}
+            for event in SUN_EVENTS:
+                try:
+                    events[event] = getattr(self.location, event)(date, local=False)
+                except astral.AstralError:
+                    events[event] = None
+            self.sun_events[date] = events
 
-        return next_rising_dt
+        return self.sun_events[date]
+
+    def next_sun_event(self, event, offset=0):
+        now = self.get_now_sync()
+
+        if now.date() != self.sun_date:
+            # Date change, so days that have passed won't be needed again
+            self.sun_date = now.date()
+            for date in [date for date in self.sun_events if date < self.sun_date]:
+                del self.sun_events[date]
 
-    def next_sunset(self, offset=0):
         mod = offset
         while True:
-            try:
-                next_setting_dt = self.location.sunset(
-                    (self.now + datetime.timedelta(seconds=offset) + datetime.timedelta(days=mod)).date(), local=False,
-                )
-                if next_setting_dt > self.now:
-                    break
-            except astral.AstralError:
-                pass
+            next_event_dt = self.get_sun_events((now + datetime.timedelta(days=mod)).date())[event]
+            if next_event_dt is not None and next_event_dt > now:
+                return next_event_dt
             mod += 1
 
-        return next_setting_dt
+    def next_sunrise(self, offset=0):
+        return self.next_sun_event("sunrise", offset)
+
+    def next_sunset(self, offset=0):
+        return self.next_sun_event("sunset", offset)
 
     @staticmethod
     def get_offset(kwargs):
@@ -282,12 +361,16 @@ class Scheduler:
 
     async def insert_schedule(self, name, aware_dt, callback, repeat, type_, **kwargs):
 
+        # A repeating timer with no interval would be due again as soon as it ran
+        if repeat is True and type_ is None and kwargs.get("interval", 0) <= 0:
+            raise ValueError("{}: Invalid interval for a repeating timer: {}".format(name, kwargs.get("interval", 0)))
+
         # aware_dt will include a timezone of some sort - convert to utc timezone
         utc = aware_dt.astimezone(pytz.utc)
 
-        # Round to nearest second
+        # Round to nearest millisecond
 
-        utc = self.my_dt_round(utc, base=1)
+        utc = self.my_dt_round(utc, base=0.001)
 
         if "pin" in kwargs:
             pin_app = kwargs["pin"]
@@ -321,6 +404,7 @@ class Scheduler:
             "pin_thread": pin_thread,
             "kwargs": kwargs,
         }
+        self.push_timer(name, handle, ts)
 
         if callback is None:
             function_name = "cancel_callback"
@@ -345,8 +429,12 @@ class Scheduler:
         )
         # verbose_log(conf.logger, "INFO", conf.schedule[name][handle])
 
-        if self.active is True:
-            await self.kick()
+        # Only wake the loop if the new entry is now the first one due, otherwise it will be picked up in due course
+        if self.active is True and self.timer_heap[0][3] == handle:
+            if self.realtime is True:
+                self.arm_timer()
+            else:
+                await self.kick()
         return handle
 
     async def terminate_app(self, name):
@@ -354,6 +442,7 @@ class Scheduler:
             for id in self.schedule[name]:
                 await self.AD.state.remove_entity("admin", "scheduler_callback.{}".format(id))
             del self.schedule[name]
+            self.compact_timers()
 
     def is_realtime(self):
         return self.realtime
@@ -362,22 +451,65 @@ class Scheduler:
     # Timer
     #
 
+    def push_timer(self, name, handle, timestamp):
+        heapq.heappush(self.timer_heap, (timestamp, next(self.timer_sequence), name, handle))
+
+    def is_live_timer(self, timer):
+        timestamp, _, name, handle = timer
+        return (
+            name in self.schedule
+            and handle in self.schedule[name]
+            and self.schedule[name][handle]["timestamp"] == timestamp
+        )
+
+    def rebuild_timers(self):
+        self.timer_heap = [
+            (entry["timestamp"], next(self.timer_sequence), name, handle)
+            for name in self.schedule
+            for handle, entry in self.schedule[name].items()
+        ]
+        heapq.heapify(self.timer_heap)
+
+    def compact_timers(self):
+        #
+        # Cancelled timers are left in the heap until they reach the top - if they start to dominate, rebuild
+        #
+        live = sum(len(entries) for entries in self.schedule.values())
+        if len(self.timer_heap) > 2 * live + 1024:
+            self.rebuild_timers()
+
+    def next_timer(self):
+
+        # Drop stale entries from the top of the heap
+        while len(self.timer_heap) > 0 and not self.is_live_timer(self.timer_heap[0]):
+            heapq.heappop(self.timer_heap)
+
+        if len(self.timer_heap) == 0:
+            return None
+
+        return self.timer_heap[0][0]
+
     def get_next_entries(self):
 
-        next_exec = datetime.datetime.now(pytz.utc).replace(year=datetime.MAXYEAR, month=12, day=31)
-        for name in self.schedule.keys():
-            for entry in self.schedule[name].keys():
-                if self.schedule[name][entry]["timestamp"] < next_exec:
-                    next_exec = self.schedule[name][entry]["timestamp"]
+        next_exec = self.next_timer()
+        if next_exec is None:
+            return []
 
-        next_entries = []
+        #
+        # Pop everything due at the same time then push the live entries back - cost is O(k log n) for k due entries
+        #
+        due = []
+        while len(self.timer_heap) > 0 and self.timer_heap[0][0] == next_exec:
+            due.append(heapq.heappop(self.timer_heap))
 
-        for name in self.schedule.keys():
-            for entry in self.schedule[name].keys():
-                if self.schedule[name][entry]["timestamp"] == next_exec:
-                    next_entries.append(
-                        {"name": name, "uuid": entry, "timestamp": self.schedule[name][entry]["timestamp"]}
-                    )
+        next_entries = []
+        seen = set()
+        for timer in due:
+            timestamp, _, name, handle = timer
+            if handle not in seen and self.is_live_timer(timer):
+                seen.add(handle)
+                heapq.heappush(self.timer_heap, timer)
+                next_entries.append({"name": name, "uuid": handle, "timestamp": timestamp})
 
         return next_entries
 
@@ -399,28 +531,98 @@ class Scheduler:
                         args["timestamp"] += offset
                         args["basetime"] += offset
                 self.logger.debug("After rewrite: %s", args)
+        self.rebuild_timers()
 
     def get_next_dst_offset(self, base, limit):
         #
-        # I can't believe there isn't a better way to find the next DST transition but ...
-        # We know the lower and upper bounds of DST so do a search to find the actual transition time
-        # I don't want to rely on heuristics such as "it occurs at 2am" because I don't know if that holds
-        # true for every timezone. With this method, as long as pytz's dst() function is correct, this should work
+        # Returns the number of seconds from base to the next DST transition, or limit if there isn't one before it
         #
-
-        # TODO: Convert this to some sort of binary search for efficiency
-        # TODO: This really should support sub 1 second periods better
         self.logger.debug("get_next_dst_offset() base=%s limit=%s", base, limit)
-        current = base.astimezone(self.AD.tz).dst()
-        self.logger.debug("current=%s", current)
-        for offset in range(1, int(limit) + 1):
-            candidate = (base + timedelta(seconds=offset)).astimezone(self.AD.tz)
-            # print(candidate)
-            if candidate.dst() != current:
+        i = bisect.bisect_right(self.dst_transitions, base)
+        if i < len(self.dst_transitions):
+            offset = (self.dst_transitions[i] - base).total_seconds()
+            if offset < limit:
                 return offset
         return limit
 
+    def arm_timer(self):
+        #
+        # Realtime only - (re)arm a single loop timer for the first entry due, or the next DST transition if
+        # that is earlier, so the loop is woken exactly when there is something to do
+        #
+        if self.timer_handle is not None:
+            self.timer_handle.cancel()
+
+        now = pytz.utc.localize(datetime.datetime.utcnow())
+        next_exec = self.next_timer()
+        if next_exec is None:
+            # Nothing to do, but still wake up now and again to keep track of DST
+            delay = 60
+        else:
+            delay = max((next_exec - now).total_seconds(), 0)
+
+        delay = self.get_next_dst_offset(now, delay)
+
+        self.timer_handle = self.AD.loop.call_at(self.AD.loop.time() + delay, self.wakeup.set)
+
+    async def realtime_loop(self):
+        old_dst_offset = self.get_dst_offset(await self.get_now())
+        while not self.stopping:
+            try:
+                self.wakeup.clear()
+                self.now = pytz.utc.localize(datetime.datetime.utcnow())
+                self.last_fired = self.now
+
+                dst_offset = self.get_dst_offset(self.now)
+                if old_dst_offset != dst_offset:
+                    #
+                    # DST began or ended, we need to go fix any existing scheduler entries to match the new local time
+                    #
+                    self.logger.info("Daylight Savings Time transition detected - rewriting events to new local time")
+                    await self.process_dst(old_dst_offset, dst_offset)
+                old_dst_offset = dst_offset
+
+                #
+                # Fire everything that is due. The loop timer can go off a little early if the wall clock was
+                # adjusted, in which case nothing is due yet and the timer is just re-armed. An entry that is due
+                # again once it has run is left for the next pass, so the rest of AppDaemon gets to run in between
+                #
+                fired = set()
+                next_entries = self.get_next_entries()
+                while len(next_entries) > 0 and next_entries[0]["timestamp"] <= self.now:
+                    if any(entry["uuid"] in fired for entry in next_entries):
+                        break
+                    for entry in next_entries:
+                        name = entry["name"]
+                        uuid_ = entry["uuid"]
+                        fired.add(uuid_)
+                        if name in self.schedule and uuid_ in self.schedule[name]:
+                            args = self.schedule[name][uuid_]
+                            self.logger.debug("Executing: %s", args)
+                            await self.exec_schedule(name, args, uuid_)
+                    next_entries = self.get_next_entries()
+
+                for k, v in list(self.schedule.items()):
+                    if v == {}:
+                        del self.schedule[k]
+
+                self.arm_timer()
+                await self.wakeup.wait()
+
+            except Exception:
+                self.logger.warning("-" * 60)
+                self.logger.warning("Unexpected error in scheduler loop")
+                self.logger.warning("-" * 60)
+                self.logger.warning(traceback.format_exc())
+                self.logger.warning("-" * 60)
+                # Prevent spamming of the logs
+                await asyncio.sleep(1)
+
+        if self.timer_handle is not None:
+            self.timer_handle.cancel()
+
     async def loop(self):  # noqa: C901
+        self.wakeup = asyncio.Event()
         self.active = True
         self.logger.debug("Starting scheduler loop()")
         self.AD.booted = await self.get_now_naive()
@@ -437,12 +639,14 @@ class Scheduler:
                 self.logger.info("Time displacement factor %s", self.AD.timewarp)
         else:
             self.logger.info("Scheduler running in realtime")
+            await self.realtime_loop()
+            return
 
         next_entries = []
         result = False
         idle_time = 1
         delay = 0
-        old_dst_offset = (await self.get_now()).astimezone(self.AD.tz).dst()
+        old_dst_offset = self.get_dst_offset(await self.get_now())
         while not self.stopping:
             try:
                 if self.endtime is not None and self.now >= self.endtime:
@@ -473,7 +677,7 @@ class Scheduler:
                 #
                 # Now we're awake and know what time it is
                 #
-                dst_offset = (await self.get_now()).astimezone(self.AD.tz).dst()
+                dst_offset = self.get_dst_offset(await self.get_now())
                 self.logger.debug(
                     "local now=%s old_dst_offset=%s new_dst_offset=%s",
                     self.now.astimezone(self.AD.tz),
@@ -529,19 +733,16 @@ class Scheduler:
                 # sleep in and potentially miss an event that should happen earlier than expected due to the time change
                 #
 
-                next = self.now + timedelta(seconds=delay)
-
-                self.logger.debug("next event=%s", next)
+                self.logger.debug("next event=%s", self.now + timedelta(seconds=delay))
 
-                if await self.is_dst() != await self.is_dst(next):
+                dst_delay = self.get_next_dst_offset(self.now, delay)
+                if dst_delay < delay:
                     #
                     # Reset delay to wake up at the DST change so we can re-jig everything
                     #
 
-                    delay = self.get_next_dst_offset(self.now, delay)
-                    self.logger.debug(
-                        "DST transition before next event: %s %s", await self.is_dst(), await self.is_dst(next)
-                    )
+                    delay = dst_delay
+                    self.logger.debug("DST transition before next event: %s", self.now + timedelta(seconds=delay))
 
                 self.logger.debug("Delay = %s seconds", delay)
 
@@ -653,9 +854,9 @@ class Scheduler:
 
     async def is_dst(self, dt=None):
         if dt is None:
-            return (await self.get_now()).astimezone(self.AD.tz).dst() != datetime.timedelta(0)
+            return self.get_dst_offset(await self.get_now()) != datetime.timedelta(0)
         else:
-            return dt.astimezone(self.AD.tz).dst() != datetime.timedelta(0)
+            return self.get_dst_offset(dt) != datetime.timedelta(0)
 
     async def get_now(self):
         if self.realtime is True:
@@ -701,6 +902,12 @@ class Scheduler:
         else:
             return self.make_naive(self.next_sunrise().astimezone(self.AD.tz))
 
+    async def sun_event(self, event, aware):
+        if aware is True:
+            return self.next_sun_event(event).astimezone(self.AD.tz)
+        else:
+            return self.make_naive(self.next_sun_event(event).astimezone(self.AD.tz))
+
     async def parse_time(self, time_str, name=None, aware=False):
         if aware is True:
             return (await self._parse_time(time_str, name))["datetime"].astimezone(self.AD.tz).time()
@@ -823,7 +1030,15 @@ class Scheduler:
         kwargs_copy = kwargs.copy()
         return utils._sanitize_kwargs(
             kwargs_copy,
-            ["interval", "constrain_days", "constrain_input_boolean", "_pin_app", "_pin_thread", "__silent"]
+            [
+                "interval",
+                "constrain_days",
+                "constrain_input_boolean",
+                "_pin_app",
+                "_pin_thread",
+                "priority",
+                "__silent",
+            ]
             + app.list_constraints(),
         )
 
@@ -115,3 +115,14 @@ class Services:
                 self.logger.error(traceback.format_exc())
                 self.logger.error("-" * 60)
                 return None
+
+    async def call_services_batch(self, calls):
+        """Makes a list of (namespace, domain, service, data) calls concurrently, returning the results in order"""
+
+        self.logger.debug("call_services_batch: %s calls", len(calls))
+
+        return list(
+            await asyncio.gather(
+                *[self.call_service(namespace, domain, service, data) for namespace, domain, service, data in calls]
+            )
+        )
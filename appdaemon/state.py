@@ -1,6 +1,10 @@
 import uuid
 import traceback
 import os
+import dbm
+import shelve
+import time
+import asyncio
 from copy import copy, deepcopy
 import datetime
 
@@ -14,8 +18,13 @@ class State:
         self.AD = ad
 
         self.state = {"default": {}, "admin": {}, "rules": {}}
+        # Entity ids of each namespace by domain, so domain lookups don't have to walk the whole namespace
+        self.domains = {"default": {}, "admin": {}, "rules": {}}
         self.logger = ad.logging.get_child("_state")
         self.app_added_namespaces = []
+        # State changes waiting for the end of the coalescing window of a callback, by callback handle and entity
+        self.coalescing = {}
+        self.namespace_bytes_written = 0
 
         # Initialize User Defined Namespaces
 
@@ -28,6 +37,10 @@ class State:
             self.add_persistent_namespace(ns, writeback)
             self.logger.info("User Defined Namespace '%s' initialized", ns)
 
+    async def init_admin_stats(self):
+        await self.add_entity("admin", "sensor.namespace_flush_latency", 0, {"unit_of_measurement": "ms"})
+        await self.add_entity("admin", "sensor.namespace_bytes_written", 0, {"unit_of_measurement": "B"})
+
     async def add_namespace(self, namespace, writeback, persist, name=None):
         """Used to Add Namespaces from Apps"""
 
@@ -41,6 +54,7 @@ class State:
         else:
             nspath_file = None
             self.state[namespace] = {}
+            self.domains[namespace] = {}
 
         self.app_added_namespaces.append(namespace)
 
@@ -67,6 +81,9 @@ class State:
         result = None
         if namespace in self.app_added_namespaces:
             result = self.state.pop(namespace)
+            self.domains.pop(namespace, None)
+            if isinstance(result, utils.PersistentDict):
+                await utils.run_in_executor(self, result.close)
             nspath_file = await utils.run_in_executor(self, self.remove_persistent_namespace, namespace)
             self.app_added_namespaces.remove(namespace)
 
@@ -96,9 +113,15 @@ class State:
             nspath = os.path.join(self.AD.config_dir, "namespaces")
             safe = bool(writeback == "safe")
 
-            nspath_file = os.path.join(nspath, f"{namespace}.db")
+            nspath_file = os.path.join(nspath, f"{namespace}.journal")
+            exists = os.path.isfile(nspath_file)
             self.state[namespace] = utils.PersistentDict(nspath_file, safe)
 
+            if not exists:
+                self.import_shelve_namespace(namespace, os.path.join(nspath, f"{namespace}.db"))
+
+            self.index_namespace(namespace)
+
             self.logger.info("Persistent Namespace '%s' initialized", namespace)
 
         except Exception:
@@ -110,12 +133,26 @@ class State:
 
         return nspath_file
 
+    def import_shelve_namespace(self, namespace, shelve_file):
+        """Used to carry over the contents of a namespace saved by earlier versions, which used a shelve database"""
+
+        if not dbm.whichdb(shelve_file):
+            return
+
+        with shelve.open(shelve_file, flag="r") as db:
+            self.state[namespace].update(self.freeze_entities(db))
+        self.state[namespace].sync()
+
+        self.logger.info(
+            "Imported %s entities into namespace '%s' from %s", len(self.state[namespace]), namespace, shelve_file,
+        )
+
     def remove_persistent_namespace(self, namespace):
         """Used to remove the file for a created namespace"""
 
         try:
             nspath = os.path.join(self.AD.config_dir, "namespaces")
-            database_file = f"{namespace}.db"
+            database_file = f"{namespace}.journal"
             nspath_file = os.path.join(nspath, database_file)
 
             if os.path.isfile(nspath_file) is True:  # if the file exists remove it
@@ -136,14 +173,29 @@ class State:
             ns.append(namespace)
         return ns
 
-    def list_namespace_entities(self, namespace):
-        et = []
-        if namespace in self.state:
-            for entity in self.state[namespace]:
-                et.append(entity)
-            return et
-        else:
+    def list_namespace_entities(self, namespace, domain=None):
+        if namespace not in self.state:
             return None
+        if domain is not None:
+            return list(self.domains[namespace].get(domain, {}))
+        return list(self.state[namespace])
+
+    def index_namespace(self, namespace):
+        self.domains[namespace] = {}
+        for entity in self.state[namespace]:
+            self.index_entity(namespace, entity)
+
+    def index_entity(self, namespace, entity):
+        # A dict rather than a set keeps the entities in the order they were added, as in the namespace itself
+        self.domains[namespace].setdefault(entity.split(".", 1)[0], {})[entity] = None
+
+    def unindex_entity(self, namespace, entity):
+        domain = entity.split(".", 1)[0]
+        entities = self.domains[namespace].get(domain)
+        if entities is not None:
+            entities.pop(entity, None)
+            if not entities:
+                del self.domains[namespace][domain]
 
     def terminate(self):
         self.logger.debug("terminate() called for state")
@@ -183,6 +235,7 @@ class State:
                     "pin_thread": pin_thread,
                     "kwargs": kwargs,
                 }
+                self.AD.callbacks.index_callback(handle, self.AD.callbacks.callbacks[name][handle])
 
             #
             # If we have a timeout parameter, add a scheduler entry to delete the callback later
@@ -231,23 +284,30 @@ class State:
                     if "duration" in kwargs:
                         __duration = kwargs["duration"]
                 if run:
-                    exec_time = await self.AD.sched.get_now() + datetime.timedelta(seconds=int(__duration))
-
-                    if kwargs.get("oneshot", False):
-                        kwargs["__handle"] = handle
-
-                    kwargs["__duration"] = await self.AD.sched.insert_schedule(
-                        name,
-                        exec_time,
-                        cb,
-                        False,
-                        None,
-                        __entity=entity,
-                        __attribute=__attribute,
-                        __old_state=None,
-                        __new_state=__new_state,
-                        **kwargs,
-                    )
+                    __new_state = utils.freeze(__new_state)
+
+                    exec_time = await self.AD.sched.get_now() + datetime.timedelta(seconds=float(__duration))
+
+                    # A state change may have set a timer since the callback was added, see check_and_dispatch_state()
+                    async with self.AD.callbacks.callbacks_lock:
+                        if "__duration" in kwargs:
+                            await self.AD.sched.cancel_timer(name, kwargs["__duration"])
+
+                        if kwargs.get("oneshot", False):
+                            kwargs["__handle"] = handle
+
+                        kwargs["__duration"] = await self.AD.sched.insert_schedule(
+                            name,
+                            exec_time,
+                            cb,
+                            False,
+                            None,
+                            __entity=entity,
+                            __attribute=__attribute,
+                            __old_state=None,
+                            __new_state=__new_state,
+                            **kwargs,
+                        )
 
             await self.AD.state.add_entity(
                 "admin",
@@ -275,6 +335,7 @@ class State:
                 self.logger.warning("Invalid callback in cancel_state_callback() from app {}".format(name))
 
             if name in self.AD.callbacks.callbacks and handle in self.AD.callbacks.callbacks[name]:
+                self.AD.callbacks.unindex_callback(handle, self.AD.callbacks.callbacks[name][handle])
                 del self.AD.callbacks.callbacks[name][handle]
                 await self.AD.state.remove_entity("admin", "state_callback.{}".format(handle))
             if name in self.AD.callbacks.callbacks and self.AD.callbacks.callbacks[name] == {}:
@@ -297,92 +358,96 @@ class State:
         data = state["data"]
         entity_id = data["entity_id"]
         self.logger.debug(data)
-        device, entity = entity_id.split(".")
 
         # Process state callbacks
 
         removes = []
+        dispatches = []
         async with self.AD.callbacks.callbacks_lock:
-            for name in self.AD.callbacks.callbacks.keys():
-                for uuid_ in self.AD.callbacks.callbacks[name]:
-                    callback = self.AD.callbacks.callbacks[name][uuid_]
-                    if callback["type"] == "state" and (
-                        callback["namespace"] == namespace or callback["namespace"] == "global" or namespace == "global"
-                    ):
-                        cdevice = None
-                        centity = None
-                        if callback["entity"] is not None:
-                            if "." not in callback["entity"]:
-                                cdevice = callback["entity"]
-                                centity = None
-                            else:
-                                cdevice, centity = callback["entity"].split(".")
-                        if callback["kwargs"].get("attribute") is None:
-                            cattribute = "state"
-                        else:
-                            cattribute = callback["kwargs"].get("attribute")
-
-                        cold = callback["kwargs"].get("old")
-                        cnew = callback["kwargs"].get("new")
-
-                        executed = False
-                        if cdevice is None:
-                            executed = await self.AD.threading.check_and_dispatch_state(
-                                name,
-                                callback["function"],
-                                entity_id,
-                                cattribute,
-                                data["new_state"],
-                                data["old_state"],
-                                cold,
-                                cnew,
-                                callback["kwargs"],
-                                uuid_,
-                                callback["pin_app"],
-                                callback["pin_thread"],
-                            )
-                        elif centity is None:
-                            if device == cdevice:
-                                executed = await self.AD.threading.check_and_dispatch_state(
-                                    name,
-                                    callback["function"],
-                                    entity_id,
-                                    cattribute,
-                                    data["new_state"],
-                                    data["old_state"],
-                                    cold,
-                                    cnew,
-                                    callback["kwargs"],
-                                    uuid_,
-                                    callback["pin_app"],
-                                    callback["pin_thread"],
-                                )
-
-                        elif device == cdevice and entity == centity:
-                            executed = await self.AD.threading.check_and_dispatch_state(
-                                name,
-                                callback["function"],
-                                entity_id,
-                                cattribute,
-                                data["new_state"],
-                                data["old_state"],
-                                cold,
-                                cnew,
-                                callback["kwargs"],
-                                uuid_,
-                                callback["pin_app"],
-                                callback["pin_thread"],
-                            )
-
-                        # Remove the callback if appropriate
-                        if executed is True:
-                            remove = callback["kwargs"].get("oneshot", False)
-                            if remove is True:
-                                removes.append({"name": callback["name"], "uuid": uuid_})
+            #
+            # Only visit the callbacks indexed against this entity, its domain, or all entities
+            #
+            callbacks = self.AD.callbacks.get_state_callbacks(namespace, entity_id)
+
+            if len(callbacks) > 0:
+                # Take a single read-only snapshot that every callback for this event can share
+                new_state = utils.freeze(data["new_state"])
+                old_state = utils.freeze(data["old_state"])
+
+            for name, uuid_ in callbacks:
+                callback = self.AD.callbacks.callbacks[name][uuid_]
+
+                if "coalesce" in callback["kwargs"]:
+                    self.coalesce_state_callback(name, uuid_, entity_id, new_state, old_state, callback["kwargs"])
+                    continue
+
+                dispatches.append((name, uuid_, callback))
+
+        #
+        # Dispatch once the lock is released, as queueing can wait on a full worker queue, and the callbacks
+        # running on that worker may need the lock to register or cancel callbacks
+        #
+        for name, uuid_, callback in dispatches:
+            executed = await self.dispatch_state_callback(name, uuid_, callback, entity_id, new_state, old_state)
+
+            # Remove the callback if appropriate
+            if executed is True:
+                remove = callback["kwargs"].get("oneshot", False)
+                if remove is True:
+                    removes.append({"name": callback["name"], "uuid": uuid_})
 
         for remove in removes:
             await self.cancel_state_callback(remove["uuid"], remove["name"])
 
+    async def dispatch_state_callback(self, name, uuid_, callback, entity_id, new_state, old_state):
+        if callback["kwargs"].get("attribute") is None:
+            cattribute = "state"
+        else:
+            cattribute = callback["kwargs"].get("attribute")
+
+        cold = callback["kwargs"].get("old")
+        cnew = callback["kwargs"].get("new")
+
+        return await self.AD.threading.check_and_dispatch_state(
+            name,
+            callback["function"],
+            entity_id,
+            cattribute,
+            new_state,
+            old_state,
+            cold,
+            cnew,
+            callback["kwargs"],
+            uuid_,
+            callback["pin_app"],
+            callback["pin_thread"],
+        )
+
+    def coalesce_state_callback(self, name, uuid_, entity_id, new_state, old_state, kwargs):
+        key = (uuid_, entity_id)
+        if key in self.coalescing:
+            # Keep the old state of the first change in the window, and the latest new state
+            self.coalescing[key]["new_state"] = new_state
+        else:
+            self.coalescing[key] = {"new_state": new_state, "old_state": old_state}
+            self.AD.loop.create_task(self.end_coalescing(name, uuid_, entity_id, kwargs["coalesce"]))
+
+    async def end_coalescing(self, name, uuid_, entity_id, window):
+        await asyncio.sleep(window)
+        states = self.coalescing.pop((uuid_, entity_id))
+
+        async with self.AD.callbacks.callbacks_lock:
+            if name not in self.AD.callbacks.callbacks or uuid_ not in self.AD.callbacks.callbacks[name]:
+                return
+            callback = self.AD.callbacks.callbacks[name][uuid_]
+
+        executed = await self.dispatch_state_callback(
+            name, uuid_, callback, entity_id, states["new_state"], states["old_state"]
+        )
+
+        if executed is True and callback["kwargs"].get("oneshot", False) is True:
+            await self.cancel_state_callback(uuid_, name)
+
     async def entity_exists(self, namespace, entity):
         if namespace in self.state and entity in self.state[namespace]:
             return True
@@ -435,6 +500,7 @@ class State:
 
         if entity in self.state[namespace]:
             self.state[namespace].pop(entity)
+            self.unindex_entity(namespace, entity)
             data = {"event_type": "__AD_ENTITY_REMOVED", "data": {"entity_id": entity}}
             self.AD.loop.create_task(self.AD.events.process_event(namespace, data))
 
@@ -446,14 +512,17 @@ class State:
         if isinstance(attributes, dict):
             attrs.update(attributes)
 
-        state = {
-            "entity_id": entity,
-            "state": state,
-            "last_changed": utils.dt_to_str(datetime.datetime(1970, 1, 1, 0, 0, 0, 0)),
-            "attributes": attrs,
-        }
+        state = utils.freeze(
+            {
+                "entity_id": entity,
+                "state": state,
+                "last_changed": utils.dt_to_str(datetime.datetime(1970, 1, 1, 0, 0, 0, 0)),
+                "attributes": attrs,
+            }
+        )
 
         self.state[namespace][entity] = state
+        self.index_entity(namespace, entity)
 
         data = {
             "event_type": "__AD_ENTITY_ADDED",
@@ -465,7 +534,16 @@ class State:
     async def get_state(self, name, namespace, entity_id=None, attribute=None, default=None, copy=True):
         self.logger.debug("get_state: %s.%s %s %s", entity_id, attribute, default, copy)
 
-        maybe_copy = lambda data: deepcopy(data) if copy else data  # noqa: E731
+        #
+        # Entity states are stored as frozen snapshots, so they can be handed out as they are. Copies share the
+        # snapshot and only copy the parts that are read
+        #
+        def maybe_copy(data):
+            if not copy:
+                return data
+            if isinstance(data, (utils.FrozenDict, utils.FrozenList)):
+                return utils.thaw(data)
+            return deepcopy(data)
 
         if entity_id is not None and "." in entity_id:
             if not await self.entity_exists(namespace, entity_id):
@@ -485,20 +563,22 @@ class State:
             raise ValueError("{}: Querying a specific attribute is only possible for a single entity".format(name))
 
         if entity_id is None:
-            return maybe_copy(self.state[namespace])
+            if copy:
+                return utils.CopyOnWriteDict(self.state[namespace])
+            return self.state[namespace]
 
-        domain = entity_id.split(".", 1)[0]
-        return {
-            entity_id: maybe_copy(state)
-            for entity_id, state in self.state[namespace].items()
-            if entity_id.split(".", 1)[0] == domain
-        }
+        entities = self.state[namespace]
+        return {entity: maybe_copy(entities[entity]) for entity in self.domains[namespace].get(entity_id, {})}
 
     def parse_state(self, entity, namespace, **kwargs):
         self.logger.debug("parse_state: %s, %s", entity, kwargs)
 
+        #
+        # The stored state is a frozen snapshot, so build the new state from a shallow copy of it.
+        # The caller freezes the result when it is stored
+        #
         if entity in self.state[namespace]:
-            new_state = self.state[namespace][entity]
+            new_state = dict(self.state[namespace][entity])
         else:
             # Its a new state entry
             new_state = {"attributes": {}}
@@ -509,10 +589,12 @@ class State:
 
         if "attributes" in kwargs:
             if kwargs.get("replace", False):
-                new_state["attributes"] = kwargs["attributes"]
+                new_state["attributes"] = dict(kwargs["attributes"])
             else:
+                new_state["attributes"] = dict(new_state["attributes"])
                 new_state["attributes"].update(kwargs["attributes"])
         else:
+            new_state["attributes"] = dict(new_state["attributes"])
             new_state["attributes"].update(kwargs)
 
         # API created entities won't necessarily have entity_id set
@@ -537,7 +619,9 @@ class State:
         # Set state without any checks or triggering amy evernts, and only if the entity exists
         #
         if namespace in self.state and entity_id in self.state[namespace]:
-            self.state[namespace][entity_id] = state
+            state = utils.freeze(state)
+            if self.state[namespace][entity_id] is not state:
+                self.state[namespace][entity_id] = state
 
     async def state_services(self, namespace, domain, service, kwargs):
         self.logger.debug("state_services: %s, %s, %s, %s", namespace, domain, service, kwargs)
@@ -586,11 +670,12 @@ class State:
     async def set_state(self, name, namespace, entity, **kwargs):
         self.logger.debug("set_state(): %s, %s", entity, kwargs)
         if entity in self.state[namespace]:
-            old_state = deepcopy(self.state[namespace][entity])
+            old_state = self.state[namespace][entity]
         else:
-            old_state = {"state": None, "attributes": {}}
+            old_state = utils.freeze({"state": None, "attributes": {}})
         new_state = self.parse_state(entity, namespace, **kwargs)
         new_state["last_changed"] = utils.dt_to_str((await self.AD.sched.get_now()).replace(microsecond=0), self.AD.tz)
+        new_state = utils.freeze(new_state)
         self.logger.debug("Old state: %s", old_state)
         self.logger.debug("New state: %s", new_state)
         if not await self.AD.state.entity_exists(namespace, entity):
@@ -608,10 +693,12 @@ class State:
             if result is not None:
                 if "entity_id" in result:
                     result.pop("entity_id")
-                self.state[namespace][entity] = self.parse_state(entity, namespace, **result)
+                self.state[namespace][entity] = utils.freeze(self.parse_state(entity, namespace, **result))
+                self.index_entity(namespace, entity)
         else:
             # Set the state locally
             self.state[namespace][entity] = new_state
+            self.index_entity(namespace, entity)
             # Fire the event locally
             self.logger.debug("sending event locally")
             data = {
@@ -630,19 +717,75 @@ class State:
     def set_namespace_state(self, namespace, state, persist=False):
         if persist is True:
             self.add_persistent_namespace(namespace, "safe")
-            self.state[namespace].update(state)
+            self.state[namespace].update(self.freeze_entities(state))
+            self.index_namespace(namespace)
         else:
             # first in case it had been created before, it should be deleted
+            if isinstance(self.state.get(namespace), utils.PersistentDict):
+                self.state[namespace].close()
             self.remove_persistent_namespace(namespace)
-            self.state[namespace] = state
+            self.state[namespace] = self.freeze_entities(state)
+            self.index_namespace(namespace)
 
     def update_namespace_state(self, namespace, state):
         if isinstance(namespace, list):  # if its a list, meaning multiple namespaces to be updated
             for ns in namespace:
                 if state.get(ns) is not None:
-                    self.state[ns].update(state[ns])
+                    self.state[ns].update(self.freeze_entities(state[ns]))
+                    for entity in state[ns]:
+                        self.index_entity(ns, entity)
+        else:
+            self.state[namespace].update(self.freeze_entities(state))
+            for entity in state:
+                self.index_entity(namespace, entity)
+
+    async def reconcile_namespace_state(self, namespace, state):
+        """Applies a refreshed copy of a namespace's state, writing only the entities that differ from it
+
+        A ``state_changed`` event is fired for each entity that was written, so callbacks see changes that were
+        missed while the plugin was connected. Entities missing from the refreshed state are left in place.
+        """
+
+        if isinstance(namespace, list):  # if its a list, meaning multiple namespaces to be reconciled
+            for ns in namespace:
+                if state.get(ns) is not None:
+                    await self.reconcile_namespace_state(ns, state[ns])
+            return
+
+        current = self.state[namespace]
+        changed = 0
+        for entity, new_state in state.items():
+            old_state = current.get(entity)
+            if old_state == new_state:
+                continue
+
+            #
+            # The refreshed state is fetched before it is applied, so an event may have brought in a newer version
+            # of the entity in the meantime
+            #
+            if old_state is not None and "last_updated" in old_state and "last_updated" in new_state:
+                if old_state["last_updated"] > new_state["last_updated"]:
+                    continue
+
+            new_state = utils.freeze(new_state)
+            current[entity] = new_state
+            self.index_entity(namespace, entity)
+            changed += 1
+
+            data = {
+                "event_type": "state_changed",
+                "data": {"entity_id": entity, "new_state": new_state, "old_state": old_state},
+            }
+            self.AD.loop.create_task(self.AD.events.process_event(namespace, data))
+
+        if changed > 0:
+            self.logger.info("Reconciled namespace '%s' - %s entities had changed", namespace, changed)
         else:
-            self.state[namespace].update(state)
+            self.logger.debug("Reconciled namespace '%s' - no changes", namespace)
+
+    @staticmethod
+    def freeze_entities(state):
+        return {entity: utils.freeze(entity_state) for entity, entity_state in state.items()}
 
     async def save_namespace(self, namespace):
         if isinstance(self.state[namespace], utils.PersistentDict):
@@ -656,10 +799,36 @@ class State:
             if isinstance(self.state[ns], utils.PersistentDict):
                 self.state[ns].sync()
 
-    def save_hybrid_namespaces(self):
+    async def save_hybrid_namespaces(self):
+        #
+        # Only entities changed since the last save are written. They are encoded here, so the loop
+        # can't change them part way through, and written to disk in the executor
+        #
+        latency = {}
         for ns in self.AD.namespaces:
-            if self.AD.namespaces[ns].get("writeback") == "hybrid":
-                self.state[ns].sync()
+            if self.AD.namespaces[ns].get("writeback") == "hybrid" and self.state[ns].dirty:
+                start = time.perf_counter()
+                self.state[ns].collect()
+                await utils.run_in_executor(self, self.state[ns].flush)
+                latency[ns] = round((time.perf_counter() - start) * 1000, 3)
+
+        if latency:
+            await self.set_state(
+                "_state", "admin", "sensor.namespace_flush_latency", state=sum(latency.values()), attributes=latency,
+            )
+
+        bytes_written = {
+            ns: self.state[ns].bytes_written for ns in self.state if isinstance(self.state[ns], utils.PersistentDict)
+        }
+        if sum(bytes_written.values()) != self.namespace_bytes_written:
+            self.namespace_bytes_written = sum(bytes_written.values())
+            await self.set_state(
+                "_state",
+                "admin",
+                "sensor.namespace_bytes_written",
+                state=self.namespace_bytes_written,
+                attributes=bytes_written,
+            )
 
     #
     # Utilities
@@ -682,6 +851,8 @@ class State:
                 "oneshot",
                 "pin_app",
                 "pin_thread",
+                "priority",
+                "coalesce",
                 "__delay",
                 "__silent",
             ]
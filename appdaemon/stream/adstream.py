@@ -3,6 +3,9 @@ import bcrypt
 import uuid
 import threading
 import asyncio
+import itertools
+import time
+from collections import OrderedDict
 
 from appdaemon.appdaemon import AppDaemon
 import appdaemon.utils as utils
@@ -10,6 +13,11 @@ from appdaemon.stream.socketio_handler import SocketIOHandler
 from appdaemon.stream.ws_handler import WSHandler
 from appdaemon.stream.sockjs_handler import SockJSHandler
 
+#
+# Requests that reply with states, which have to reach the client in order with the state changes queued for it
+#
+STATE_REQUESTS = ("get_state", "resync")
+
 
 class ADStream:
     def __init__(self, ad: AppDaemon, app, transport):
@@ -22,6 +30,10 @@ class ADStream:
         self.handlers = {}
         self.handlers_lock = threading.RLock()
 
+        # Subscriptions of all clients, indexed by the entity id or event type they listen for
+        self.subscriptions = {"state": SubscriptionIndex(), "event": SubscriptionIndex()}
+        self.subscription_ids = itertools.count()
+
         if self.transport == "ws":
             self.stream_handler = WSHandler(self, app, "/stream", self.AD)
         elif self.transport == "socketio":
@@ -55,17 +67,113 @@ class ADStream:
 
     async def on_disconnect(self, handle):
         with self.handlers_lock:
-            del self.handlers[handle]
+            handler = self.handlers.pop(handle)
+            for type_ in handler.subscriptions:
+                for sub in handler.subscriptions[type_].values():
+                    self.remove_subscription(type_, sub)
+
+        handler._stop_sending()
+        await handler._remove_admin_stats()
+
+    async def update_admin_stats(self):
+        with self.handlers_lock:
+            handlers = list(self.handlers.values())
+
+        for handler in handlers:
+            await handler._update_admin_stats()
+
+    def add_subscription(self, type_, handler, handle, namespace, key, response_id):
+        sub = {
+            "id": next(self.subscription_ids),
+            "handler": handler,
+            "handle": handle,
+            "response_id": response_id,
+            "namespace": namespace,
+            "key": key,
+        }
+        with self.handlers_lock:
+            self.subscriptions[type_].add(key, sub)
+        return sub
+
+    def remove_subscription(self, type_, sub):
+        with self.handlers_lock:
+            self.subscriptions[type_].remove(sub["key"], sub)
 
     async def process_event(self, data):  # noqa: C901
         try:
+            if data["event_type"] == "__AD_ENTITY_REMOVED":
+                # Clients using deltas get the entity in full if it is created again
+                with self.handlers_lock:
+                    handlers = [handler for handler in self.handlers.values() if handler.deltas is True]
+                for handler in handlers:
+                    handler._forget_states(data["namespace"], data["data"]["entity_id"])
+
+            if data["event_type"] == "state_changed":
+                type_ = "state"
+                key = data["data"]["entity_id"]
+            else:
+                type_ = "event"
+                key = data["event_type"]
+
+            #
+            # Each client gets one response per event, for the first of its subscriptions that matches
+            #
+            matches = {}
             with self.handlers_lock:
-                if len(self.handlers) > 0:
-                    # self.logger.debug("Sending data: %s", data)
-                    for handler in self.handlers:
-                        if self.handlers[handler].authed is True:  # if authenticated
-                            # await self.handlers[handler]._event(data)
-                            asyncio.ensure_future(self.handlers[handler]._event(data))
+                for sub in self.subscriptions[type_].match(key):
+                    if sub["namespace"].endswith("*"):
+                        if not data["namespace"].startswith(sub["namespace"][:-1]):
+                            continue
+                    else:
+                        if not data["namespace"] == sub["namespace"]:
+                            continue
+
+                    handler = sub["handler"]
+                    if handler.authed is True and (
+                        handler.handle not in matches or sub["id"] < matches[handler.handle]["id"]
+                    ):
+                        matches[handler.handle] = sub
+
+            if len(matches) == 0:
+                return
+
+            #
+            # Encode the event once, and only wrap it for each response id. Clients using deltas get the changes
+            # since the last state they were sent, which is the same state for all the clients that are up to date,
+            # so each delta is encoded once as well
+            #
+            response_type = "state_changed" if type_ == "state" else "event"
+
+            # A client that is behind only needs the latest state of each entity
+            coalesce_key = (data["namespace"], key) if type_ == "state" else None
+
+            events = {}
+            messages = {}
+            for sub in matches.values():
+                handler = sub["handler"]
+                if type_ == "state" and handler.deltas is True:
+                    state = data["data"]["new_state"]
+                    base = handler._state_base(coalesce_key)
+                    event_key = id(base)
+                else:
+                    state = base = None
+                    event_key = "event"
+
+                if event_key not in events:
+                    try:
+                        event = data if state is None else state_delta_event(data, base)
+                        events[event_key] = utils.convert_json(event)
+                    except TypeError as e:
+                        self.logger.warning("Unexpected error in JSON conversion when writing to stream: %s", e)
+                        self.logger.debug("Data is: %s", data)
+                        return
+
+                msg_key = (event_key, utils.convert_json(sub["response_id"]))
+                if msg_key not in messages:
+                    messages[msg_key] = '{{"data": {}, "response_id": {}, "response_type": "{}"}}'.format(
+                        events[event_key], msg_key[1], response_type
+                    )
+                handler._queue(messages[msg_key], coalesce_key, state)
 
         except Exception:
             self.logger.warning("-" * 60)
@@ -75,6 +183,110 @@ class ADStream:
             self.logger.warning("-" * 60)
 
 
+def state_delta_event(data, base):
+    """
+    Returns a copy of a state_changed event with the new state replaced by what changed in it since base, or with
+    just the new state if there is no base.
+    """
+
+    event_data = {key: value for key, value in data["data"].items() if key not in ("new_state", "old_state")}
+    if base is None:
+        event_data["new_state"] = data["data"]["new_state"]
+    else:
+        event_data["delta"] = state_delta(base, data["data"]["new_state"])
+
+    event = dict(data)
+    event["data"] = event_data
+    return event
+
+
+def state_delta(old_state, new_state):
+    """
+    Returns the fields of new_state that are new or different from old_state, with the attributes compared one by
+    one, and the names of the fields and attributes that were removed.
+    """
+
+    delta = {}
+
+    changed = {
+        key: value
+        for key, value in new_state.items()
+        if key != "attributes" and (key not in old_state or old_state[key] != value)
+    }
+    if changed:
+        delta["changed"] = changed
+
+    removed = [key for key in old_state if key != "attributes" and key not in new_state]
+    if removed:
+        delta["removed"] = removed
+
+    old_attributes = old_state.get("attributes") or {}
+    new_attributes = new_state.get("attributes") or {}
+
+    changed_attributes = {
+        key: value
+        for key, value in new_attributes.items()
+        if key not in old_attributes or old_attributes[key] != value
+    }
+    if changed_attributes:
+        delta["changed_attributes"] = changed_attributes
+
+    removed_attributes = [key for key in old_attributes if key not in new_attributes]
+    if removed_attributes:
+        delta["removed_attributes"] = removed_attributes
+
+    return delta
+
+
+class SubscriptionIndex:
+
+    """
+    Stream subscriptions by the entity id or event type they listen for. Exact keys are kept in a dict, and keys
+    ending in ``*`` in a trie of their prefix, so finding the subscriptions for a key only visits the ones that match.
+    """
+
+    def __init__(self):
+        self.exact = {}
+        self.prefixes = {"children": {}, "subs": {}}
+
+    def add(self, key, sub):
+        if key.endswith("*"):
+            node = self.prefixes
+            for char in key[:-1]:
+                node = node["children"].setdefault(char, {"children": {}, "subs": {}})
+            node["subs"][sub["id"]] = sub
+        else:
+            self.exact.setdefault(key, {})[sub["id"]] = sub
+
+    def remove(self, key, sub):
+        if key.endswith("*"):
+            path = [self.prefixes]
+            for char in key[:-1]:
+                path.append(path[-1]["children"][char])
+            path[-1]["subs"].pop(sub["id"], None)
+
+            # Prune the branch back to the last node still in use
+            for i in range(len(path) - 1, 0, -1):
+                if path[i]["subs"] or path[i]["children"]:
+                    break
+                del path[i - 1]["children"][key[i - 1]]
+        else:
+            self.exact[key].pop(sub["id"], None)
+            if not self.exact[key]:
+                del self.exact[key]
+
+    def match(self, key):
+        yield from self.exact.get(key, {}).values()
+
+        node = self.prefixes
+        yield from node["subs"].values()
+        for char in key:
+            node = node["children"].get(char)
+            if node is None:
+                break
+            yield from node["subs"].values()
+
+
 ## Any method here that doesn't begin with "_" will be exposed to the stream
 ## directly. Only Create public methods here if you wish to make them
 ## stream commands.
@@ -85,6 +297,7 @@ class RequestHandler:
         self.adstream = adstream
         self.authed = False
         self.client_name = None
+        self.deltas = False
         self.subscriptions = {
             "state": {},
             "event": {},
@@ -96,6 +309,28 @@ class RequestHandler:
         if self.AD.http.password is None:
             self.authed = True
 
+        #
+        # Events are queued for the client and sent by a task of its own, so a slow client can't hold up the
+        # others. The queue is bounded, and the client is disconnected if it falls too far behind
+        #
+        self.outbox = OrderedDict()
+        self.outbox_ids = itertools.count()
+        self.outbox_ready = asyncio.Event()
+        self.queue_size = self.AD.http.stream_queue_size
+        self.max_lag = self.AD.http.stream_max_lag
+        self.dropped = 0
+        self.coalesced = 0
+        self.stats = None
+        self.send_lock = asyncio.Lock()
+        self.sender = asyncio.ensure_future(self._send_queued())
+
+        #
+        # For clients using deltas, the state of each entity they will have once the queue is sent, and the state
+        # they had before each state still in the queue
+        #
+        self.sent_states = {}
+        self.queued_bases = {}
+
         # Create a stream
         #
         self.stream = self.adstream.stream_handler.makeStream(
@@ -116,53 +351,110 @@ class RequestHandler:
 
         await self.AD.events.process_event("admin", event_data)
 
-    async def _event(self, data):
-        response = {"data": data}
-        if data["event_type"] == "state_changed":
-            for handle, sub in self.subscriptions["state"].items():
-                if sub["namespace"].endswith("*"):
-                    if not data["namespace"].startswith(sub["namespace"][:-1]):
-                        continue
-                else:
-                    if not data["namespace"] == sub["namespace"]:
-                        continue
-
-                if sub["entity_id"].endswith("*"):
-                    if not data["data"]["entity_id"].startswith(sub["entity_id"][:-1]):
-                        continue
-                else:
-                    if not data["data"]["entity_id"] == sub["entity_id"]:
-                        continue
-
-                response["response_id"] = sub["response_id"]
-                response["response_type"] = "state_changed"
-                await self._respond(response)
-                break
-        else:
-            for handle, sub in self.subscriptions["event"].items():
-                if sub["namespace"].endswith("*"):
-                    if not data["namespace"].startswith(sub["namespace"][:-1]):
-                        continue
-                else:
-                    if not data["namespace"] == sub["namespace"]:
-                        continue
-
-                if sub["event"].endswith("*"):
-                    if not data["event_type"].startswith(sub["event"][:-1]):
-                        continue
-                else:
-                    if not data["event_type"] == sub["event"]:
-                        continue
-
-                response["response_id"] = sub["response_id"]
-                response["response_type"] = "event"
-                await self._respond(response)
-                break
-
     async def _respond(self, data):
         self.logger.debug("--> %s", data)
         await self.stream.sendclient(data)
 
+    async def _respond_encoded(self, msg):
+        self.logger.debug("--> %s", msg)
+        await self.stream.sendencoded(msg)
+
+    def _state_base(self, key):
+        # The state a delta for this entity is relative to - the queued one replaces it, so it is the one before
+        if key in self.queued_bases:
+            return self.queued_bases[key]
+        return self.sent_states.get(key)
+
+    def _queue(self, msg, coalesce_key=None, state=None):
+        if self.sender is None:
+            return
+
+        now = time.monotonic()
+        if coalesce_key is not None and coalesce_key in self.outbox:
+            # Replace the state that is still waiting, but keep its place and the time it was queued
+            self.outbox[coalesce_key] = (self.outbox[coalesce_key][0], msg)
+            self.coalesced += 1
+        else:
+            if coalesce_key is None:
+                coalesce_key = next(self.outbox_ids)
+            if self.queue_size > 0 and len(self.outbox) >= self.queue_size:
+                dropped_key, _ = self.outbox.popitem(last=False)
+                if dropped_key in self.queued_bases:
+                    # The client keeps the state it had, so the next delta has to be relative to that
+                    self.sent_states[dropped_key] = self.queued_bases.pop(dropped_key)
+                self.dropped += 1
+            if state is not None:
+                self.queued_bases[coalesce_key] = self.sent_states.get(coalesce_key)
+            self.outbox[coalesce_key] = (now, msg)
+            self.outbox_ready.set()
+
+        if state is not None:
+            self.sent_states[coalesce_key] = state
+
+        oldest = next(iter(self.outbox.values()))[0]
+        if self.max_lag > 0 and now - oldest > self.max_lag:
+            self.logger.warning(
+                "Client %s is over %s seconds behind the event stream - disconnecting", self.client_name, self.max_lag
+            )
+            self._stop_sending()
+            asyncio.ensure_future(self.stream.close())
+
+    async def _send_queued(self):
+        while True:
+            await self.outbox_ready.wait()
+            async with self.send_lock:
+                await self._flush_queued()
+                self.outbox_ready.clear()
+
+    async def _flush_queued(self):
+        # Callers must hold send_lock
+        while len(self.outbox) > 0:
+            key, (_, msg) = self.outbox.popitem(last=False)
+            self.queued_bases.pop(key, None)
+            await self._respond_encoded(msg)
+
+    def _stop_sending(self):
+        if self.sender is not None:
+            self.sender.cancel()
+            self.sender = None
+        self.outbox.clear()
+        self.sent_states.clear()
+        self.queued_bases.clear()
+
+    def _forget_states(self, namespace=None, entity_id=None):
+        # Drop what the client was sent for these entities, so the next change of each is sent in full
+        for key in list(self.sent_states):
+            if (namespace is None or key[0] == namespace) and (entity_id is None or key[1] == entity_id):
+                del self.sent_states[key]
+                if key in self.queued_bases:
+                    del self.queued_bases[key]
+                    del self.outbox[key]
+
+    async def _remove_admin_stats(self):
+        if self.stats is not None:
+            await self.AD.state.remove_entity("admin", "stream_client.{}".format(self.handle))
+            self.stats = None
+
+    async def _update_admin_stats(self):
+        if self.authed is not True or self.sender is None:
+            return
+
+        stats = {
+            "client_name": self.client_name,
+            "queue_depth": len(self.outbox),
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+        if stats == self.stats:
+            return
+
+        entity_id = "stream_client.{}".format(self.handle)
+        if self.stats is None:
+            await self.AD.state.add_entity("admin", entity_id, "connected", stats)
+        else:
+            await self.AD.state.set_state("_stream", "admin", entity_id, attributes=stats)
+        self.stats = stats
+
     async def _response_success(self, msg, data=None):
         response = {"response_type": msg["request_type"]}
         if "request_id" in msg:
@@ -177,6 +469,48 @@ class RequestHandler:
 
         await self._respond(response)
 
+    async def _response_parts(self, request_type, request_id, states, chunk_size, nested):
+        """
+        Sends all but the last chunk_size entities of states as partial responses, and returns the rest for the
+        final response. States are indexed by namespace first if nested is True.
+        """
+
+        if states is None:
+            return None
+
+        if nested is True:
+            items = ((namespace, entity, state) for namespace in states for entity, state in states[namespace].items())
+        else:
+            items = ((None, entity, state) for entity, state in states.items())
+
+        part = {}
+        size = 0
+        for namespace, entity, state in items:
+            if size == chunk_size:
+                response = {"response_type": request_type}
+                if request_id is not None:
+                    response["response_id"] = request_id
+                response["response_success"] = True
+                response["response_partial"] = True
+                response["data"] = part
+                await self._respond(response)
+                part = {}
+                size = 0
+
+            if nested is True:
+                part.setdefault(namespace, {})[entity] = state
+            else:
+                part[entity] = state
+            size += 1
+
+        if nested is True:
+            # Namespaces with no entities still show up in the result
+            for namespace in states:
+                if not states[namespace]:
+                    part[namespace] = {}
+
+        return part
+
     async def _response_error(self, msg, error):
         response = {"response_type": msg["request_type"]}
         if "request_id" in msg:
@@ -208,6 +542,18 @@ class RequestHandler:
         request_id = msg.get("request_id", None)
 
         try:
+            if msg["request_type"] in STATE_REQUESTS:
+                #
+                # Everything queued before the states are read is sent first, and nothing queued while they are
+                # sent, in one response or several, can get ahead of them
+                #
+                async with self.send_lock:
+                    await self._flush_queued()
+                    data = await fn(request_data, request_id)
+                    if data is not None or request_id is not None:
+                        await self._response_success(msg, data)
+                return
+
             data = await fn(request_data, request_id)
             if data is not None or request_id is not None:
                 return await self._response_success(msg, data)
@@ -248,8 +594,13 @@ class RequestHandler:
 
         self.stream.set_client_name(self.client_name)
 
+        deltas = data.get("deltas", False) is True
+        if deltas != self.deltas:
+            self._forget_states()
+            self.deltas = deltas
+
         self.access.info("New client %s connected", data["client_name"])
-        response_data = {"version": utils.__version__}
+        response_data = {"version": utils.__version__, "deltas": self.deltas}
 
         event_data = {
             "event_type": "stream_connected",
@@ -312,17 +663,39 @@ class RequestHandler:
 
         return await self.AD.services.call_service(data["namespace"], domain, service, service_data)
 
-    async def get_state(self, data, request_id):
-        if not self.authed:
-            raise RequestHandlerException("unauthorized")
-
+    async def _get_states(self, request_type, data, request_id):
         namespace = data.get("namespace", None)
         entity_id = data.get("entity_id", None)
+        chunk_size = data.get("chunk_size", None)
 
         if entity_id is not None and namespace is None:
             raise RequestHandlerException("entity_id cannot be set without namespace")
 
-        return self.AD.state.get_entity(namespace, entity_id, self.client_name)
+        if chunk_size is not None and (not isinstance(chunk_size, int) or chunk_size < 1):
+            raise RequestHandlerException("invalid chunk_size")
+
+        if request_type == "resync":
+            # The current states replace any deltas still waiting to be sent
+            self._forget_states(namespace, entity_id)
+
+        states = self.AD.state.get_entity(namespace, entity_id, self.client_name)
+
+        if chunk_size is None or entity_id is not None:
+            return states
+
+        return await self._response_parts(request_type, request_id, states, chunk_size, namespace is None)
+
+    async def get_state(self, data, request_id):
+        if not self.authed:
+            raise RequestHandlerException("unauthorized")
+
+        return await self._get_states("get_state", data, request_id)
+
+    async def resync(self, data, request_id):
+        if not self.authed:
+            raise RequestHandlerException("unauthorized")
+
+        return await self._get_states("resync", data, request_id)
 
     async def listen_state(self, data, request_id):
         if not self.authed:
@@ -339,11 +712,9 @@ class RequestHandler:
         if handle in self.subscriptions["state"]:
             raise RequestHandlerException("handle already exists")
 
-        self.subscriptions["state"][handle] = {
-            "response_id": request_id,
-            "namespace": data["namespace"],
-            "entity_id": data["entity_id"],
-        }
+        self.subscriptions["state"][handle] = self.adstream.add_subscription(
+            "state", self, handle, data["namespace"], data["entity_id"], request_id
+        )
 
         return handle
 
@@ -357,7 +728,7 @@ class RequestHandler:
         if data["handle"] not in self.subscriptions["state"]:
             raise RequestHandlerException("invalid handle")
 
-        del self.subscriptions["state"][data["handle"]]
+        self.adstream.remove_subscription("state", self.subscriptions["state"].pop(data["handle"]))
 
         return True
 
@@ -376,11 +747,9 @@ class RequestHandler:
         if handle in self.subscriptions["event"]:
             raise RequestHandlerException("handle already exists")
 
-        self.subscriptions["event"][handle] = {
-            "response_id": request_id,
-            "namespace": data["namespace"],
-            "event": data["event"],
-        }
+        self.subscriptions["event"][handle] = self.adstream.add_subscription(
+            "event", self, handle, data["namespace"], data["event"], request_id
+        )
 
         return handle
 
@@ -394,7 +763,7 @@ class RequestHandler:
         if data["handle"] not in self.subscriptions["event"]:
             raise RequestHandlerException("invalid handle")
 
-        del self.subscriptions["event"][data["handle"]]
+        self.adstream.remove_subscription("event", self.subscriptions["event"].pop(data["handle"]))
 
         return True
 
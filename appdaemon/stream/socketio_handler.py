@@ -84,18 +84,31 @@ class SocketIOStream:
     async def run(self):
         pass
 
+    async def close(self):
+        await self.ns.disconnect(self.client_id)
+
     async def sendclient(self, data):
         self.logger.debug("IOSocket Send sid={} data={}".format(self.client_id, data))
         data["client_id"] = self.client_id
         try:
             msg = utils.convert_json(data)
-            await self.ns.emit("up", msg, room=self.client_id)
         except TypeError as e:
             self.logger.debug("-" * 60)
             self.logger.warning("Unexpected error in JSON conversion when writing to stream from %s", self.client_name)
             self.logger.debug("Data is: %s", data)
             self.logger.debug("Error is: %s", e)
             self.logger.debug("-" * 60)
+            return
+
+        await self.emit(msg)
+
+    async def sendencoded(self, msg):
+        # Messages are shared between clients, so add the client id to a copy
+        await self.emit('{{"client_id": {}, {}'.format(utils.convert_json(self.client_id), msg[1:]))
+
+    async def emit(self, msg):
+        try:
+            await self.ns.emit("up", msg, room=self.client_id)
         except Exception:
             self.logger.debug("-" * 60)
             self.logger.debug("Client disconnected unexpectedly from %s", self.client_name)
@@ -69,17 +69,25 @@ class SockJSStream:
     async def run(self):
         pass
 
+    async def close(self):
+        self.session.close()
+
     async def sendclient(self, data):
         try:
             msg = utils.convert_json(data)
-            await utils.run_in_executor(self, self.session.send, msg)
         except TypeError as e:
             self.logger.debug("-" * 60)
             self.logger.warning("Unexpected error in JSON conversion when writing to stream from %s", self.client_name)
             self.logger.debug("Data is: %s", data)
             self.logger.debug("Error is: %s", e)
             self.logger.debug("-" * 60)
+            return
+
+        await self.sendencoded(msg)
 
+    async def sendencoded(self, msg):
+        try:
+            await utils.run_in_executor(self, self.session.send, msg)
         except Exception:
             self.logger.debug("-" * 60)
             self.logger.debug("Client disconnected unexpectedly from %s", self.client_name)
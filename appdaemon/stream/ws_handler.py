@@ -40,6 +40,7 @@ class WSStream:
 
         self.logger = ad.logging.get_child("_stream")
         self.access = ad.logging.get_access()
+        self.compress = ad.http.stream_compress
         self.ws = None
         self.client_name = kwargs.get("client_name")
 
@@ -48,7 +49,8 @@ class WSStream:
 
     async def run(self):
         self.lock = asyncio.Lock()
-        self.ws = web.WebSocketResponse()
+        # permessage-deflate is used if the client offers it and compression is enabled
+        self.ws = web.WebSocketResponse(compress=self.compress)
         await self.ws.prepare(self.request)
 
         try:
@@ -79,17 +81,26 @@ class WSStream:
             await self.ws.close()
             self.logger.debug("Done")
 
+    async def close(self):
+        await self.ws.close()
+
     async def sendclient(self, data):
         try:
-            async with self.lock:
-                await self.ws.send_json(data, dumps=utils.convert_json)
-
+            msg = utils.convert_json(data)
         except TypeError as e:
             self.logger.debug("-" * 60)
             self.logger.warning("Unexpected error in JSON conversion when writing to stream from %s", self.client_name)
             self.logger.debug("Data is: %s", data)
             self.logger.debug("Error is: %s", e)
             self.logger.debug("-" * 60)
+            return
+
+        await self.sendencoded(msg)
+
+    async def sendencoded(self, msg):
+        try:
+            async with self.lock:
+                await self.ws.send_str(msg)
 
         except Exception:
             self.logger.debug("-" * 60)
@@ -1,19 +1,190 @@
 import asyncio
 import threading
 import datetime
-from queue import Queue
+from collections import deque
+import queue
 from random import randint
 import re
-import sys
 import traceback
 import inspect
 from datetime import timedelta
 import logging
-import iso8601
 
 from appdaemon import utils as utils
 from appdaemon.appdaemon import AppDaemon
 
+#
+# Callback priorities, highest first
+#
+PRIORITIES = ("high", "normal", "low")
+OVERFLOW_POLICIES = ("block", "drop_oldest", "coalesce")
+
+
+class ThreadQueue:
+    """Work queue for a single worker thread.
+
+    Entries are kept in one FIFO per priority level and ``get()`` always serves the highest priority that has
+    work waiting. If ``maxsize`` is set, ``put()`` applies the overflow policy once the queue is full:
+
+    - ``block`` - wait for the worker to make room
+    - ``drop_oldest`` - discard the oldest entry of the lowest priority queued to make room
+    - ``coalesce`` - replace an entry already queued for the same callback and entity or event, otherwise behave as
+      ``drop_oldest``
+
+    Depth changes are reported to ``depths`` so the least loaded queue can be found without scanning them all.
+    """
+
+    def __init__(self, name, maxsize=0, overflow="block", depths=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.depths = depths
+        self.levels = [deque() for _ in PRIORITIES]
+        # coalesce key -> queued entry, used when coalescing
+        self.queued = {}
+        # (loop, future) of each coroutine waiting for room in the queue
+        self.waiters = deque()
+        self.size = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.not_full = threading.Condition(self.mutex)
+
+    def qsize(self):
+        return self.size
+
+    def full(self):
+        return 0 < self.maxsize <= self.size
+
+    def put(self, args, priority=1, block=True):
+        """Queues args at the given priority level, returns False if an entry was dropped or coalesced to do so"""
+        displaced = False
+        with self.not_full:
+            if self.full():
+                if self.overflow == "block":
+                    if block is not True:
+                        raise queue.Full
+                    while self.full():
+                        self.not_full.wait()
+                elif self.overflow == "coalesce" and coalesce_key(args) in self.queued:
+                    # Entries are one element lists so they can be replaced without searching the queue
+                    self.queued[coalesce_key(args)][0] = args
+                    self.coalesced += 1
+                    return False
+                else:
+                    if not self._drop_oldest(priority):
+                        self.dropped += 1
+                        return False
+                    displaced = True
+
+            entry = [args]
+            self.levels[priority].append(entry)
+            self.queued[coalesce_key(args)] = entry
+            if not displaced:
+                self.size += 1
+                if self.depths is not None:
+                    self.depths.change(self.name, 1)
+            self.not_empty.notify()
+
+        return not displaced
+
+    def _drop_oldest(self, priority):
+        # Never displace an entry of higher priority than the one being queued
+        for level in range(len(self.levels) - 1, priority - 1, -1):
+            if self.levels[level]:
+                self._forget(self.levels[level].popleft())
+                self.dropped += 1
+                return True
+        return False
+
+    def _forget(self, entry):
+        key = coalesce_key(entry[0])
+        if self.queued.get(key) is entry:
+            del self.queued[key]
+
+    async def wait_for_room(self):
+        """Waits on the event loop until the queue has room, without tying up a thread to do so"""
+        loop = asyncio.get_event_loop()
+        while True:
+            with self.mutex:
+                if not self.full():
+                    return
+                waiter = loop.create_future()
+                self.waiters.append((loop, waiter))
+            await waiter
+
+    def get(self):
+        with self.not_empty:
+            while self.size == 0:
+                self.not_empty.wait()
+            for level in self.levels:
+                if level:
+                    entry = level.popleft()
+                    break
+            self._forget(entry)
+            self.size -= 1
+            if self.depths is not None:
+                self.depths.change(self.name, -1)
+            self.not_full.notify()
+            if self.waiters:
+                loop, waiter = self.waiters.popleft()
+                loop.call_soon_threadsafe(wake_waiter, waiter)
+            return entry[0]
+
+
+def coalesce_key(args):
+    # Changes to different entities, or different events, for the same callback are kept apart
+    if args["type"] == "state":
+        return args["id"], args["entity"]
+    if args["type"] == "event":
+        return args["id"], args["event"]
+    return args["id"]
+
+
+def wake_waiter(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class QueueDepths:
+    """Tracks the depth of the unpinned worker queues so the least loaded one can be found in O(1).
+
+    Threads are bucketed by depth and the minimum depth is maintained as the queues change one entry at a time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.depth = {}
+        # depth -> thread ids at that depth, a dict is used as an insertion ordered set
+        self.buckets = {}
+        self.min_depth = 0
+
+    def add(self, thread_id):
+        with self.lock:
+            self.depth[thread_id] = 0
+            self.buckets.setdefault(0, {})[thread_id] = None
+            self.min_depth = 0
+
+    def change(self, thread_id, delta):
+        with self.lock:
+            old = self.depth[thread_id]
+            new = old + delta
+            bucket = self.buckets[old]
+            del bucket[thread_id]
+            if not bucket:
+                del self.buckets[old]
+            self.buckets.setdefault(new, {})[thread_id] = None
+            self.depth[thread_id] = new
+            if new < self.min_depth or old == self.min_depth and old not in self.buckets:
+                self.min_depth = new
+
+    def least_loaded(self):
+        with self.lock:
+            if not self.buckets:
+                return None
+            return next(iter(self.buckets[self.min_depth]))
+
 
 class Threading:
     def __init__(self, ad: AppDaemon, kwargs):
@@ -32,14 +203,13 @@ class Threading:
         self.add_entity = ad.state.add_entity
         self.get_state = ad.state.get_state
         self.set_state = ad.state.set_state
-        self.add_to_state = ad.state.add_to_state
-        self.add_to_attr = ad.state.add_to_attr
 
         self.auto_pin = True
         self.pin_threads = 0
         self.total_threads = 0
         self.pin_apps = None
         self.next_thread = None
+        self.queue_depths = QueueDepths()
         # Setup stats
 
         self.current_callbacks_executed = 0
@@ -48,6 +218,22 @@ class Threading:
         self.last_stats_time = datetime.datetime(1970, 1, 1, 0, 0, 0, 0)
         self.callback_list = []
 
+        #
+        # Thread and callback stats are kept in memory and written to the admin namespace in one batch every
+        # admin_delay by update_admin_stats(), rather than with several state updates per callback
+        #
+        self.callbacks_total_fired = 0
+        self.callbacks_total_executed = 0
+        self.threads_current_busy = 0
+        self.threads_max_busy = 0
+        self.threads_max_busy_time = datetime.datetime(1970, 1, 1, 0, 0, 0, 0)
+        self.threads_last_action_time = datetime.datetime(1970, 1, 1, 0, 0, 0, 0)
+        self.thread_info = {}
+        self.stats_dirty = False
+        self.dirty_threads = set()
+        self.pending_attrs = {}
+        self.pending_app_states = {}
+
     async def get_q_update(self):
         for thread in self.threads:
             qsize = self.get_q(thread).qsize()
@@ -139,6 +325,12 @@ class Threading:
         if self.pin_threads < 0:
             raise ValueError("pin_threads cannot be < 0")
 
+        if self.AD.thread_queue_size < 0:
+            raise ValueError("thread_queue_size cannot be < 0")
+
+        if self.AD.thread_queue_overflow not in OVERFLOW_POLICIES:
+            raise ValueError("thread_queue_overflow must be one of {}".format(", ".join(OVERFLOW_POLICIES)))
+
         self.logger.info(
             "Starting Apps with %s workers and %s pins", self.total_threads, self.pin_threads,
         )
@@ -150,6 +342,7 @@ class Threading:
             await self.add_thread(True)
 
         # Add thread object to track async
+        self.thread_info["async"] = {"callback": "idle", "time_called": datetime.datetime(1970, 1, 1, 0, 0, 0, 0)}
         await self.add_entity(
             "admin",
             "thread.async",
@@ -181,55 +374,48 @@ class Threading:
         return qsize
 
     def min_q_id(self):
-        id = 0
-        i = 0
-        qsize = sys.maxsize
-        for thread in self.threads:
-            if self.threads[thread]["queue"].qsize() < qsize:
-                qsize = self.threads[thread]["queue"].qsize()
-                id = i
-            i += 1
-        return id
+        thread_id = self.queue_depths.least_loaded()
+        if thread_id is None:
+            return self.pin_threads
+        return int(thread_id.split("-")[1])
 
     async def get_thread_info(self):
         info = {}
-        info["max_busy_time"] = await self.get_state("_threading", "admin", "sensor.threads_max_busy_time")
-        info["last_action_time"] = await self.get_state("_threading", "admin", "sensor.threads_last_action_time")
-        info["current_busy"] = await self.get_state("_threading", "admin", "sensor.threads_current_busy")
-        info["max_busy"] = await self.get_state("_threading", "admin", "sensor.threads_max_busy")
+        info["max_busy_time"] = utils.dt_to_str(self.threads_max_busy_time, self.AD.tz)
+        info["last_action_time"] = utils.dt_to_str(self.threads_last_action_time, self.AD.tz)
+        info["current_busy"] = self.threads_current_busy
+        info["max_busy"] = self.threads_max_busy
         info["threads"] = {}
         for thread in sorted(self.threads, key=self.natural_keys):
             if thread not in info["threads"]:
                 info["threads"][thread] = {}
-            t = await self.get_state("_threading", "admin", "thread.{}".format(thread), attribute="all")
-            info["threads"][thread]["time_called"] = t["attributes"]["time_called"]
-            info["threads"][thread]["callback"] = t["state"]
-            info["threads"][thread]["is_alive"] = t["attributes"]["is_alive"]
+            t = self.thread_info[thread]
+            info["threads"][thread]["time_called"] = utils.dt_to_str(t["time_called"], self.AD.tz)
+            info["threads"][thread]["callback"] = t["callback"]
+            info["threads"][thread]["is_alive"] = self.threads[thread]["thread"].is_alive()
         return info
 
     async def dump_threads(self):
         self.diag.info("--------------------------------------------------")
         self.diag.info("Threads")
         self.diag.info("--------------------------------------------------")
-        current_busy = await self.get_state("_threading", "admin", "sensor.threads_current_busy")
-        max_busy = await self.get_state("_threading", "admin", "sensor.threads_max_busy")
-        max_busy_time = utils.str_to_dt(await self.get_state("_threading", "admin", "sensor.threads_max_busy_time"))
-        last_action_time = await self.get_state("_threading", "admin", "sensor.threads_last_action_time")
-        self.diag.info("Currently busy threads: %s", current_busy)
-        self.diag.info("Most used threads: %s at %s", max_busy, max_busy_time)
-        self.diag.info("Last activity: %s", last_action_time)
+        self.diag.info("Currently busy threads: %s", self.threads_current_busy)
+        self.diag.info("Most used threads: %s at %s", self.threads_max_busy, self.threads_max_busy_time)
+        self.diag.info("Last activity: %s", utils.dt_to_str(self.threads_last_action_time, self.AD.tz))
         self.diag.info("Total Q Entries: %s", self.total_q_size())
         self.diag.info("--------------------------------------------------")
         for thread in sorted(self.threads, key=self.natural_keys):
-            t = await self.get_state("_threading", "admin", "thread.{}".format(thread), attribute="all")
-            # print("thread.{}".format(thread), t)
+            t = self.thread_info[thread]
             self.diag.info(
-                "%s - qsize: %s | current callback: %s | since %s, | alive: %s, | pinned apps: %s",
+                "%s - qsize: %s | dropped: %s | coalesced: %s | current callback: %s | since %s, | alive: %s, "
+                "| pinned apps: %s",
                 thread,
-                t["attributes"]["q"],
-                t["state"],
-                t["attributes"]["time_called"],
-                t["attributes"]["is_alive"],
+                self.threads[thread]["queue"].qsize(),
+                self.threads[thread]["queue"].dropped,
+                self.threads[thread]["queue"].coalesced,
+                t["callback"],
+                utils.dt_to_str(t["time_called"], self.AD.tz),
+                self.threads[thread]["thread"].is_alive(),
                 await self.get_pinned_apps(thread),
             )
         self.diag.info("--------------------------------------------------")
@@ -238,7 +424,7 @@ class Threading:
     # Thread Management
     #
 
-    def select_q(self, args):
+    async def select_q(self, args):
         #
         # Select Q based on distribution method:
         #   Round Robin
@@ -277,7 +463,17 @@ class Threading:
         id = "thread-{}".format(thread)
         q = self.threads[id]["queue"]
 
-        q.put_nowait(args)
+        priority = args["kwargs"].get("priority", "normal")
+        level = PRIORITIES.index(priority) if priority in PRIORITIES else PRIORITIES.index("normal")
+
+        if q.overflow == "block":
+            # Callers never hold callbacks_lock here, so a worker can still register callbacks while we wait
+            await q.wait_for_room()
+
+        if q.put(args, level, block=False) is False:
+            self.logger.debug("Queue for %s is full, %s callback %s dropped or coalesced", id, args["type"], args["id"])
+            self.dirty_threads.add(id)
+            self.stats_dirty = True
 
     async def check_overdue_and_dead_threads(self):
         if self.AD.sched.realtime is True and self.AD.thread_duration_warning_threshold != 0:
@@ -288,23 +484,15 @@ class Threading:
                     self.logger.critical("Thread will be restarted")
                     id = thread_id.split("-")[1]
                     await self.add_thread(silent=False, pinthread=False, id=id)
-                if await self.get_state("_threading", "admin", "thread.{}".format(thread_id)) != "idle":
-                    start = utils.str_to_dt(
-                        await self.get_state(
-                            "_threading", "admin", "thread.{}".format(thread_id), attribute="time_called",
-                        )
-                    )
+                if self.thread_info[thread_id]["callback"] != "idle":
+                    start = self.thread_info[thread_id]["time_called"]
                     dur = (await self.AD.sched.get_now() - start).total_seconds()
                     if (
                         dur >= self.AD.thread_duration_warning_threshold
                         and dur % self.AD.thread_duration_warning_threshold == 0
                     ):
                         self.logger.warning(
-                            "Excessive time spent in callback: %s - %s",
-                            await self.get_state(
-                                "_threading", "admin", "thread.{}".format(thread_id), attribute="callback",
-                            ),
-                            dur,
+                            "Excessive time spent in callback: %s - %s", self.thread_info[thread_id]["callback"], dur,
                         )
 
     async def check_q_size(self, warning_step, warning_iterations):
@@ -324,12 +512,8 @@ class Threading:
                             "Queue size for thread %s is %s, callback is '%s' called at %s - possible thread starvation",
                             thread,
                             qsize,
-                            await self.get_state("_threading", "admin", "thread.{}".format(thread)),
-                            iso8601.parse_date(
-                                await self.get_state(
-                                    "_threading", "admin", "thread.{}".format(thread), attribute="time_called",
-                                )
-                            ),
+                            self.thread_info[thread]["callback"],
+                            self.thread_info[thread]["time_called"],
                         )
 
                 await self.dump_threads()
@@ -364,74 +548,112 @@ class Threading:
 
         now = await self.AD.sched.get_now()
         if callback == "idle":
-            start = utils.str_to_dt(
-                await self.get_state("_threading", "admin", "thread.{}".format(thread_id), attribute="time_called",)
-            )
+            start = self.thread_info[thread_id]["time_called"]
             if (
                 self.AD.sched.realtime is True
                 and (now - start).total_seconds() >= self.AD.thread_duration_warning_threshold
             ):
                 self.logger.warning(
-                    "callback %s has now completed",
-                    await self.get_state("_threading", "admin", "thread.{}".format(thread_id)),
+                    "callback %s has now completed", self.thread_info[thread_id]["callback"],
                 )
-            await self.add_to_state("_threading", "admin", "sensor.threads_current_busy", -1)
+            self.threads_current_busy -= 1
 
-            await self.add_to_attr("_threading", "admin", appentity, "totalcallbacks", 1)
-            await self.add_to_attr("_threading", "admin", appentity, "instancecallbacks", 1)
+            self.add_to_pending_attr(appentity, "totalcallbacks", 1)
+            self.add_to_pending_attr(appentity, "instancecallbacks", 1)
+            self.add_to_pending_attr("{}_callback.{}".format(type, uuid), "executed", 1)
 
-            await self.add_to_attr(
-                "_threading", "admin", "{}_callback.{}".format(type, uuid), "executed", 1,
-            )
-            await self.add_to_state("_threading", "admin", "sensor.callbacks_total_executed", 1)
+            self.callbacks_total_executed += 1
             self.current_callbacks_executed += 1
         else:
-            await self.add_to_state("_threading", "admin", "sensor.threads_current_busy", 1)
+            self.threads_current_busy += 1
             self.current_callbacks_fired += 1
 
-        current_busy = await self.get_state("_threading", "admin", "sensor.threads_current_busy")
-        max_busy = await self.get_state("_threading", "admin", "sensor.threads_max_busy")
-        if current_busy > max_busy:
-            await self.set_state("_threading", "admin", "sensor.threads_max_busy", state=current_busy)
+        if self.threads_current_busy > self.threads_max_busy:
+            self.threads_max_busy = self.threads_current_busy
+            self.threads_max_busy_time = now.replace(microsecond=0)
+            self.threads_last_action_time = now.replace(microsecond=0)
+
+        # Update thread info
+
+        self.thread_info[thread_id] = {"callback": callback, "time_called": now.replace(microsecond=0)}
+        self.dirty_threads.add(thread_id)
+        self.pending_app_states[appentity] = callback
+        self.stats_dirty = True
+
+    def add_to_pending_attr(self, entity_id, attr, i):
+        attrs = self.pending_attrs.setdefault(entity_id, {})
+        attrs[attr] = attrs.get(attr, 0) + i
+
+    async def update_admin_stats(self):
+        """Writes the thread and callback stats accumulated since the last call to the admin namespace"""
+
+        if self.stats_dirty is True:
+            self.stats_dirty = False
             await self.set_state(
-                "_threading",
-                "admin",
-                "sensor.threads_max_busy_time",
-                state=utils.dt_to_str((await self.AD.sched.get_now()).replace(microsecond=0), self.AD.tz),
+                "_threading", "admin", "sensor.callbacks_total_fired", state=self.callbacks_total_fired,
             )
-
             await self.set_state(
-                "_threading",
-                "admin",
-                "sensor.threads_last_action_time",
-                state=utils.dt_to_str((await self.AD.sched.get_now()).replace(microsecond=0), self.AD.tz),
+                "_threading", "admin", "sensor.callbacks_total_executed", state=self.callbacks_total_executed,
             )
-
-        # Update thread info
-
-        if thread_id == "async":
+            await self.set_state("_threading", "admin", "sensor.threads_current_busy", state=self.threads_current_busy)
+            await self.set_state("_threading", "admin", "sensor.threads_max_busy", state=self.threads_max_busy)
             await self.set_state(
                 "_threading",
                 "admin",
-                "thread.{}".format(thread_id),
-                q=0,
-                state=callback,
-                time_called=utils.dt_to_str(now.replace(microsecond=0), self.AD.tz),
-                is_alive=True,
-                pinned_apps=[],
+                "sensor.threads_max_busy_time",
+                state=utils.dt_to_str(self.threads_max_busy_time, self.AD.tz),
             )
-        else:
             await self.set_state(
                 "_threading",
                 "admin",
-                "thread.{}".format(thread_id),
-                q=self.threads[thread_id]["queue"].qsize(),
-                state=callback,
-                time_called=utils.dt_to_str(now.replace(microsecond=0), self.AD.tz),
-                is_alive=self.threads[thread_id]["thread"].is_alive(),
-                pinned_apps=await self.get_pinned_apps(thread_id),
+                "sensor.threads_last_action_time",
+                state=utils.dt_to_str(self.threads_last_action_time, self.AD.tz),
             )
-        await self.set_state("_threading", "admin", appentity, state=callback)
+
+        #
+        # Swap out the pending updates before we start awaiting so new ones go into the next batch
+        #
+        dirty_threads, self.dirty_threads = self.dirty_threads, set()
+        pending_attrs, self.pending_attrs = self.pending_attrs, {}
+        pending_app_states, self.pending_app_states = self.pending_app_states, {}
+
+        for thread_id in dirty_threads:
+            info = self.thread_info[thread_id]
+            if thread_id == "async":
+                await self.set_state(
+                    "_threading",
+                    "admin",
+                    "thread.{}".format(thread_id),
+                    q=0,
+                    state=info["callback"],
+                    time_called=utils.dt_to_str(info["time_called"], self.AD.tz),
+                    is_alive=True,
+                    pinned_apps=[],
+                )
+            else:
+                await self.set_state(
+                    "_threading",
+                    "admin",
+                    "thread.{}".format(thread_id),
+                    q=self.threads[thread_id]["queue"].qsize(),
+                    dropped=self.threads[thread_id]["queue"].dropped,
+                    coalesced=self.threads[thread_id]["queue"].coalesced,
+                    state=info["callback"],
+                    time_called=utils.dt_to_str(info["time_called"], self.AD.tz),
+                    is_alive=self.threads[thread_id]["thread"].is_alive(),
+                    pinned_apps=await self.get_pinned_apps(thread_id),
+                )
+
+        for entity_id, attrs in pending_attrs.items():
+            state = await self.get_state("_threading", "admin", entity_id, attribute="all")
+            if state is not None:
+                for attr, i in attrs.items():
+                    state["attributes"][attr] = state["attributes"].get(attr, 0) + i
+                await self.set_state("_threading", "admin", entity_id, attributes=state["attributes"])
+
+        for appentity, callback in pending_app_states.items():
+            if await self.AD.state.entity_exists("admin", appentity):
+                await self.set_state("_threading", "admin", appentity, state=callback)
 
     #
     # Pinning
@@ -453,15 +675,33 @@ class Threading:
                 "admin",
                 "thread.{}".format(name),
                 "idle",
-                {"q": 0, "is_alive": True, "time_called": utils.dt_to_str(datetime.datetime(1970, 1, 1, 0, 0, 0, 0))},
+                {
+                    "q": 0,
+                    "dropped": 0,
+                    "coalesced": 0,
+                    "is_alive": True,
+                    "time_called": utils.dt_to_str(datetime.datetime(1970, 1, 1, 0, 0, 0, 0)),
+                },
             )
             self.threads[name] = {}
-            self.threads[name]["queue"] = Queue(maxsize=0)
+            #
+            # Only unpinned threads take part in load distribution
+            #
+            if pinthread is False and tid >= self.pin_threads:
+                depths = self.queue_depths
+                depths.add(name)
+            else:
+                depths = None
+            self.threads[name]["queue"] = ThreadQueue(
+                name, self.AD.thread_queue_size, self.AD.thread_queue_overflow, depths
+            )
+            self.thread_info[name] = {"callback": "idle", "time_called": datetime.datetime(1970, 1, 1, 0, 0, 0, 0)}
             t.start()
             self.thread_count += 1
             if pinthread is True:
                 self.pin_threads += 1
         else:
+            self.thread_info[name]["callback"] = "idle"
             await self.set_state(
                 "_threading", "admin", "thread.{}".format(name), state="idle", is_alive=True,
             )
@@ -646,74 +886,81 @@ class Threading:
             # Don't do anything unless there has been a change
             #
             if new != old:
-                if "__duration" in kwargs:
+                matched = (cold is None or cold == old) and (cnew is None or cnew == new)
+
+                if "duration" in kwargs or "__duration" in kwargs:
                     #
-                    # We have a pending timer for this, but we are coming around again.
-                    # Either we will start a new timer if the conditions are met
-                    # Or we won't if they are not.
-                    # Either way, we cancel the old timer
+                    # The pending timer is kept in the callback's kwargs, so it is replaced under the lock, where
+                    # other changes of the entity and cancelling the callback can't see it half done
                     #
-                    await self.AD.sched.cancel_timer(name, kwargs["__duration"])
+                    async with self.AD.callbacks.callbacks_lock:
+                        if "__duration" in kwargs:
+                            #
+                            # We have a pending timer for this, but we are coming around again.
+                            # Either we will start a new timer if the conditions are met
+                            # Or we won't if they are not.
+                            # Either way, we cancel the old timer
+                            #
+                            await self.AD.sched.cancel_timer(name, kwargs["__duration"])
+
+                        # The callback may have been cancelled since the change was picked up
+                        registered = name in self.AD.callbacks.callbacks and uuid_ in self.AD.callbacks.callbacks[name]
+
+                        if matched and "duration" in kwargs and registered:
+                            #
+                            # Set a timer
+                            #
+                            exec_time = await self.AD.sched.get_now() + timedelta(seconds=float(kwargs["duration"]))
+
+                            #
+                            # If it's a oneshot, scheduler will delete the callback once it has executed,
+                            # We need to give it the handle so it knows what to delete
+                            #
+                            if kwargs.get("oneshot", False):
+                                kwargs["__handle"] = uuid_
+
+                            #
+                            # We're not executing the callback immediately so let's schedule it
+                            # Unless we intercede and cancel it, the callback will happen in "duration" seconds
+                            #
+
+                            kwargs["__duration"] = await self.AD.sched.insert_schedule(
+                                name,
+                                exec_time,
+                                funcref,
+                                False,
+                                None,
+                                __entity=entity,
+                                __attribute=attribute,
+                                __old_state=old,
+                                __new_state=new,
+                                **kwargs
+                            )
 
                 #
                 # Check if we care about the change
                 #
-                if (cold is None or cold == old) and (cnew is None or cnew == new):
+                if matched and "duration" not in kwargs:
                     #
-                    # We do!
+                    # Not a delay so make the callback immediately
                     #
-
-                    if "duration" in kwargs:
-                        #
-                        # Set a timer
-                        #
-                        exec_time = await self.AD.sched.get_now() + timedelta(seconds=int(kwargs["duration"]))
-
-                        #
-                        # If it's a oneshot, scheduler will delete the callback once it has executed,
-                        # We need to give it the handle so it knows what to delete
-                        #
-                        if kwargs.get("oneshot", False):
-                            kwargs["__handle"] = uuid_
-
-                        #
-                        # We're not executing the callback immediately so let's schedule it
-                        # Unless we intercede and cancel it, the callback will happen in "duration" seconds
-                        #
-
-                        kwargs["__duration"] = await self.AD.sched.insert_schedule(
-                            name,
-                            exec_time,
-                            funcref,
-                            False,
-                            None,
-                            __entity=entity,
-                            __attribute=attribute,
-                            __old_state=old,
-                            __new_state=new,
-                            **kwargs
-                        )
-                    else:
-                        #
-                        # Not a delay so make the callback immediately
-                        #
-                        executed = await self.dispatch_worker(
-                            name,
-                            {
-                                "id": uuid_,
-                                "name": name,
-                                "objectid": self.AD.app_management.objects[name]["id"],
-                                "type": "state",
-                                "function": funcref,
-                                "attribute": attribute,
-                                "entity": entity,
-                                "new_state": new,
-                                "old_state": old,
-                                "pin_app": pin_app,
-                                "pin_thread": pin_thread,
-                                "kwargs": kwargs,
-                            },
-                        )
+                    executed = await self.dispatch_worker(
+                        name,
+                        {
+                            "id": uuid_,
+                            "name": name,
+                            "objectid": self.AD.app_management.objects[name]["id"],
+                            "type": "state",
+                            "function": funcref,
+                            "attribute": attribute,
+                            "entity": entity,
+                            "new_state": new,
+                            "old_state": old,
+                            "pin_app": pin_app,
+                            "pin_thread": pin_thread,
+                            "kwargs": kwargs,
+                        },
+                    )
 
         return executed
 
@@ -737,31 +984,34 @@ class Threading:
 
         #
         # Callback level constraints
+        # (evaluated against the registered kwargs so nothing is copied for callbacks that are constrained out)
         #
-        myargs = utils.deepcopy(args)
-        if "kwargs" in myargs:
-            for arg in myargs["kwargs"].keys():
-                constrained = await self.check_constraint(
-                    arg, myargs["kwargs"][arg], self.AD.app_management.objects[name]["object"],
-                )
+        if "kwargs" in args:
+            for arg, value in list(args["kwargs"].items()):
+                constrained = await self.check_constraint(arg, value, self.AD.app_management.objects[name]["object"])
                 if not constrained:
                     unconstrained = False
-            if not await self.check_time_constraint(myargs["kwargs"], name):
+            if not await self.check_time_constraint(args["kwargs"], name):
                 unconstrained = False
-            elif not await self.check_days_constraint(myargs["kwargs"], name):
+            elif not await self.check_days_constraint(args["kwargs"], name):
                 unconstrained = False
 
         if unconstrained:
+            #
+            # args is built fresh for each dispatch and state/event/log data arrive as frozen snapshots shared by all
+            # the callbacks for an event, so only kwargs needs a copy to stop the worker annotating the registration
+            #
+            myargs = args.copy()
+            myargs["kwargs"] = dict(args["kwargs"])
             #
             # It's going to happen
             #
             if "__silent" in args["kwargs"] and args["kwargs"]["__silent"] is True:
                 pass
             else:
-                await self.add_to_state("_threading", "admin", "sensor.callbacks_total_fired", 1)
-                await self.add_to_attr(
-                    "_threading", "admin", "{}_callback.{}".format(myargs["type"], myargs["id"]), "fired", 1,
-                )
+                self.callbacks_total_fired += 1
+                self.add_to_pending_attr("{}_callback.{}".format(myargs["type"], myargs["id"]), "fired", 1)
+                self.stats_dirty = True
             #
             # And Q
             #
@@ -769,7 +1019,7 @@ class Threading:
                 f = asyncio.ensure_future(self.async_worker(myargs))
                 self.AD.futures.add_future(name, f)
             else:
-                self.select_q(myargs)
+                await self.select_q(myargs)
             return True
         else:
             return False
@@ -954,8 +1204,6 @@ class Threading:
                 if not self.AD.stopping:
                     self.logger.warning("Found stale callback for %s - discarding", name)
 
-            q.task_done()
-
     def report_callback_sig(self, name, type, funcref, args):
 
         error_logger = logging.getLogger("Error.{}".format(name))
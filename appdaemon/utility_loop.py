@@ -52,6 +52,7 @@ class Utility:
         await self.AD.threading.init_admin_stats()
         await self.AD.threading.create_initial_threads()
         await self.AD.app_management.init_admin_stats()
+        await self.AD.state.init_admin_stats()
 
         #
         # Start the web server
@@ -167,9 +168,14 @@ class Utility:
 
                     await self.AD.threading.check_overdue_and_dead_threads()
 
+                    # Flush thread stats to the admin namespace if there is no admin loop to do it
+
+                    if self.AD.admin_loop is None:
+                        await self.AD.threading.update_admin_stats()
+
                     # Save any hybrid namespaces
 
-                    self.AD.state.save_hybrid_namespaces()
+                    await self.AD.state.save_hybrid_namespaces()
 
                     # Run utility for each plugin
 
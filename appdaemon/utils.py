@@ -7,14 +7,17 @@ import time
 import cProfile
 import io
 import pstats
-import shelve
+import pickle
+import struct
 import threading
+import zlib
 import datetime
 import dateutil.parser
 import yaml
 import copy
 import json
 import inspect
+from collections import deque
 from functools import wraps
 from appdaemon.version import __version__  # noqa: F401
 
@@ -78,21 +81,133 @@ class Formatter(object):
         return "(%s)" % (",".join(items) + self.lfchar + self.htchar * indent)
 
 
-class PersistentDict(shelve.DbfilenameShelf):
+class PersistentDict(dict):
     """
-    Dict-like object that uses a Shelf to persist its contents.
+    Dict-like object that persists its contents to an append-only journal file.
+
+    Each change is appended to the journal as a single record, so the cost of a write doesn't grow with the size
+    of the dict. If ``safe`` is set changes are written as they are made, otherwise the changed keys are tracked
+    and written by ``sync()``, or by ``collect()`` and ``flush()`` to do the writing in another thread. Records are
+    on disk once the write returns. Once most of the journal is stale records it is compacted by rewriting just the
+    live entries, and when the file is opened the journal is replayed to rebuild the dict, dropping any partial or
+    corrupt record at the end.
     """
 
+    # Record length and CRC of the pickled record that follows
+    header = struct.Struct(">II")
+    compact_min_records = 1000
+
     def __init__(self, filename, safe, *args, **kwargs):
-        # writeback=True allows for mutating objects in place, like with a dict.
-        super().__init__(filename, writeback=True)
+        super().__init__()
+        self.filename = filename
         self.safe = safe
         self.rlock = threading.RLock()
+        # Keys changed since the last write, when not in safe mode
+        self.dirty = set()
+        # Encoded records waiting to be written, and the lock held while writing them
+        self.outbox = deque()
+        self.file_lock = threading.Lock()
+        self.records = 0
+        self.bytes_written = 0
+        self.replay()
+        self.file = open(self.filename, "ab")
         self.update(*args, **kwargs)
 
-    def __contains__(self, key):
+    def replay(self):
+        if not os.path.isfile(self.filename):
+            return
+
+        with open(self.filename, "rb") as f:
+            data = f.read()
+
+        offset = 0
+        while offset + self.header.size <= len(data):
+            length, crc = self.header.unpack_from(data, offset)
+            record = data[offset + self.header.size : offset + self.header.size + length]
+            if len(record) < length or zlib.crc32(record) != crc:
+                break
+            deleted, key, value = pickle.loads(record)
+            if deleted:
+                super().pop(key, None)
+            else:
+                super().__setitem__(key, value)
+            offset += self.header.size + length
+            self.records += 1
+
+        if offset < len(data):
+            # A partial record left by an interrupted write, drop it so new records follow on from good data
+            with open(self.filename, "r+b") as f:
+                f.truncate(offset)
+
+    def encode(self, key):
+        if key in self:
+            record = pickle.dumps((False, key, dict.__getitem__(self, key)), pickle.HIGHEST_PROTOCOL)
+        else:
+            record = pickle.dumps((True, key, None), pickle.HIGHEST_PROTOCOL)
+        return self.header.pack(len(record), zlib.crc32(record)) + record
+
+    def collect(self, keys=None):
+        """Encodes the records for the given keys, or the dirty keys, and queues them for ``flush()``"""
         with self.rlock:
-            return super().__contains__(key)
+            if keys is None:
+                keys, self.dirty = self.dirty, set()
+            if not keys:
+                return
+            if self.records + len(keys) > max(self.compact_min_records, 2 * len(self)):
+                # Most of the journal is stale records, so replace it with just the live entries
+                self.outbox.append((True, b"".join(self.encode(key) for key in self)))
+                self.records = len(self)
+                self.dirty.clear()
+            else:
+                self.outbox.append((False, b"".join(self.encode(key) for key in keys)))
+                self.records += len(keys)
+
+    def flush(self):
+        """Writes the records queued by ``collect()`` to the journal, returning the number of bytes written
+
+        The records are encoded when they are collected, so this can be run in another thread while the dict
+        continues to change. Appended records are fsynced once per call, after the last of them.
+        """
+        written = 0
+        appended = False
+        with self.file_lock:
+            while self.outbox:
+                compact, data = self.outbox.popleft()
+                if compact:
+                    tmp_file = "{}.tmp".format(self.filename)
+                    with open(tmp_file, "wb") as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    self.file.close()
+                    os.replace(tmp_file, self.filename)
+                    self.fsync_dir()
+                    self.file = open(self.filename, "ab")
+                else:
+                    self.file.write(data)
+                    appended = True
+                written += len(data)
+            if appended:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            self.bytes_written += written
+        return written
+
+    def fsync_dir(self):
+        # The rename of a compacted journal is only durable once its directory is synced, where that can be done
+        if os.name == "posix":
+            fd = os.open(os.path.dirname(os.path.abspath(self.filename)), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def changed(self, keys):
+        if self.safe:
+            self.collect(keys)
+            self.flush()
+        else:
+            self.dirty.update(keys)
 
     def __copy__(self):
         return dict(self)
@@ -100,43 +215,64 @@ class PersistentDict(shelve.DbfilenameShelf):
     def __deepcopy__(self, memo):
         return copy.deepcopy(dict(self), memo=memo)
 
+    def __reduce__(self):
+        return dict, (dict(self),)
+
     def __delitem__(self, key):
         with self.rlock:
             super().__delitem__(key)
+            self.changed([key])
 
-    def __getitem__(self, key):
-        with self.rlock:
-            return super().__getitem__(key)
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, dict(self))
 
-    def __iter__(self):
+    def __setitem__(self, key, val):
         with self.rlock:
-            for item in super().__iter__():
-                yield item
+            super().__setitem__(key, val)
+            self.changed([key])
 
-    def __len__(self):
+    def clear(self):
         with self.rlock:
-            return super().__len__()
+            keys = list(self)
+            super().clear()
+            self.changed(keys)
 
-    def __repr__(self):
-        return "%s(%r)" % (type(self).__name__, dict(self))
+    def pop(self, key, *default):
+        with self.rlock:
+            if key in self:
+                value = super().pop(key)
+                self.changed([key])
+                return value
+            return super().pop(key, *default)
 
-    def __setitem__(self, key, val):
+    def popitem(self):
         with self.rlock:
-            super().__setitem__(key, val)
-            if self.safe:
-                self.sync()
+            key, value = super().popitem()
+            self.changed([key])
+            return key, value
 
-    def sync(self):
+    def setdefault(self, key, default=None):
         with self.rlock:
-            super().sync()
+            if key not in self:
+                self[key] = default
+            return self[key]
 
-    def update(self, save=True, *args, **kwargs):
+    def update(self, *args, **kwargs):
         with self.rlock:
-            for key, value in dict(*args, **kwargs).items():
-                # use super().__setitem__() to prevent multiple save() calls
+            items = dict(*args, **kwargs)
+            for key, value in items.items():
                 super().__setitem__(key, value)
-                if self.safe and save:
-                    self.sync()
+            # All the records go in with a single write
+            self.changed(list(items))
+
+    def sync(self):
+        self.collect()
+        self.flush()
+
+    def close(self):
+        self.sync()
+        with self.file_lock:
+            self.file.close()
 
 
 class AttrDict(dict):
@@ -363,6 +499,145 @@ def deepcopy(data):
     return result
 
 
+class FrozenDict(dict):
+    """
+    Read-only dict used to share state and event snapshots between the event loop and worker threads without
+    copying them for every callback. copy() returns a mutable deep copy for callers that need to modify it.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("{} is read-only, use copy() to get a modifiable version".format(type(self).__name__))
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+    def copy(self):
+        return deepcopy(self)
+
+    def __copy__(self):
+        return deepcopy(self)
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self)
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+class FrozenList(list):
+    """
+    Read-only list counterpart of FrozenDict.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("{} is read-only, use copy() to get a modifiable version".format(type(self).__name__))
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+
+    def copy(self):
+        return deepcopy(self)
+
+    def __copy__(self):
+        return deepcopy(self)
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self)
+
+    def __reduce__(self):
+        return FrozenList, (list(self),)
+
+
+def freeze(data):
+    """Returns a read-only snapshot of data, reusing any part of it that is already frozen"""
+
+    if isinstance(data, (FrozenDict, FrozenList)):
+        return data
+    elif isinstance(data, dict):
+        return FrozenDict((key, freeze(value)) for key, value in data.items())
+    elif isinstance(data, list):
+        return FrozenList(freeze(item) for item in data)
+    elif isinstance(data, tuple):
+        return tuple(freeze(item) for item in data)
+    else:
+        return data
+
+
+class CopyOnWriteDict(dict):
+    """
+    Modifiable view of a FrozenDict that shares as much of it as possible. It starts out as a shallow copy, and each
+    nested dict or list is only copied the first time it is read, so the parts of a state that are never touched are
+    never copied.
+
+    Iteration goes through ``keys()`` and ``__getitem__()`` rather than the dict internals, so ``dict(d)``,
+    ``{**d}``, ``f(**d)`` and JSON encoding all see the thawed values too.
+    """
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if isinstance(value, (FrozenDict, FrozenList)):
+            value = thaw(value)
+            super().__setitem__(key, value)
+        return value
+
+    def __iter__(self):
+        return super().__iter__()
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def pop(self, key, *default):
+        return thaw(super().pop(key, *default))
+
+    def popitem(self):
+        key, value = super().popitem()
+        return key, thaw(value)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def copy(self):
+        return deepcopy(self)
+
+    def __copy__(self):
+        return CopyOnWriteDict(self)
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self)
+
+    def __reduce__(self):
+        return dict, (self.items(),)
+
+
+def thaw(data):
+    """Returns a modifiable version of a frozen snapshot, which only copies the parts of it that are read"""
+
+    if isinstance(data, FrozenDict):
+        return CopyOnWriteDict(data)
+    elif isinstance(data, FrozenList):
+        return [thaw(item) for item in data]
+    else:
+        return data
+
+
+#
+# Frozen snapshots dump like the dicts and lists they stand in for
+#
+for _dumper in (yaml.Dumper, yaml.SafeDumper):
+    yaml.add_representer(FrozenDict, yaml.representer.SafeRepresenter.represent_dict, Dumper=_dumper)
+    yaml.add_representer(FrozenList, yaml.representer.SafeRepresenter.represent_list, Dumper=_dumper)
+    yaml.add_representer(CopyOnWriteDict, yaml.representer.SafeRepresenter.represent_dict, Dumper=_dumper)
+
+
 def find_path(name):
     for path in [
         os.path.join(os.path.expanduser("~"), ".homeassistant"),
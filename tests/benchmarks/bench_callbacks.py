@@ -0,0 +1,157 @@
+"""
+Callback lookup benchmarks, run from the repository root with:
+
+    PYTHONPATH=. python tests/benchmarks/bench_callbacks.py
+
+Not collected by pytest, the numbers depend on the machine they run on.
+"""
+
+import logging
+import random
+import statistics
+import time
+import uuid
+
+from appdaemon.callbacks import Callbacks
+
+
+class FakeLogging:
+    def get_child(self, name):
+        return logging.getLogger("AppDaemon.{}".format(name))
+
+    def get_diag(self):
+        return logging.getLogger("Diag")
+
+
+class FakeAD:
+    def __init__(self):
+        self.logging = FakeLogging()
+
+
+def timed(fn, repeat):
+    """Median time of fn() in microseconds"""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1e6
+
+
+def make_state_callbacks(count, entity_ids, seed=1):
+    """count state callbacks spread over 20 apps, mostly for single entities with a few per domain and for all"""
+
+    rng = random.Random(seed)
+    callbacks = Callbacks(FakeAD())
+    for i in range(count):
+        name = "app{}".format(i % 20)
+        choice = rng.random()
+        if choice < 0.01:
+            entity = None
+        elif choice < 0.05:
+            entity = rng.choice(entity_ids).split(".")[0]
+        else:
+            entity = rng.choice(entity_ids)
+        cb = {"name": name, "type": "state", "entity": entity, "namespace": "default", "kwargs": {}}
+        handle = uuid.uuid4().hex
+        callbacks.callbacks.setdefault(name, {})[handle] = cb
+        callbacks.index_callback(handle, cb)
+    return callbacks
+
+
+def scan_state_callbacks(callbacks, namespace, entity_id):
+    """How the callbacks for a state change were found before the index - a check of every callback"""
+
+    device, entity = entity_id.split(".")
+    matches = []
+    for name in callbacks.callbacks.keys():
+        for uuid_ in callbacks.callbacks[name]:
+            callback = callbacks.callbacks[name][uuid_]
+            if callback["type"] == "state" and (
+                callback["namespace"] == namespace or callback["namespace"] == "global" or namespace == "global"
+            ):
+                cdevice = None
+                centity = None
+                if callback["entity"] is not None:
+                    if "." not in callback["entity"]:
+                        cdevice = callback["entity"]
+                    else:
+                        cdevice, centity = callback["entity"].split(".")
+                if (
+                    cdevice is None
+                    or (centity is None and cdevice == device)
+                    or (cdevice == device and centity == entity)
+                ):
+                    matches.append((name, uuid_))
+    return matches
+
+
+def bench_state_callbacks():
+    entity_ids = ["{}.entity_{}".format(domain, i) for domain in ("light", "switch", "sensor") for i in range(333)]
+    rng = random.Random(2)
+
+    print("State callbacks for one state change, 999 entities - median time per lookup in microseconds")
+    print("{:>10} {:>10} {:>10}".format("callbacks", "index", "scan"))
+    for count in (1000, 10000, 100000):
+        callbacks = make_state_callbacks(count, entity_ids)
+        index = timed(lambda: callbacks.get_state_callbacks("default", rng.choice(entity_ids)), 2000)
+        scan = timed(lambda: scan_state_callbacks(callbacks, "default", rng.choice(entity_ids)), 20)
+        print("{:>10} {:>10.2f} {:>10.0f}".format(count, index, scan))
+
+
+class EventTypeCallbacks(Callbacks):
+    """How event callbacks were indexed before the topic index - by event type only"""
+
+    @staticmethod
+    def topic_filter(kwargs):
+        return None
+
+
+def make_topic_callbacks(kind, count, topics):
+    """count MQTT_MESSAGE callbacks spread over 20 apps, each filtering on one of topics"""
+
+    callbacks = kind(FakeAD())
+    for i in range(count):
+        name = "app{}".format(i % 20)
+        kwargs = {"topic": topics[i % len(topics)]}
+        cb = {"name": name, "type": "event", "event": "MQTT_MESSAGE", "namespace": "default", "kwargs": kwargs}
+        handle = uuid.uuid4().hex
+        callbacks.callbacks.setdefault(name, {})[handle] = cb
+        callbacks.index_callback(handle, cb)
+    return callbacks
+
+
+def match_event_callbacks(callbacks, namespace, data):
+    """The callbacks the index returns for an event, filtered on their kwargs like process_event_callbacks()"""
+
+    matches = []
+    for name, handle in callbacks.get_event_callbacks(namespace, data["event_type"], data["data"]):
+        kwargs = callbacks.callbacks[name][handle]["kwargs"]
+        if all(kwargs[key] == data["data"][key] for key in kwargs if key in data["data"]):
+            matches.append((name, handle))
+    return matches
+
+
+def bench_topic_callbacks():
+    rng = random.Random(3)
+
+    print("Event callbacks for one MQTT message, one topic per callback - median time per lookup in microseconds")
+    print("{:>10} {:>12} {:>12}".format("callbacks", "topic index", "event type"))
+    for count in (100, 1000, 10000):
+        topics = ["home/device_{}/state".format(i) for i in range(count)]
+
+        def message():
+            return {"event_type": "MQTT_MESSAGE", "data": {"topic": rng.choice(topics), "wildcard": None}}
+
+        results = []
+        for kind in (Callbacks, EventTypeCallbacks):
+            callbacks = make_topic_callbacks(kind, count, topics)
+            results.append(timed(lambda: match_event_callbacks(callbacks, "default", message()), 200))
+        print("{:>10} {:>12.2f} {:>12.1f}".format(count, *results))
+
+
+if __name__ == "__main__":
+    bench_state_callbacks()
+    print()
+    bench_topic_callbacks()
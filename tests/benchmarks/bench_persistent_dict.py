@@ -0,0 +1,102 @@
+"""
+Persistent namespace benchmarks, run from the repository root with:
+
+    PYTHONPATH=. python tests/benchmarks/bench_persistent_dict.py
+
+Compares the journal of PersistentDict with the writeback shelve it replaced. Not collected by pytest, the numbers
+depend on the machine, and the file system the temporary files are written to.
+"""
+
+import os
+import shelve
+import statistics
+import tempfile
+import time
+
+from appdaemon import utils
+
+
+class ShelveDict(shelve.DbfilenameShelf):
+    """How persistent namespaces were stored before the journal"""
+
+    def __init__(self, filename, safe):
+        super().__init__(filename, writeback=True)
+        self.safe = safe
+
+    def __setitem__(self, key, val):
+        super().__setitem__(key, val)
+        if self.safe:
+            self.sync()
+
+
+def timed(fn, repeat):
+    """Median time of fn() in microseconds"""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1e6
+
+
+def entity(i, n=0):
+    return {
+        "entity_id": "sensor.entity_{}".format(i),
+        "state": str(n),
+        "attributes": {"friendly_name": "Entity {}".format(i), "unit_of_measurement": "C"},
+        "last_changed": "2020-01-01T00:00:00.000000+00:00",
+    }
+
+
+def fill(data, count):
+    for i in range(count):
+        data["sensor.entity_{}".format(i)] = entity(i)
+    data.sync()
+
+
+def bench(kind, directory, count):
+    if kind == "journal":
+        filename = os.path.join(directory, "{}.journal".format(count))
+        make = utils.PersistentDict
+    else:
+        filename = os.path.join(directory, "{}.shelve".format(count))
+        make = ShelveDict
+
+    data = make(filename, False)
+    fill(data, count)
+    data.close()
+
+    opened = timed(lambda: make(filename, False).close(), 5)
+
+    data = make(filename, True)
+    writes = iter(range(1000000))
+    safe_write = timed(lambda: data.__setitem__("sensor.entity_0", entity(0, next(writes))), 200)
+    data.close()
+
+    data = make(filename, False)
+
+    def sync_ten():
+        n = next(writes)
+        for i in range(10):
+            data["sensor.entity_{}".format(i)] = entity(i, n)
+        data.sync()
+
+    sync = timed(sync_ten, 200)
+    data.close()
+
+    return opened, safe_write, sync
+
+
+def bench_persistent_dict():
+    print("Median times in microseconds")
+    print("{:>9} {:>8} {:>12} {:>12} {:>16}".format("entities", "store", "open", "safe write", "sync 10 changes"))
+    with tempfile.TemporaryDirectory() as directory:
+        for count in (100, 1000, 10000):
+            for kind in ("shelve", "journal"):
+                opened, safe_write, sync = bench(kind, directory, count)
+                print("{:>9} {:>8} {:>12.0f} {:>12.1f} {:>16.1f}".format(count, kind, opened, safe_write, sync))
+
+
+if __name__ == "__main__":
+    bench_persistent_dict()
@@ -0,0 +1,288 @@
+"""
+Scheduler benchmarks, run from the repository root with:
+
+    PYTHONPATH=. python tests/benchmarks/bench_scheduler.py
+
+Not collected by pytest, the numbers depend on the machine they run on.
+"""
+
+import asyncio
+import datetime
+import itertools
+import logging
+import random
+import statistics
+import time
+import uuid
+
+import astral
+import pytz
+
+from appdaemon.scheduler import Scheduler
+
+START = pytz.utc.localize(datetime.datetime(2020, 1, 1))
+
+
+class FakeLogging:
+    def get_child(self, name):
+        return logging.getLogger("AppDaemon.{}".format(name))
+
+    def get_error(self):
+        return logging.getLogger("Error")
+
+    def get_diag(self):
+        return logging.getLogger("Diag")
+
+    def set_tz(self, tz):
+        pass
+
+
+class FakeAppManagement:
+    def __init__(self):
+        self.objects = {"app": {"id": "app", "pin_app": True, "pin_thread": None}}
+
+
+class FakeState:
+    async def add_entity(self, namespace, entity_id, state, attributes=None):
+        pass
+
+    async def set_state(self, name, namespace, entity_id, **kwargs):
+        pass
+
+    async def remove_entity(self, namespace, entity_id):
+        pass
+
+
+class FakeThreading:
+    """Records how late each timer callback is dispatched, against the time it was asked for"""
+
+    def __init__(self):
+        self.lateness = []
+
+    async def dispatch_worker(self, name, args):
+        now = datetime.datetime.now(pytz.utc)
+        kwargs = args["kwargs"]
+        if "interval" in kwargs:
+            requested = kwargs["requested"] + datetime.timedelta(seconds=kwargs["interval"] * kwargs["runs"])
+            kwargs["runs"] += 1
+        else:
+            requested = kwargs["requested"]
+        self.lateness.append((now - requested).total_seconds() * 1000)
+        return True
+
+
+class FakeAD:
+    def __init__(self):
+        self.logging = FakeLogging()
+        self.app_management = FakeAppManagement()
+        self.state = FakeState()
+        self.threading = FakeThreading()
+        self.time_zone = "Europe/London"
+        self.latitude = 51.5
+        self.longitude = -0.1
+        self.elevation = 10
+        self.starttime = None
+        self.endtime = None
+        self.timewarp = 1
+
+
+class SecondScheduler(Scheduler):
+    """Rounds timer timestamps to the second, like insert_schedule() did before millisecond timers"""
+
+    @staticmethod
+    def my_dt_round(dt, base=1, prec=10):
+        return Scheduler.my_dt_round(dt, base=1, prec=prec)
+
+
+def timed(fn, repeat):
+    """Median time of fn() in microseconds"""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1e6
+
+
+def make_timers(count, seed=1):
+    """A Scheduler holding only count timers for one app, spread over a day, without the rest of AppDaemon"""
+
+    rng = random.Random(seed)
+    sched = Scheduler.__new__(Scheduler)
+    sched.schedule = {"app": {}}
+    sched.timer_heap = []
+    sched.timer_sequence = itertools.count()
+    for _ in range(count):
+        handle = uuid.uuid4().hex
+        timestamp = START + datetime.timedelta(milliseconds=rng.randrange(86400 * 1000))
+        sched.schedule["app"][handle] = {"timestamp": timestamp}
+        sched.push_timer("app", handle, timestamp)
+    return sched
+
+
+def scan_next_entries(schedule):
+    """How the next entries were found before the timer heap - two passes over every entry"""
+
+    next_exec = datetime.datetime.now(pytz.utc).replace(year=datetime.MAXYEAR, month=12, day=31)
+    for name in schedule.keys():
+        for entry in schedule[name].keys():
+            if schedule[name][entry]["timestamp"] < next_exec:
+                next_exec = schedule[name][entry]["timestamp"]
+
+    next_entries = []
+    for name in schedule.keys():
+        for entry in schedule[name].keys():
+            if schedule[name][entry]["timestamp"] == next_exec:
+                next_entries.append({"name": name, "uuid": entry, "timestamp": schedule[name][entry]["timestamp"]})
+
+    return next_entries
+
+
+def fire_next(sched, get_next_entries):
+    for entry in get_next_entries():
+        del sched.schedule[entry["name"]][entry["uuid"]]
+
+
+def bench_timer_queue():
+    print("Timer queue - median time per call in microseconds")
+    print("{:>8} {:>12} {:>12} {:>12} {:>16}".format("timers", "push", "fire (heap)", "fire (scan)", "fire, 50% gone"))
+    for count in (1000, 10000, 100000):
+        sched = make_timers(count)
+
+        handles = itertools.count()
+        push = timed(lambda: sched.push_timer("app", next(handles), START), 1000)
+        sched = make_timers(count)
+
+        heap = timed(lambda: fire_next(sched, sched.get_next_entries), 500)
+        scan = timed(lambda: fire_next(sched, lambda: scan_next_entries(sched.schedule)), 20)
+
+        # Cancelled timers are left in the heap, and dropped as they reach the top
+        sched = make_timers(count)
+        for handle in list(sched.schedule["app"])[::2]:
+            del sched.schedule["app"][handle]
+        cancelled = timed(lambda: fire_next(sched, sched.get_next_entries), 500)
+
+        print("{:>8} {:>12.2f} {:>12.2f} {:>12.0f} {:>16.2f}".format(count, push, heap, scan, cancelled))
+
+
+class AstralScheduler(Scheduler):
+    """Computes sunrise and sunset with astral on every call, like the scheduler did before the solar event cache"""
+
+    def next_sunrise(self, offset=0):
+        return self.next_astral("sunrise", offset)
+
+    def next_sunset(self, offset=0):
+        return self.next_astral("sunset", offset)
+
+    def next_astral(self, event, offset):
+        now = self.get_now_sync()
+        mod = offset
+        while True:
+            try:
+                next_dt = getattr(self.location, event)(
+                    (now + datetime.timedelta(seconds=offset) + datetime.timedelta(days=mod)).date(), local=False
+                )
+                if next_dt > now:
+                    return next_dt
+            except astral.AstralError:
+                pass
+            mod += 1
+
+
+def run_coroutine(coro):
+    """Runs a coroutine that never waits on anything, without the overhead of an event loop"""
+
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError("Coroutine waited")
+
+
+def bench_sun_constraints():
+    print("Solar constraint checks - median time per call in microseconds")
+    print("{:>48} {:>8} {:>10} {:>8}".format("", "cache", "new day", "astral"))
+
+    checks = (
+        ("sun_up()", lambda sched: sched.sun_up()),
+        ('now_is_between("sunset", "sunrise")', lambda sched: sched.now_is_between("sunset", "sunrise")),
+        (
+            'now_is_between("sunset - 00:30:00", "23:00:00")',
+            lambda sched: sched.now_is_between("sunset - 00:30:00", "23:00:00"),
+        ),
+    )
+    sched = Scheduler(FakeAD())
+    astral_sched = AstralScheduler(FakeAD())
+
+    def new_day(check):
+        # The first check after the date changes computes the solar events for the days it needs
+        sched.sun_events = {}
+        return run_coroutine(check(sched))
+
+    for label, check in checks:
+        cached = timed(lambda: run_coroutine(check(sched)), 2000)
+        uncached = timed(lambda: new_day(check), 500)
+        computed = timed(lambda: run_coroutine(check(astral_sched)), 2000)
+        print("{:>48} {:>8.1f} {:>10.1f} {:>8.1f}".format(label, cached, uncached, computed))
+
+
+def callback(kwargs):
+    pass
+
+
+def run_timers(kind, repeat, count, seed=1):
+    """Runs count timers through the realtime loop and returns how late each callback was, in milliseconds"""
+
+    rng = random.Random(seed)
+    sched = kind(FakeAD())
+
+    async def scenario():
+        sched.AD.loop = asyncio.get_running_loop()
+        sched.wakeup = asyncio.Event()
+        loop = asyncio.ensure_future(sched.realtime_loop())
+        now = datetime.datetime.now(pytz.utc)
+        if repeat:
+            # A 100ms polling timer
+            requested = now + datetime.timedelta(seconds=0.1)
+            await sched.insert_schedule(
+                "app", requested, callback, True, None, interval=0.1, requested=requested, runs=0
+            )
+        else:
+            # Debounce style delays, spread over two seconds
+            for _ in range(count):
+                requested = now + datetime.timedelta(seconds=rng.uniform(0.05, 2))
+                await sched.insert_schedule("app", requested, callback, False, None, requested=requested)
+        sched.wakeup.set()
+        while len(sched.AD.threading.lateness) < count:
+            await asyncio.sleep(0.01)
+        sched.stop()
+        await loop
+
+    asyncio.run(scenario())
+    return sched.AD.threading.lateness[:count]
+
+
+def bench_timer_jitter():
+    print("Timer lateness against the requested time, in milliseconds (negative is early)")
+    print("{:>30} {:>8} {:>8} {:>8} {:>8}".format("timers", "median", "p95", "min", "max"))
+    for label, kind, repeat in (
+        ("200 run_in, second rounding", SecondScheduler, False),
+        ("200 run_in, millisecond", Scheduler, False),
+        ("run_every(0.1), 100 runs", Scheduler, True),
+    ):
+        lateness = sorted(run_timers(kind, repeat, 100 if repeat else 200))
+        p95 = lateness[int(len(lateness) * 0.95) - 1]
+        print(
+            "{:>30} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f}".format(
+                label, statistics.median(lateness), p95, lateness[0], lateness[-1]
+            )
+        )
+
+
+if __name__ == "__main__":
+    bench_timer_queue()
+    print()
+    bench_timer_jitter()
+    print()
+    bench_sun_constraints()
@@ -0,0 +1,166 @@
+"""
+Event stream benchmarks, run from the repository root with:
+
+    PYTHONPATH=. python tests/benchmarks/bench_stream.py
+
+Compares handing events to the stream directly with the deepcopy and thread_async hop that was used before. Not
+collected by pytest, the numbers depend on the machine they run on.
+"""
+
+import asyncio
+import copy
+import logging
+import statistics
+import time
+
+from appdaemon.http import HTTP
+from appdaemon.stream.adstream import ADStream
+from appdaemon.thread_async import ThreadAsync
+
+
+class FakeLogging:
+    def get_child(self, name):
+        return logging.getLogger("AppDaemon.{}".format(name))
+
+    def get_access(self):
+        return logging.getLogger("AppDaemon.access")
+
+
+class FakeHTTP:
+    password = None
+    stream_queue_size = 0
+    stream_max_lag = 0
+
+
+class FakeState:
+    def get_entity(self, namespace=None, entity_id=None, name=None):
+        return {}
+
+
+class FakeEvents:
+    async def process_event(self, namespace, data):
+        pass
+
+
+class FakeAD:
+    def __init__(self):
+        self.logging = FakeLogging()
+        self.http = FakeHTTP()
+        self.state = FakeState()
+        self.events = FakeEvents()
+        self.thread_async = ThreadAsync(self)
+
+
+class FakeStream:
+    """Records when each message reaches the client connection"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def run(self):
+        pass
+
+    def set_client_name(self, client_name):
+        pass
+
+    async def sendclient(self, data):
+        self.sent.append(time.perf_counter())
+
+    async def sendencoded(self, msg):
+        self.sent.append(time.perf_counter())
+
+
+class FakeStreamHandler:
+    def __init__(self):
+        self.stream = FakeStream()
+
+    def makeStream(self, ad, request, **kwargs):
+        return self.stream
+
+
+def state_changed(n):
+    """A Home Assistant state_changed event, as it reaches Events.process_event()"""
+
+    def light(state):
+        return {
+            "entity_id": "light.kitchen",
+            "state": state,
+            "attributes": {
+                "brightness": n % 256,
+                "color_mode": "hs",
+                "hs_color": [30.0, 70.0],
+                "rgb_color": [255, 167, 76],
+                "supported_color_modes": ["color_temp", "hs"],
+                "friendly_name": "Kitchen",
+                "supported_features": 40,
+            },
+            "last_changed": "2020-01-01T00:00:00.000000+00:00",
+            "last_updated": "2020-01-01T00:00:00.000000+00:00",
+            "context": {"id": "01G0000000000000000000000{}".format(n), "parent_id": None, "user_id": None},
+        }
+
+    return {
+        "event_type": "state_changed",
+        "data": {"entity_id": "light.kitchen", "old_state": light("off"), "new_state": light("on")},
+        "origin": "LOCAL",
+        "time_fired": "2020-01-01T00:00:00.000000+00:00",
+        "context": {"id": "01G0000000000000000000000{}".format(n), "parent_id": None, "user_id": None},
+    }
+
+
+async def hop(http, namespace, data):
+    """How Events.process_event() and HTTP.stream_update() streamed an event before"""
+
+    mydata = copy.deepcopy(data)
+    mydata["namespace"] = namespace
+    http.AD.thread_async.call_async_no_wait(http.stream.process_event, mydata)
+
+
+async def direct(http, namespace, data):
+    """How they stream an event now"""
+
+    await HTTP.stream_update(http, namespace, dict(data))
+
+
+async def latencies(send, count):
+    ad = FakeAD()
+    http = HTTP.__new__(HTTP)
+    http.AD = ad
+    http.stream = ADStream(ad, None, "test")
+    http.stream.stream_handler = FakeStreamHandler()
+    sent = http.stream.stream_handler.stream.sent
+    thread_async = asyncio.ensure_future(ad.thread_async.loop())
+
+    await http.stream.on_connect(None)
+    handler = next(iter(http.stream.handlers.values()))
+    await handler._request({"request_type": "hello", "request_id": 1, "data": {"client_name": "bench"}})
+    await handler._request(
+        {"request_type": "listen_state", "request_id": 2, "data": {"namespace": "default", "entity_id": "light.*"}}
+    )
+
+    times = []
+    for n in range(count):
+        data = state_changed(n)
+        delivered = len(sent) + 1
+        start = time.perf_counter()
+        await send(http, "default", data)
+        while len(sent) < delivered:
+            await asyncio.sleep(0)
+        times.append((sent[-1] - start) * 1e6)
+
+    handler._stop_sending()
+    ad.thread_async.stop()
+    await thread_async
+    return times
+
+
+def bench_stream_latency():
+    print("One state_changed event to one client, from process_event() to the client connection, in microseconds")
+    print("{:>24} {:>8} {:>8}".format("", "median", "p95"))
+    for label, send in (("deepcopy + thread_async", hop), ("direct", direct)):
+        times = sorted(asyncio.run(latencies(send, 5000)))
+        print("{:>24} {:>8.1f} {:>8.1f}".format(label, statistics.median(times), times[int(len(times) * 0.95) - 1]))
+
+
+if __name__ == "__main__":
+    bench_stream_latency()
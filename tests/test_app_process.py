@@ -0,0 +1,81 @@
+import concurrent.futures
+import logging
+
+from appdaemon.adapi import ADAPI
+from appdaemon.app_process import AppProcess
+
+
+class PingApp(ADAPI):
+    """Runs in the worker process - its ADAPI methods are forwarded to the main process"""
+
+    def start(self):
+        handle = self.run_in(self.tick, 5)
+        self.logger.info("started %s", handle)
+
+    def tick(self, kwargs):
+        self.logger.info("tick %s", kwargs["count"])
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class FakeLogging:
+    def get_child(self, name):
+        return logging.getLogger("AppDaemon.{}".format(name))
+
+
+class FakeAD:
+    def __init__(self, executor):
+        self.logging = FakeLogging()
+        self.executor = executor
+
+
+class MainApp:
+    """Stands in for the app object AppDaemon keeps in the main process"""
+
+    name = "ping"
+
+    def __init__(self):
+        self.logger = logging.getLogger("test_app_process.ping")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.handler = ListHandler()
+        self.logger.addHandler(self.handler)
+        self.err = logging.getLogger("test_app_process.ping.err")
+        self.scheduled = []
+
+    def run_in(self, callback, delay):
+        self.scheduled.append((callback, delay))
+        return "handle-1"
+
+
+def test_app_process_round_trip():
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    app = MainApp()
+    process = AppProcess(FakeAD(executor), "ping", app, {"module": PingApp.__module__, "class": "PingApp"})
+    process.start()
+    try:
+        # The API call comes back to the main process, with the callback replaced by a stub for it
+        process.call("start")
+        assert len(app.scheduled) == 1
+        callback, delay = app.scheduled[0]
+        assert delay == 5
+        assert callback.__name__ == "tick"
+        assert callback is process.get_callback("tick")
+
+        # Calling the stub runs the callback in the worker process
+        callback({"count": 1})
+
+        # Log records are relayed before the call completes, as they share the pipe
+        assert app.handler.messages == ["started handle-1", "tick 1"]
+    finally:
+        process.stop()
+        executor.shutdown()
+
+    assert process.process is None
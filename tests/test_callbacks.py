@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import random
+import uuid
+
+from appdaemon.callbacks import Callbacks
+
+NAMESPACES = ("default", "hass2", "global")
+DOMAINS = ("light", "switch", "sensor")
+ENTITIES = ("kitchen", "hall", "porch")
+
+
+class FakeLogging:
+    def get_child(self, name):
+        return logging.getLogger("AppDaemon.{}".format(name))
+
+    def get_diag(self):
+        return logging.getLogger("Diag")
+
+
+class FakeState:
+    async def remove_entity(self, namespace, entity_id):
+        pass
+
+
+class FakeAD:
+    def __init__(self):
+        self.logging = FakeLogging()
+        self.state = FakeState()
+
+
+def callback(entity, attribute, old, new, kwargs):
+    pass
+
+
+def state_callback(name, namespace, entity):
+    return {
+        "name": name,
+        "id": name,
+        "type": "state",
+        "function": callback,
+        "entity": entity,
+        "namespace": namespace,
+        "pin_app": True,
+        "pin_thread": None,
+        "kwargs": {},
+    }
+
+
+def listen_state(callbacks, name, namespace, entity):
+    handle = uuid.uuid4().hex
+    cb = state_callback(name, namespace, entity)
+    callbacks.callbacks.setdefault(name, {})[handle] = cb
+    callbacks.index_callback(handle, cb)
+    return handle
+
+
+def cancel_listen_state(callbacks, name, handle):
+    callbacks.unindex_callback(handle, callbacks.callbacks[name][handle])
+    del callbacks.callbacks[name][handle]
+
+
+def scan_state_callbacks(callbacks, namespace, entity_id):
+    """The state callbacks for a change, found by checking every callback like process_state_callbacks() used to"""
+
+    device, entity = entity_id.split(".")
+    matches = []
+    for name in callbacks.callbacks:
+        for handle, cb in callbacks.callbacks[name].items():
+            if cb["type"] != "state":
+                continue
+            if not (cb["namespace"] == namespace or cb["namespace"] == "global" or namespace == "global"):
+                continue
+            if cb["entity"] is None:
+                matches.append((name, handle))
+            elif "." not in cb["entity"]:
+                if cb["entity"] == device:
+                    matches.append((name, handle))
+            elif cb["entity"] == entity_id:
+                matches.append((name, handle))
+    return sorted(matches)
+
+
+def random_entity(rng):
+    choice = rng.random()
+    if choice < 0.1:
+        return None
+    if choice < 0.3:
+        return rng.choice(DOMAINS)
+    return "{}.{}".format(rng.choice(DOMAINS), rng.choice(ENTITIES))
+
+
+def all_entity_ids():
+    return ["{}.{}".format(domain, entity) for domain in DOMAINS for entity in ENTITIES]
+
+
+def check_against_scan(callbacks):
+    for namespace in NAMESPACES:
+        for entity_id in all_entity_ids():
+            assert sorted(callbacks.get_state_callbacks(namespace, entity_id)) == scan_state_callbacks(
+                callbacks, namespace, entity_id
+            )
+
+
+def test_state_callbacks_match_like_a_scan():
+    callbacks = Callbacks(FakeAD())
+    rng = random.Random(1)
+
+    handles = []
+    for _ in range(500):
+        name = rng.choice(("app1", "app2", "app3"))
+        handles.append((name, listen_state(callbacks, name, rng.choice(NAMESPACES), random_entity(rng))))
+    check_against_scan(callbacks)
+
+    rng.shuffle(handles)
+    for name, handle in handles[:250]:
+        cancel_listen_state(callbacks, name, handle)
+    check_against_scan(callbacks)
+
+    for name, handle in handles[250:]:
+        cancel_listen_state(callbacks, name, handle)
+    assert callbacks.state_index == {}
+
+
+def test_state_callback_matching():
+    callbacks = Callbacks(FakeAD())
+    everything = listen_state(callbacks, "app", "default", None)
+    lights = listen_state(callbacks, "app", "default", "light")
+    kitchen = listen_state(callbacks, "app", "default", "light.kitchen")
+    other_namespace = listen_state(callbacks, "app", "hass2", "light.kitchen")
+    all_namespaces = listen_state(callbacks, "app", "global", "light.kitchen")
+
+    def matches(namespace, entity_id):
+        return {handle for _, handle in callbacks.get_state_callbacks(namespace, entity_id)}
+
+    assert matches("default", "light.kitchen") == {everything, lights, kitchen, all_namespaces}
+    assert matches("default", "light.hall") == {everything, lights}
+    assert matches("default", "switch.kitchen") == {everything}
+    assert matches("hass2", "light.kitchen") == {other_namespace, all_namespaces}
+    assert matches("hass2", "light.hall") == set()
+    # A change in the global namespace is seen by callbacks in every namespace
+    assert matches("global", "light.kitchen") == {everything, lights, kitchen, other_namespace, all_namespaces}
+
+    cancel_listen_state(callbacks, "app", kitchen)
+    assert matches("default", "light.kitchen") == {everything, lights, all_namespaces}
+
+
+def test_cleared_callbacks_are_unindexed():
+    callbacks = Callbacks(FakeAD())
+    listen_state(callbacks, "app1", "default", "light.kitchen")
+    listen_state(callbacks, "app1", "default", None)
+    kept = listen_state(callbacks, "app2", "default", "light.kitchen")
+
+    asyncio.run(callbacks.clear_callbacks("app1"))
+
+    assert callbacks.get_state_callbacks("default", "light.kitchen") == [("app2", kept)]
+    assert callbacks.get_state_callbacks("default", "switch.hall") == []
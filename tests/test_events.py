@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import random
+
+from appdaemon.callbacks import Callbacks
+from appdaemon.events import Events
+
+
+class FakeLogging:
+    def get_child(self, name):
+        return logging.getLogger("AppDaemon.{}".format(name))
+
+    def get_diag(self):
+        return logging.getLogger("Diag")
+
+
+class FakeAppManagement:
+    def __init__(self):
+        self.objects = {"app": {"id": "app", "pin_app": True, "pin_thread": None}}
+
+
+class FakeState:
+    async def add_entity(self, namespace, entity_id, state, attributes=None):
+        pass
+
+    async def remove_entity(self, namespace, entity_id):
+        pass
+
+
+class FakeThreading:
+    def __init__(self):
+        self.dispatched = []
+
+    def validate_pin(self, name, kwargs):
+        return True
+
+    async def dispatch_worker(self, name, args):
+        self.dispatched.append(args)
+        return True
+
+
+class FakeAD:
+    def __init__(self):
+        self.logging = FakeLogging()
+        self.app_management = FakeAppManagement()
+        self.state = FakeState()
+        self.threading = FakeThreading()
+        self.coalesce_states = None
+        self.callbacks = Callbacks(self)
+        self.events = Events(self)
+
+
+def callback(event, data, kwargs):
+    pass
+
+
+def test_priority_is_not_an_event_filter():
+    ad = FakeAD()
+
+    async def scenario():
+        await ad.events.add_event_callback("app", "default", callback, "notify", priority="high")
+        await ad.events.add_event_callback("app", "default", callback, "notify", priority="high", target="phone")
+        await ad.events.process_event_callbacks(
+            "default", {"event_type": "notify", "data": {"priority": "low", "target": "tablet"}}
+        )
+
+    asyncio.run(scenario())
+
+    # The event's own priority doesn't filter it out, but other keyword arguments still do
+    assert [args["kwargs"] for args in ad.threading.dispatched] == [{"priority": "high"}]
+
+
+def test_callback_options_are_not_passed_to_event_callbacks():
+    kwargs = {"priority": "high", "__silent": True, "target": "phone"}
+    assert Events.sanitize_event_kwargs(None, kwargs) == {"target": "phone"}
+    assert kwargs == {"priority": "high", "__silent": True, "target": "phone"}
+
+
+def mqtt_message(topic, wildcard=None):
+    return {"event_type": "MQTT_MESSAGE", "data": {"topic": topic, "wildcard": wildcard, "payload": "on"}}
+
+
+def dispatched_handles(ad, namespace, data):
+    ad.threading.dispatched = []
+    asyncio.run(ad.events.process_event_callbacks(namespace, data))
+    return {args["id"] for args in ad.threading.dispatched}
+
+
+def test_topic_listeners_only_see_their_topic():
+    ad = FakeAD()
+
+    def listen(namespace, event, **kwargs):
+        return asyncio.run(ad.events.add_event_callback("app", namespace, callback, event, **kwargs))
+
+    kitchen = listen("default", "MQTT_MESSAGE", topic="home/kitchen")
+    hall = listen("default", "MQTT_MESSAGE", topic="home/hall")
+    home = listen("default", "MQTT_MESSAGE", wildcard="home/#")
+    both = listen("default", "MQTT_MESSAGE", topic="home/kitchen", wildcard="home/#")
+    other_namespace = listen("mqtt2", "MQTT_MESSAGE", topic="home/kitchen")
+    all_namespaces = listen("global", "MQTT_MESSAGE", topic="home/kitchen")
+    all_messages = listen("default", "MQTT_MESSAGE")
+    all_events = listen("default", None, topic="home/kitchen")
+
+    assert ad.callbacks.event_index == {"default": {"MQTT_MESSAGE": {all_messages: "app"}}}
+
+    assert dispatched_handles(ad, "default", mqtt_message("home/kitchen")) == {
+        kitchen,
+        all_namespaces,
+        all_messages,
+        all_events,
+    }
+    assert dispatched_handles(ad, "default", mqtt_message("home/kitchen", "home/#")) == {
+        kitchen,
+        home,
+        both,
+        all_namespaces,
+        all_messages,
+        all_events,
+    }
+    assert dispatched_handles(ad, "default", mqtt_message("home/hall", "home/#")) == {hall, home, all_messages}
+    assert dispatched_handles(ad, "mqtt2", mqtt_message("home/kitchen")) == {other_namespace, all_namespaces}
+
+    # Filters on fields an event doesn't have are ignored, so a topic filter doesn't hide other events
+    assert dispatched_handles(ad, "default", {"event_type": "MQTT_MESSAGE", "data": {}}) == {
+        kitchen,
+        hall,
+        home,
+        both,
+        all_namespaces,
+        all_messages,
+        all_events,
+    }
+    assert dispatched_handles(ad, "default", {"event_type": "notify", "data": {}}) == {all_events}
+
+    for handle in (kitchen, hall, home, both, all_events):
+        asyncio.run(ad.events.cancel_event_callback("app", handle))
+    assert "default" not in ad.callbacks.topic_index
+    for handle in (other_namespace, all_namespaces, all_messages):
+        asyncio.run(ad.events.cancel_event_callback("app", handle))
+    assert ad.callbacks.topic_index == {}
+    assert ad.callbacks.event_index == {}
+
+
+def scan_event_callbacks(ad, namespace, data):
+    """The event callbacks for an event, found by checking every callback against the event"""
+
+    handles = set()
+    for name in ad.callbacks.callbacks:
+        for handle, cb in ad.callbacks.callbacks[name].items():
+            if not (cb["namespace"] == namespace or cb["namespace"] == "global" or namespace == "global"):
+                continue
+            if cb["event"] is not None and cb["event"] != data["event_type"]:
+                continue
+            if all(cb["kwargs"][key] == data["data"][key] for key in cb["kwargs"] if key in data["data"]):
+                handles.add(handle)
+    return handles
+
+
+def test_topic_index_matches_like_a_scan():
+    ad = FakeAD()
+    rng = random.Random(1)
+    topics = ["home/{}".format(room) for room in ("kitchen", "hall", "porch")]
+    wildcards = ["home/#", "home/+"]
+
+    def random_filter():
+        kwargs = {}
+        if rng.random() < 0.6:
+            kwargs["topic"] = rng.choice(topics)
+        if rng.random() < 0.4:
+            kwargs["wildcard"] = rng.choice(wildcards)
+        return kwargs
+
+    handles = []
+    for _ in range(300):
+        namespace = rng.choice(("default", "mqtt2", "global"))
+        event = rng.choice(("MQTT_MESSAGE", "MQTT_MESSAGE", None))
+        handles.append(asyncio.run(ad.events.add_event_callback("app", namespace, callback, event, **random_filter())))
+
+    events = [mqtt_message(topic, wildcard) for topic in topics for wildcard in wildcards + [None]]
+    events += [{"event_type": "MQTT_MESSAGE", "data": data} for data in ({}, {"topic": "home/hall"})]
+    events += [{"event_type": "MQTT_MESSAGE", "data": {"wildcard": "home/#"}}]
+    for namespace in ("default", "mqtt2", "global"):
+        for data in events:
+            assert dispatched_handles(ad, namespace, data) == scan_event_callbacks(ad, namespace, data)
+
+    for handle in handles:
+        asyncio.run(ad.events.cancel_event_callback("app", handle))
+    assert ad.callbacks.topic_index == {}
+    assert ad.callbacks.event_index == {}
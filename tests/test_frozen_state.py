@@ -0,0 +1,70 @@
+import copy
+import json
+import pickle
+
+import pytest
+import yaml
+
+from appdaemon import utils
+
+
+def frozen_state():
+    return utils.freeze({"state": "on", "attributes": {"brightness": 200, "rgb": [1, 2, 3], "extra": {"a": 1}}})
+
+
+def test_frozen_state_is_read_only():
+    state = frozen_state()
+    with pytest.raises(TypeError):
+        state["state"] = "off"
+    with pytest.raises(TypeError):
+        state["attributes"]["rgb"].append(4)
+
+
+@pytest.mark.parametrize(
+    "convert",
+    [
+        lambda state: state,
+        lambda state: dict(state),
+        lambda state: {**state},
+        lambda state: dict(state.items()),
+        lambda state: (lambda **kwargs: kwargs)(**state),
+        lambda state: copy.copy(state),
+        lambda state: copy.deepcopy(state),
+        lambda state: state.copy(),
+    ],
+)
+def test_thawed_state_can_be_modified(convert):
+    frozen = frozen_state()
+    state = convert(utils.thaw(frozen))
+
+    state["state"] = "off"
+    state["attributes"]["brightness"] = 100
+    state["attributes"]["rgb"].append(4)
+    state["attributes"]["extra"]["b"] = 2
+
+    assert state["attributes"] == {"brightness": 100, "rgb": [1, 2, 3, 4], "extra": {"a": 1, "b": 2}}
+    # The snapshot it came from is untouched
+    assert frozen == frozen_state()
+
+
+def test_thawed_values_can_be_modified():
+    for value in utils.thaw(frozen_state()).values():
+        if isinstance(value, dict):
+            value["new"] = True
+
+
+def test_thawed_state_only_copies_what_is_read():
+    frozen = frozen_state()
+    state = utils.thaw(frozen)
+    assert dict.__getitem__(state, "attributes") is frozen["attributes"]
+
+    state["attributes"]
+    assert dict.__getitem__(state, "attributes") is not frozen["attributes"]
+
+
+def test_state_serializes_like_a_dict():
+    expected = {"state": "on", "attributes": {"brightness": 200, "rgb": [1, 2, 3], "extra": {"a": 1}}}
+    for state in (frozen_state(), utils.thaw(frozen_state())):
+        assert json.loads(json.dumps(state)) == expected
+        assert yaml.safe_load(yaml.safe_dump(state)) == expected
+        assert pickle.loads(pickle.dumps(state)) == expected
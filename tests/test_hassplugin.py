@@ -0,0 +1,199 @@
+import asyncio
+import logging
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from appdaemon.plugins.hass.hassplugin import HassPlugin
+
+TOKEN = "secret"
+
+CONFIG = {"latitude": 51.5, "longitude": 0.1, "elevation": 10, "time_zone": "Europe/London", "state": "RUNNING"}
+
+STATES = [
+    {"entity_id": "light.kitchen", "state": "off", "attributes": {}},
+    {"entity_id": "sensor.temperature", "state": "20", "attributes": {"unit_of_measurement": "C"}},
+]
+
+
+def state_changed(entity_id, state):
+    return {"event_type": "state_changed", "data": {"entity_id": entity_id, "new_state": {"state": state}}}
+
+
+class FakeHA:
+    """
+    Stands in for Home Assistant: serves the REST API the plugin reads at startup, and on each websocket connection
+    goes through auth and subscribe_events, then sends the events of that connection and answers commands
+    """
+
+    def __init__(self, events):
+        self.events = events
+        self.connections = 0
+        self.subscriptions = []
+        self.commands = []
+        self.sockets = []
+
+        self.app = web.Application()
+        self.app.router.add_get("/api/config", self.rest(CONFIG))
+        self.app.router.add_get("/api/services", self.rest([{"domain": "light", "services": ["turn_on"]}]))
+        self.app.router.add_get("/api/states", self.rest(STATES))
+        self.app.router.add_get("/api/websocket", self.websocket)
+
+    def rest(self, data):
+        async def handler(request):
+            assert request.headers["Authorization"] == "Bearer {}".format(TOKEN)
+            return web.json_response(data)
+
+        return handler
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.sockets.append(ws)
+        connection = self.connections
+        self.connections += 1
+
+        await ws.send_json({"type": "auth_required", "ha_version": "0.110.0"})
+        auth = await ws.receive_json()
+        if auth != {"type": "auth", "access_token": TOKEN}:
+            await ws.send_json({"type": "auth_invalid", "message": "Invalid access token"})
+            await ws.close()
+            return ws
+        await ws.send_json({"type": "auth_ok", "ha_version": "0.110.0"})
+
+        subscribe = await ws.receive_json()
+        self.subscriptions.append(subscribe)
+        _id = subscribe["id"]
+        await ws.send_json({"id": _id, "type": "result", "success": True, "result": None})
+
+        # Sent straight away, so they arrive while the plugin is still starting up
+        for event in self.events[connection]:
+            await ws.send_json({"id": _id, "type": "event", "event": event})
+
+        async for msg in ws:
+            command = msg.json()
+            self.commands.append(command)
+            if command["type"] == "get_states":
+                await ws.send_json({"id": command["id"], "type": "result", "success": True, "result": STATES})
+            elif command["type"] == "call_service":
+                await ws.send_json({"id": command["id"], "type": "result", "success": True, "result": {}})
+            else:
+                await ws.send_json(
+                    {
+                        "id": command["id"],
+                        "type": "result",
+                        "success": False,
+                        "error": {"code": "unknown_command", "message": "Unknown command."},
+                    }
+                )
+
+        return ws
+
+
+class FakeLogging:
+    def get_child(self, name):
+        return logging.getLogger("AppDaemon.{}".format(name))
+
+
+class FakeServices:
+    def __init__(self):
+        self.registered = []
+
+    def register_service(self, namespace, domain, service, callback, **kwargs):
+        self.registered.append((namespace, domain, service))
+
+
+class FakeEvents:
+    def __init__(self):
+        self.processed = []
+
+    async def add_event_callback(self, name, namespace, cb, event, **kwargs):
+        pass
+
+    async def process_event(self, namespace, data):
+        self.processed.append((namespace, data))
+
+
+class FakePlugins:
+    def __init__(self):
+        self.notifications = []
+
+    async def notify_plugin_started(self, name, namespace, meta, state, first_time):
+        self.notifications.append(("started", first_time, state))
+
+    async def notify_plugin_stopped(self, name, namespace):
+        self.notifications.append(("stopped",))
+
+
+class FakeCallbacks:
+    async def clear_callbacks(self, name):
+        pass
+
+
+class FakeAD:
+    def __init__(self, loop):
+        self.loop = loop
+        self.logging = FakeLogging()
+        self.services = FakeServices()
+        self.events = FakeEvents()
+        self.plugins = FakePlugins()
+        self.callbacks = FakeCallbacks()
+
+
+async def wait_for(condition, timeout=10):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+def test_websocket_session():
+    events = [
+        [state_changed("light.kitchen", "on"), state_changed("light.kitchen", "off"), {"event_type": "ping"}],
+        [state_changed("sensor.temperature", "21")],
+    ]
+
+    async def scenario():
+        ha = FakeHA(events)
+        server = TestServer(ha.app)
+        await server.start_server()
+
+        ad = FakeAD(asyncio.get_running_loop())
+        url = str(server.make_url("")).rstrip("/")
+        plugin = HassPlugin(ad, "HASS", {"ha_url": url, "token": TOKEN, "retry_secs": 0, "ws_commands": True})
+        updates = asyncio.ensure_future(plugin.get_updates())
+        try:
+            # The events of the first connection are all processed, in order, once the plugin has started
+            await wait_for(lambda: len(ad.events.processed) == 3)
+            assert ad.events.processed == [("default", event) for event in events[0]]
+            assert ad.plugins.notifications == [("started", True, {state["entity_id"]: state for state in STATES})]
+            assert ("default", "light", "turn_on") in ad.services.registered
+
+            # Commands go over the websocket, with their results matched up by id
+            assert await plugin.ws_command({"type": "get_states"}) == STATES
+            assert await plugin.call_plugin_service("default", "light", "turn_on", "light.kitchen") == {}
+            assert [command["type"] for command in ha.commands] == ["get_states", "call_service"]
+            assert ha.commands[1]["service_data"] == {"entity_id": "light.kitchen"}
+
+            # Home Assistant going away stops the plugin, and it reconnects and starts again
+            await ha.sockets[0].close()
+            await wait_for(lambda: len(ad.events.processed) == 4)
+            assert ad.events.processed[3] == ("default", events[1][0])
+            assert [notification[:2] for notification in ad.plugins.notifications] == [
+                ("started", True),
+                ("stopped",),
+                ("started", False),
+            ]
+            assert ha.connections == 2
+            assert ha.subscriptions == [{"id": 1, "type": "subscribe_events"}, {"id": 1, "type": "subscribe_events"}]
+            assert plugin.ws_connected()
+        finally:
+            plugin.stop()
+            await asyncio.wait_for(updates, 10)
+            await plugin.session.close()
+            await server.close()
+
+        assert not plugin.ws_connected()
+
+    asyncio.run(scenario())
@@ -0,0 +1,124 @@
+import os
+
+from appdaemon import utils
+
+
+def journal(tmp_path):
+    return str(tmp_path / "namespace.journal")
+
+
+def test_journal_is_replayed(tmp_path):
+    filename = journal(tmp_path)
+    data = utils.PersistentDict(filename, True)
+    data["light.kitchen"] = {"state": "on"}
+    data["light.hall"] = {"state": "off"}
+    data["light.kitchen"] = {"state": "off"}
+    data.update({"sensor.temperature": {"state": "20"}, "sensor.humidity": {"state": "50"}})
+    del data["light.hall"]
+    data.pop("sensor.humidity")
+    data.close()
+
+    assert utils.PersistentDict(filename, True) == {
+        "light.kitchen": {"state": "off"},
+        "sensor.temperature": {"state": "20"},
+    }
+
+
+def test_unsafe_changes_are_written_on_sync(tmp_path):
+    filename = journal(tmp_path)
+    data = utils.PersistentDict(filename, False)
+    data["light.kitchen"] = {"state": "on"}
+    assert utils.PersistentDict(filename, False) == {}
+
+    data.sync()
+    assert utils.PersistentDict(filename, False) == {"light.kitchen": {"state": "on"}}
+
+
+def test_appended_records_are_fsynced(tmp_path, monkeypatch):
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: synced.append(fd) or fsync(fd))
+
+    data = utils.PersistentDict(journal(tmp_path), False)
+    data["light.kitchen"] = {"state": "on"}
+    data["light.hall"] = {"state": "on"}
+    assert synced == []
+
+    # One fsync for all the records written together
+    data.sync()
+    assert synced == [data.file.fileno()]
+
+    # Nothing to write, nothing to sync
+    data.sync()
+    assert len(synced) == 1
+
+
+def test_corrupt_tail_is_truncated(tmp_path):
+    filename = journal(tmp_path)
+    data = utils.PersistentDict(filename, True)
+    data["light.kitchen"] = {"state": "on"}
+    data["light.hall"] = {"state": "on"}
+    data.close()
+    good_size = os.path.getsize(filename)
+
+    data = utils.PersistentDict(filename, True)
+    data["light.kitchen"] = {"state": "off"}
+    data.close()
+
+    # Flip a byte of the last record, so its CRC no longer matches
+    with open(filename, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+
+    data = utils.PersistentDict(filename, True)
+    assert data == {"light.kitchen": {"state": "on"}, "light.hall": {"state": "on"}}
+    assert os.path.getsize(filename) == good_size
+
+    # New records follow on from the good ones
+    data["light.porch"] = {"state": "on"}
+    data.close()
+    assert utils.PersistentDict(filename, True) == {
+        "light.kitchen": {"state": "on"},
+        "light.hall": {"state": "on"},
+        "light.porch": {"state": "on"},
+    }
+
+
+def test_partial_record_is_truncated(tmp_path):
+    filename = journal(tmp_path)
+    data = utils.PersistentDict(filename, True)
+    data["light.kitchen"] = {"state": "on"}
+    data.close()
+    good_size = os.path.getsize(filename)
+
+    # A write interrupted part way through a record
+    record = data.encode("light.kitchen")
+    with open(filename, "ab") as f:
+        f.write(record[: len(record) // 2])
+
+    assert utils.PersistentDict(filename, True) == {"light.kitchen": {"state": "on"}}
+    assert os.path.getsize(filename) == good_size
+
+
+def test_journal_is_compacted(tmp_path):
+    filename = journal(tmp_path)
+    data = utils.PersistentDict(filename, True)
+    data.compact_min_records = 50
+    for i in range(10):
+        data["sensor.{}".format(i)] = {"state": 0}
+    for n in range(1, 100):
+        data["sensor.{}".format(n % 10)] = {"state": n}
+
+    # Each compaction leaves only the live entries, so the journal never grows far past the minimum
+    assert data.records <= data.compact_min_records
+    sizes = {len(data.encode(key)) for key in data}
+    assert os.path.getsize(filename) <= data.compact_min_records * max(sizes)
+    assert not os.path.exists("{}.tmp".format(filename))
+
+    expected = dict(data)
+    data["sensor.0"] = {"state": "after compaction"}
+    expected["sensor.0"] = {"state": "after compaction"}
+    data.close()
+    assert utils.PersistentDict(filename, True) == expected
@@ -0,0 +1,216 @@
+import asyncio
+import datetime
+import logging
+import random
+
+import pytest
+import pytz
+
+from appdaemon.scheduler import Scheduler
+
+
+class FakeLogging:
+    def get_child(self, name):
+        return logging.getLogger("AppDaemon.{}".format(name))
+
+    def get_error(self):
+        return logging.getLogger("Error")
+
+    def get_diag(self):
+        return logging.getLogger("Diag")
+
+    def set_tz(self, tz):
+        pass
+
+
+class FakeAppManagement:
+    def __init__(self):
+        self.objects = {}
+
+    def add(self, name):
+        self.objects[name] = {"id": name, "pin_app": True, "pin_thread": None}
+
+
+class FakeState:
+    async def add_entity(self, namespace, entity_id, state, attributes=None):
+        pass
+
+    async def set_state(self, name, namespace, entity_id, **kwargs):
+        pass
+
+    async def remove_entity(self, namespace, entity_id):
+        pass
+
+
+class FakeThreading:
+    def __init__(self):
+        self.dispatched = []
+
+    async def dispatch_worker(self, name, args):
+        self.dispatched.append(args["id"])
+        return True
+
+
+class FakeAD:
+    def __init__(self):
+        self.logging = FakeLogging()
+        self.app_management = FakeAppManagement()
+        self.state = FakeState()
+        self.threading = FakeThreading()
+        self.time_zone = "Europe/London"
+        self.latitude = 51.5
+        self.longitude = -0.1
+        self.elevation = 10
+        self.starttime = None
+        self.endtime = None
+        self.timewarp = 1
+
+
+def callback(kwargs):
+    pass
+
+
+def make_scheduler(apps=("app",)):
+    ad = FakeAD()
+    for name in apps:
+        ad.app_management.add(name)
+    return Scheduler(ad)
+
+
+def fire_all(sched):
+    """Takes the entries off the schedule in the order the scheduler fires them, as lists of entries due together"""
+
+    fired = []
+    while True:
+        entries = sched.get_next_entries()
+        if len(entries) == 0:
+            return fired
+        fired.append(entries)
+        for entry in entries:
+            del sched.schedule[entry["name"]][entry["uuid"]]
+
+
+def test_entries_fire_in_time_order():
+    sched = make_scheduler(("app1", "app2"))
+    start = pytz.utc.localize(datetime.datetime(2020, 1, 1))
+    rng = random.Random(1)
+
+    async def insert():
+        timers = {}
+        for i in range(2000):
+            name = rng.choice(("app1", "app2"))
+            # Few distinct times, so plenty of entries are due together
+            when = start + datetime.timedelta(seconds=rng.randrange(200))
+            handle = await sched.insert_schedule(name, when, callback, False, None)
+            timers[handle] = (name, when)
+        return timers
+
+    timers = asyncio.run(insert())
+
+    fired = fire_all(sched)
+    assert sorted(entry["uuid"] for entries in fired for entry in entries) == sorted(timers)
+
+    times = [entries[0]["timestamp"] for entries in fired]
+    assert times == sorted(set(when for _, when in timers.values()))
+    for entries in fired:
+        for entry in entries:
+            assert timers[entry["uuid"]] == (entry["name"], entry["timestamp"])
+
+
+def test_next_entries_are_left_on_the_heap():
+    sched = make_scheduler()
+    when = pytz.utc.localize(datetime.datetime(2020, 1, 1))
+    handle = asyncio.run(sched.insert_schedule("app", when, callback, False, None))
+
+    # Until an entry is fired and removed, it stays the next one due
+    assert sched.get_next_entries() == [{"name": "app", "uuid": handle, "timestamp": when}]
+    assert sched.get_next_entries() == [{"name": "app", "uuid": handle, "timestamp": when}]
+
+
+def test_cancelled_and_moved_entries_are_skipped():
+    sched = make_scheduler()
+    start = pytz.utc.localize(datetime.datetime(2020, 1, 1))
+
+    async def insert():
+        return [
+            await sched.insert_schedule("app", start + datetime.timedelta(seconds=i), callback, False, None)
+            for i in range(100)
+        ]
+
+    handles = asyncio.run(insert())
+
+    cancelled = set(handles[::2])
+    for handle in cancelled:
+        asyncio.run(sched.cancel_timer("app", handle))
+
+    # A repeating entry moving on leaves its old heap entry behind, like exec_schedule() does
+    moved = handles[1]
+    sched.schedule["app"][moved]["timestamp"] = start + datetime.timedelta(seconds=1000)
+    sched.push_timer("app", moved, sched.schedule["app"][moved]["timestamp"])
+
+    # Stale entries stay in the heap until they reach the top
+    assert len(sched.timer_heap) == 101
+
+    fired = [entries[0]["uuid"] for entries in fire_all(sched)]
+    expected = [handle for handle in handles if handle not in cancelled and handle != moved] + [moved]
+    assert fired == expected
+    assert sched.timer_heap == []
+
+
+def test_heap_is_compacted_when_mostly_cancelled():
+    sched = make_scheduler()
+    start = pytz.utc.localize(datetime.datetime(2020, 1, 1))
+
+    async def insert_and_cancel():
+        handles = [
+            await sched.insert_schedule("app", start + datetime.timedelta(seconds=i), callback, False, None)
+            for i in range(5000)
+        ]
+        for handle in handles[:4500]:
+            await sched.cancel_timer("app", handle)
+        return handles
+
+    handles = asyncio.run(insert_and_cancel())
+
+    assert len(sched.timer_heap) <= 2 * 500 + 1024
+    assert [entries[0]["uuid"] for entries in fire_all(sched)] == handles[4500:]
+
+
+def test_repeating_timer_needs_an_interval():
+    sched = make_scheduler()
+    when = pytz.utc.localize(datetime.datetime(2020, 1, 1))
+
+    for interval in (0, -1):
+        with pytest.raises(ValueError):
+            asyncio.run(sched.insert_schedule("app", when, callback, True, None, interval=interval))
+    assert sched.schedule == {}
+
+
+def test_timer_due_again_does_not_hold_up_the_loop():
+    sched = make_scheduler()
+    dispatched = sched.AD.threading.dispatched
+
+    async def scenario():
+        sched.AD.loop = asyncio.get_running_loop()
+        sched.wakeup = asyncio.Event()
+        now = pytz.utc.localize(datetime.datetime.utcnow())
+        handle = await sched.insert_schedule(
+            "app", now - datetime.timedelta(seconds=1), callback, True, None, interval=60
+        )
+        # A timer that is due again straight away, as one with no interval would be
+        sched.schedule["app"][handle]["interval"] = 0
+
+        loop = asyncio.ensure_future(sched.realtime_loop())
+        counts = []
+        while len(dispatched) < 5 and len(counts) < 1000:
+            await asyncio.sleep(0)
+            counts.append(len(dispatched))
+        sched.stop()
+        await asyncio.wait_for(loop, 5)
+        return handle, counts
+
+    handle, counts = asyncio.run(scenario())
+    # The timer keeps firing, but only once each time the loop comes round
+    assert len(dispatched) >= 5
+    assert set(dispatched) == {handle}
+    assert all(after - before <= 1 for before, after in zip(counts, counts[1:]))
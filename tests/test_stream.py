@@ -0,0 +1,179 @@
+import asyncio
+import copy
+import json
+import logging
+
+from appdaemon.stream.adstream import ADStream
+
+
+class FakeLogging:
+    def get_child(self, name):
+        return logging.getLogger("AppDaemon.{}".format(name))
+
+    def get_access(self):
+        return logging.getLogger("AppDaemon.access")
+
+
+class FakeHTTP:
+    password = None
+    stream_queue_size = 0
+    stream_max_lag = 0
+
+
+class FakeState:
+    def __init__(self, states):
+        self.states = states
+
+    def get_entity(self, namespace=None, entity_id=None, name=None):
+        if entity_id is not None:
+            return copy.deepcopy(self.states[namespace][entity_id])
+        if namespace is not None:
+            return copy.deepcopy(self.states[namespace])
+        return copy.deepcopy(self.states)
+
+
+class FakeEvents:
+    async def process_event(self, namespace, data):
+        pass
+
+
+class FakeAD:
+    def __init__(self, states):
+        self.logging = FakeLogging()
+        self.http = FakeHTTP()
+        self.state = FakeState(states)
+        self.events = FakeEvents()
+
+
+class FakeStream:
+    """Records what is sent to the client, giving way to other tasks on each send like a real connection"""
+
+    def __init__(self):
+        self.sent = []
+        self.on_partial = None
+
+    async def run(self):
+        pass
+
+    def set_client_name(self, client_name):
+        pass
+
+    async def sendclient(self, data):
+        await asyncio.sleep(0)
+        self.sent.append(json.loads(json.dumps(data)))
+        if data.get("response_partial") is True and self.on_partial is not None:
+            on_partial, self.on_partial = self.on_partial, None
+            await on_partial()
+
+    async def sendencoded(self, msg):
+        await asyncio.sleep(0)
+        self.sent.append(json.loads(msg))
+
+
+class FakeStreamHandler:
+    def __init__(self):
+        self.stream = FakeStream()
+
+    def makeStream(self, ad, request, **kwargs):
+        return self.stream
+
+
+def light(state, brightness):
+    return {"entity_id": "light.a", "state": state, "attributes": {"brightness": brightness}}
+
+
+def make_stream(states):
+    adstream = ADStream(FakeAD(states), None, "test")
+    adstream.stream_handler = FakeStreamHandler()
+    return adstream
+
+
+async def connect(adstream, deltas):
+    await adstream.on_connect(None)
+    handler = next(iter(adstream.handlers.values()))
+    await handler._request(
+        {"request_type": "hello", "request_id": 1, "data": {"client_name": "test", "deltas": deltas}}
+    )
+    await handler._request(
+        {"request_type": "listen_state", "request_id": 2, "data": {"namespace": "default", "entity_id": "light.*"}}
+    )
+    return handler
+
+
+async def change_state(adstream, new_state):
+    states = adstream.AD.state.states["default"]
+    data = {"entity_id": new_state["entity_id"], "old_state": states[new_state["entity_id"]], "new_state": new_state}
+    states[new_state["entity_id"]] = new_state
+    await adstream.process_event({"namespace": "default", "event_type": "state_changed", "data": data})
+
+
+def replay(sent):
+    """Applies what the client was sent in order, the way a client would, and returns the states it ends up with"""
+
+    states = {}
+    for response in sent:
+        if response["response_type"] in ("get_state", "resync"):
+            states.update(copy.deepcopy(response["data"]))
+        elif response["response_type"] == "state_changed":
+            data = response["data"]["data"]
+            if "new_state" in data:
+                states[data["entity_id"]] = copy.deepcopy(data["new_state"])
+            else:
+                state = states[data["entity_id"]]
+                state.update(data["delta"].get("changed", {}))
+                state["attributes"].update(data["delta"].get("changed_attributes", {}))
+    return states
+
+
+def summarize(sent):
+    summary = []
+    for response in sent:
+        if response["response_type"] == "state_changed":
+            summary.append("state_changed")
+        elif response.get("response_partial") is True:
+            summary.append("partial")
+        else:
+            summary.append(response["response_type"])
+    return summary
+
+
+def run_interleaved(request_type, deltas):
+    async def scenario():
+        states = {"default": {"light.a": light("off", 0), "light.b": light("off", 0), "light.c": light("off", 0)}}
+        adstream = make_stream(states)
+        handler = await connect(adstream, deltas)
+        stream = adstream.stream_handler.stream
+        stream.sent.clear()
+
+        # One change is queued before the request, and another arrives while the reply is being sent
+        await change_state(adstream, light("on", 100))
+
+        async def change_during_reply():
+            await change_state(adstream, light("on", 200))
+
+        stream.on_partial = change_during_reply
+        await handler._request(
+            {"request_type": request_type, "request_id": 3, "data": {"namespace": "default", "chunk_size": 1}}
+        )
+        await asyncio.sleep(0.01)
+        handler._stop_sending()
+
+        return stream.sent, states["default"]
+
+    return asyncio.run(scenario())
+
+
+def test_chunked_state_is_sent_in_order_with_events():
+    sent, states = run_interleaved("get_state", False)
+
+    assert summarize(sent) == ["state_changed", "partial", "partial", "get_state", "state_changed"]
+    assert replay(sent) == states
+
+
+def test_resync_is_sent_in_order_with_deltas():
+    sent, states = run_interleaved("resync", True)
+
+    assert summarize(sent) == ["state_changed", "partial", "partial", "resync", "state_changed"]
+    # The change after the resync is sent in full, as the resync dropped the states deltas were relative to
+    assert "new_state" in sent[-1]["data"]["data"]
+    assert replay(sent) == states
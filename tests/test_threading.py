@@ -0,0 +1,118 @@
+import asyncio
+import datetime
+import itertools
+import logging
+
+import pytz
+
+from appdaemon.callbacks import Callbacks
+from appdaemon.threading import Threading
+
+
+class FakeLogging:
+    def get_child(self, name):
+        return logging.getLogger("AppDaemon.{}".format(name))
+
+    def get_diag(self):
+        return logging.getLogger("Diag")
+
+
+class FakeSched:
+    """Keeps the handles of the live timers, and gives way to other tasks while adding one, like the real one"""
+
+    def __init__(self):
+        self.handles = itertools.count()
+        self.timers = set()
+
+    async def get_now(self):
+        return pytz.utc.localize(datetime.datetime.utcnow())
+
+    async def insert_schedule(self, name, aware_dt, callback, repeat, type_, **kwargs):
+        await asyncio.sleep(0)
+        handle = next(self.handles)
+        self.timers.add(handle)
+        return handle
+
+    async def cancel_timer(self, name, handle):
+        self.timers.discard(handle)
+
+
+class FakeAD:
+    def __init__(self):
+        self.logging = FakeLogging()
+        self.sched = FakeSched()
+        self.callbacks = Callbacks(self)
+
+
+class FakeThreading:
+    """Just enough of Threading for check_and_dispatch_state()"""
+
+    def __init__(self, ad):
+        self.AD = ad
+
+    async def dispatch_worker(self, name, args):
+        return True
+
+
+def callback(entity, attribute, old, new, kwargs):
+    pass
+
+
+def test_duration_timer_is_replaced_under_the_lock():
+    ad = FakeAD()
+    threading = FakeThreading(ad)
+    kwargs = {"duration": 60}
+    ad.callbacks.callbacks["app"] = {"handle": {"name": "app", "type": "state", "kwargs": kwargs}}
+
+    def change(old, new):
+        return Threading.check_and_dispatch_state(
+            threading,
+            "app",
+            callback,
+            "light.kitchen",
+            "state",
+            {"state": new},
+            {"state": old},
+            None,
+            None,
+            kwargs,
+            "handle",
+            True,
+            None,
+        )
+
+    async def scenario():
+        # Two changes of the entity being processed at the same time
+        await asyncio.gather(change("off", "on"), change("on", "off"))
+
+    asyncio.run(scenario())
+
+    # Only the timer of the last change is left, the other one was cancelled rather than lost track of
+    assert ad.sched.timers == {kwargs["__duration"]}
+
+
+def test_no_duration_timer_for_a_cancelled_callback():
+    ad = FakeAD()
+    threading = FakeThreading(ad)
+    kwargs = {"duration": 60}
+
+    asyncio.run(
+        Threading.check_and_dispatch_state(
+            threading,
+            "app",
+            callback,
+            "light.kitchen",
+            "state",
+            {"state": "on"},
+            {"state": "off"},
+            None,
+            None,
+            kwargs,
+            "handle",
+            True,
+            None,
+        )
+    )
+
+    assert ad.sched.timers == set()
+    assert "__duration" not in kwargs